@@ -0,0 +1,132 @@
+"""
+Benchmark and regression check for the LoRA compaction stage (src/compaction.py)
+on synthetic safetensors files, CPU only.
+
+Generates a LoRA shaped like the default preset (rank 512 on four
+15360 -> 3072 projections, float32) whose layer updates have a low effective
+rank plus noise, with some untrained all-zero layers, then compacts it with
+each configuration and reports size, error and time as JSON:
+
+    python benchmarks/bench_compact.py
+    python benchmarks/bench_compact.py --rank 64 --layers 16 --in-features 3072
+
+Exits with status 1 when a configuration exceeds its error bound, drops the
+wrong layers or writes a file that does not read back.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+
+
+def make_lora(path, layers, zero_layers, rank, in_features, out_features, effective_rank, noise, alpha):
+    import numpy as np
+    from compaction import write_safetensors
+    rng = np.random.default_rng(0)
+    tensors = {}
+    for index in range(layers):
+        prefix = f"transformer.single_transformer_blocks.{index}.proj_out"
+        down = rng.standard_normal((rank, in_features), dtype=np.float32) / np.sqrt(in_features)
+        # Most of each update lives in the first effective_rank directions
+        weights = np.where(np.arange(rank) < effective_rank, 1.0, noise).astype(np.float32)
+        up = rng.standard_normal((out_features, rank), dtype=np.float32) * weights * 1e-2
+        if index >= layers - zero_layers:
+            up[:] = 0.0  # lora_B starts at zero and an untrained layer stays there
+        tensors[f"{prefix}.lora_A.weight"] = down
+        tensors[f"{prefix}.lora_B.weight"] = up
+        if alpha:
+            tensors[f"{prefix}.alpha"] = np.array(alpha, dtype=np.float32)
+    write_safetensors(path, tensors, {"format": "pt", "ss_network_dim": str(rank)})
+
+
+def check_readback(path, report):
+    """
+    Re-reads the output, with the safetensors package when it is installed.
+    """
+    from compaction import find_layers, read_safetensors
+    tensors, _ = read_safetensors(path)
+    try:
+        from safetensors.numpy import load_file
+        if report["dtype"] not in ("bf16", "bfloat16"):  # numpy has no bfloat16
+            reference = load_file(path)
+            assert sorted(reference) == sorted(tensors), "tensor names differ from the safetensors reader"
+    except ImportError:
+        pass
+    layers = find_layers(tensors)
+    assert len(layers) == report["layers"] - report["dropped"], f"{len(layers)} layers read back"
+    return max((tensors[down].shape[0] for down, _, _ in layers.values()), default=None)
+
+
+def run_benchmark(args):
+    sys.path.insert(0, SRC_DIR)
+    from compaction import CompactionSettings, compact_lora
+
+    workdir = tempfile.mkdtemp(prefix="bench_compact_")
+    source = os.path.join(workdir, "lora.safetensors")
+    make_lora(
+        source, args.layers, args.zero_layers, args.rank, args.in_features, args.out_features,
+        args.effective_rank, args.noise, args.alpha
+    )
+    # (name, settings, maximum relative error, expected rank after)
+    configurations = [
+        ("float16", CompactionSettings(dtype="float16"), 1e-3, args.rank),
+        ("bf16", CompactionSettings(dtype="bf16"), 1e-2, args.rank),
+        (f"float16 rank {args.effective_rank}", CompactionSettings(dtype="float16", rank=args.effective_rank), args.max_resize_error, args.effective_rank),
+        ("float16 energy 0.99", CompactionSettings(dtype="float16", energy=0.99), args.max_resize_error, None),
+    ]
+    results = {"source_bytes": os.path.getsize(source), "configurations": {}}
+    failures = []
+    try:
+        for name, settings, max_error, expected_rank in configurations:
+            output = os.path.join(workdir, "compacted.safetensors")
+            report = compact_lora(source, output, settings)
+            report["rank_read_back"] = check_readback(output, report)
+            results["configurations"][name] = report
+            if report["relative_error"] > max_error:
+                failures.append(f"{name}: relative error {report['relative_error']:.2e} > {max_error:.0e}")
+            if report["dropped"] != args.zero_layers:
+                failures.append(f"{name}: dropped {report['dropped']} layers, expected {args.zero_layers}")
+            if expected_rank is not None and report["rank_read_back"] != expected_rank:
+                failures.append(f"{name}: rank {report['rank_read_back']}, expected {expected_rank}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    results["failures"] = failures
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--zero-layers", type=int, default=1, help="layers left at zero, which should be dropped")
+    parser.add_argument("--rank", type=int, default=512)
+    parser.add_argument("--in-features", type=int, default=15360)
+    parser.add_argument("--out-features", type=int, default=3072)
+    parser.add_argument("--effective-rank", type=int, default=32, help="directions carrying most of each update")
+    parser.add_argument("--noise", type=float, default=0.01, help="relative weight of the remaining directions")
+    parser.add_argument("--alpha", type=float, default=0.0, help="write alpha tensors with this value (0: none)")
+    parser.add_argument("--max-resize-error", type=float, default=0.2)
+    parser.add_argument("--output", help="write JSON results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmark(args)
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    if results["failures"]:
+        for failure in results["failures"]:
+            print(f"FAIL {failure}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
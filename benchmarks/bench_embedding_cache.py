@@ -0,0 +1,173 @@
+"""
+Benchmark and regression check for the text-embedding cache
+(src/embedding_cache.py) with a small CPU text encoder.
+
+The warm worker routes ai-toolkit's encode_prompt through
+EmbeddingCache.cached(); this stands in for T5/CLIP with a byte-level
+EmbeddingBag, encodes a set of captions plus the fixed sample prompt cold,
+again from the same cache (memory hits) and from a fresh cache on the same
+folder (disk hits), and reports per-call times as JSON:
+
+    python benchmarks/bench_embedding_cache.py
+    python benchmarks/bench_embedding_cache.py --prompts 500 --dim 4096
+
+Exits with status 1 when a cached embedding differs from a fresh encode, a
+prompt is encoded more than once, dropout calls are cached, two encoder ids
+share entries, the cache outgrows max_bytes, or a concurrently pruned file
+fails a lookup. Needs torch.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+SAMPLE_PROMPT = "a man holding a sign that says, 'this is a sign'"
+
+
+class CountingEncoder:
+    """
+    Byte-level EmbeddingBag text encoder that counts its calls.
+    """
+
+    def __init__(self, dim, delay):
+        import torch
+        torch.manual_seed(0)
+        self.model = torch.nn.EmbeddingBag(256, dim, mode="mean").eval()
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self, prompt, dropout_prob=0.0):
+        import torch
+        self.calls += 1
+        time.sleep(self.delay)  # what a real encoder costs beyond this toy
+        tokens = torch.tensor([list(prompt.encode())], dtype=torch.long)
+        with torch.no_grad():
+            embedding = self.model(tokens)
+        if dropout_prob:
+            embedding = embedding * (torch.rand(()) > dropout_prob)
+        return embedding
+
+
+def timed_pass(encode, prompts):
+    start = time.perf_counter()
+    outputs = [encode(prompt) for prompt in prompts]
+    return outputs, (time.perf_counter() - start) / len(prompts)
+
+
+def run_benchmark(args):
+    sys.path.insert(0, SRC_DIR)
+    import torch
+    from embedding_cache import EmbeddingCache
+
+    workdir = tempfile.mkdtemp(prefix="bench_embedding_cache_")
+    prompts = [f"[trigger], photo {index} of a person, studio light" for index in range(args.prompts)] + [SAMPLE_PROMPT]
+    failures = []
+    try:
+        encoder = CountingEncoder(args.dim, args.delay)
+        cache = EmbeddingCache(cache_dir=os.path.join(workdir, "cache"))
+        encode = cache.cached("encoder-a", encoder)
+
+        fresh, uncached_seconds = timed_pass(encoder, prompts)
+        encoder.calls = 0
+        cold, cold_seconds = timed_pass(encode, prompts)
+        memory, memory_seconds = timed_pass(encode, prompts)
+        disk_cache = EmbeddingCache(cache_dir=cache.cache_dir)
+        disk, disk_seconds = timed_pass(disk_cache.cached("encoder-a", encoder), prompts)
+
+        if encoder.calls != len(prompts):
+            failures.append(f"{encoder.calls} encoder calls for {len(prompts)} prompts over three passes")
+        for name, outputs in (("cold", cold), ("memory", memory), ("disk", disk)):
+            if not all(torch.equal(a, b) for a, b in zip(fresh, outputs)):
+                failures.append(f"{name} pass returned embeddings that differ from a fresh encode")
+
+        # Caption dropout makes the output random, so such calls bypass the cache
+        dropout = cache.cached("encoder-a", encoder, uncacheable=lambda p, a, kw: bool(kw.get("dropout_prob")))
+        calls = encoder.calls
+        dropout(prompts[0], dropout_prob=0.5)
+        dropout(prompts[0], dropout_prob=0.5)
+        if encoder.calls != calls + 2:
+            failures.append("calls with dropout_prob were served from the cache")
+
+        # Another encoder (quantized, another dtype) must not reuse these entries
+        calls = encoder.calls
+        cache.cached("encoder-b", encoder)(prompts[0])
+        if encoder.calls != calls + 1:
+            failures.append("a different encoder id was served another encoder's embedding")
+
+        # The size limit holds for writes through cached(), not only explicit prunes
+        entry_bytes = os.path.getsize(cache.path("encoder-a", cache.key(prompts[0])))
+        bounded = EmbeddingCache(cache_dir=os.path.join(workdir, "bounded"), max_bytes=entry_bytes * 4)
+        bounded_encode = bounded.cached("encoder-a", encoder)
+        for prompt in prompts:
+            bounded_encode(prompt)
+        bounded_bytes = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(bounded.cache_dir) for name in names
+        )
+        if bounded_bytes > bounded.max_bytes:
+            failures.append(f"bounded cache holds {bounded_bytes} bytes, max_bytes is {bounded.max_bytes}")
+
+        # Another worker may prune a file right after it was loaded
+        racing = EmbeddingCache(cache_dir=cache.cache_dir)
+        path = racing.path("encoder-a", racing.key(prompts[1]))
+        original_load = torch.load
+
+        def load_then_prune(*a, **kw):
+            value = original_load(*a, **kw)
+            os.remove(path)
+            return value
+
+        torch.load = load_then_prune
+        try:
+            if racing.get("encoder-a", racing.key(prompts[1])) is None:
+                failures.append("a lookup whose file was pruned after loading returned nothing")
+        except OSError as e:
+            failures.append(f"a lookup whose file was pruned after loading raised {e!r}")
+        finally:
+            torch.load = original_load
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "prompts": len(prompts),
+        "seconds_per_prompt": {
+            "uncached": uncached_seconds,
+            "cold": cold_seconds,
+            "memory_hit": memory_seconds,
+            "disk_hit": disk_seconds,
+        },
+        "bounded_bytes": bounded_bytes,
+        "failures": failures,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=64, help="distinct captions besides the sample prompt")
+    parser.add_argument("--dim", type=int, default=1024, help="embedding width")
+    parser.add_argument("--delay", type=float, default=0.002, help="extra seconds per encoder call")
+    parser.add_argument("--output", help="write JSON results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmark(args)
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    if results["failures"]:
+        for failure in results["failures"]:
+            print(f"FAIL {failure}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Cold-start import benchmark and regression check for the worker entry point.
+
+Imports the module (rp_handler by default) in fresh interpreters with
+python -X importtime, reports the median import time and the slowest modules,
+and fails when the import exceeds --budget or eagerly pulls in a module that
+must stay lazy (torch, boto3, yaml, ... see --forbid):
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --module main --forbid torch --budget 2
+    python benchmarks/bench_import.py --output imports.json
+
+Exits with status 1 on a regression so it can gate CI.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+
+# Imported by the prewarm thread or inside the jobs, never by the handler module itself
+DEFAULT_FORBIDDEN = "torch,boto3,botocore,yaml,requests,numpy,PIL,main"
+
+
+def parse_importtime(stderr):
+    """
+    Parses -X importtime output into {module: (self seconds, cumulative seconds)}.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        modules[name.strip()] = (int(self_us) / 1e6, int(cumulative_us) / 1e6)
+    return modules
+
+
+def measure(module):
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [SRC_DIR, os.environ.get("PYTHONPATH")]))}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_DIR,
+        env=env,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        # importtime lines come first; the traceback is the tail of stderr
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.splitlines()[-1]}")
+    return parse_importtime(result.stderr)
+
+
+def run_benchmark(args):
+    forbidden = [name for name in args.forbid.split(",") if name]
+    runs = [measure(args.module) for _ in range(args.repeat)]
+    totals = [run[args.module][1] for run in runs]
+    last = runs[-1]
+    slowest = sorted(last.items(), key=lambda item: -item[1][0])[:args.top]
+    eager = sorted(
+        name for name in forbidden
+        if any(imported == name or imported.startswith(name + ".") for imported in last)
+    )
+    return {
+        "module": args.module,
+        "seconds": statistics.median(totals),
+        "runs": totals,
+        "modules_imported": len(last),
+        "slowest": [{"module": name, "self": s, "cumulative": c} for name, (s, c) in slowest],
+        "eager_forbidden": eager,
+    }
+
+
+def check(results, budget):
+    failures = []
+    if budget is not None and results["seconds"] > budget:
+        failures.append(f"import took {results['seconds']:.3f}s, budget is {budget:.3f}s")
+    if results["eager_forbidden"]:
+        failures.append(f"eagerly imported: {', '.join(results['eager_forbidden'])}")
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="rp_handler", help="module to import")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters to time")
+    parser.add_argument("--budget", type=float, default=1.0, help="maximum median import time in seconds")
+    parser.add_argument("--forbid", default=DEFAULT_FORBIDDEN, help="comma separated modules that must not be imported")
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to report")
+    parser.add_argument("--output", help="write JSON results to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        results = run_benchmark(args)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    failures = check(results, args.budget)
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,351 @@
+"""
+End-to-end benchmark of the training job path (main.run_job, which
+rp_handler.train_handler calls) against local stand-ins:
+
+  * a threaded HTTP server serving generated JPEGs, with optional latency,
+  * a moto S3 server standing in for R2 (skipped with --no-upload, or when
+    moto is not installed),
+  * benchmarks/fake_run.py in place of ai-toolkit's run.py.
+
+Reports per-stage latency, peak RSS and bytes moved as JSON:
+
+    python benchmarks/bench_job.py --images 30 --image-size 2048 \
+        --steps 200 --checkpoint-mb 64 --output results.json
+    python benchmarks/bench_job.py ... --compare results.json
+    python benchmarks/bench_job.py --jobs 3 --vary-trigger
+
+fake_run.py names and loads latents like ai-toolkit, so the run exits with
+status 1 when a latent restored from the latent cache is not loaded by the
+trainer, or when a later job on the same images and trigger word encodes
+latents the first one stored.
+"""
+import os
+import io
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import functools
+import tempfile
+import resource
+import threading
+from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_images(count, size):
+    from PIL import Image
+    import numpy as np
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(count):
+        pixels = (rng.random((16, 16, 3)) * 255).astype("uint8")
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).resize((size, size * 3 // 4), Image.BICUBIC).save(buffer, format="JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def start_image_server(images, delay):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            index = int(self.path.strip("/").split(".")[0])
+            time.sleep(delay)
+            body = images[index]
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", free_port()), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_s3_server(bucket):
+    from moto.server import ThreadedMotoServer
+    import boto3
+    port = free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    endpoint = f"http://127.0.0.1:{port}"
+    credentials = {"access_key_id": "bench", "secret_access_key": "bench", "endpoint_url": endpoint}
+    boto3.client(
+        "s3", endpoint_url=endpoint, aws_access_key_id="bench", aws_secret_access_key="bench", region_name="us-east-1"
+    ).create_bucket(Bucket=bucket)
+    return server, credentials
+
+
+class StageTimer:
+    """
+    Times calls to module attributes by wrapping them in place.
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def wrap(self, owner, attribute, stage):
+        original = getattr(owner, attribute)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.seconds[stage] += time.perf_counter() - start
+                    self.calls[stage] += 1
+
+        setattr(owner, attribute, timed)
+
+
+def span_seconds(spans):
+    # Spans such as "upload" repeat once per checkpoint
+    totals = {}
+    for span in spans:
+        totals[span["name"]] = round(totals.get(span["name"], 0) + span["seconds"], 4)
+    return totals
+
+
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix="bench-job-")
+    marker_dir = os.path.join(workdir, "markers")
+    os.makedirs(marker_dir)
+    toolkit_dir = os.path.join(workdir, "ai-toolkit")
+    os.makedirs(toolkit_dir)
+    shutil.copy(os.path.join(BENCH_DIR, "fake_run.py"), os.path.join(toolkit_dir, "run.py"))
+
+    # Caches live in the work dir unless --cache-dir keeps them across runs
+    cache_root = args.cache_dir or os.path.join(workdir, "cache")
+    os.environ.update({
+        "IMAGE_CACHE_DIR": os.path.join(cache_root, "images"),
+        "LATENT_CACHE_DIR": os.path.join(cache_root, "latents"),
+        "EMBEDDING_CACHE_DIR": os.path.join(cache_root, "embeddings"),
+        "R2_INDEX_DIR": os.path.join(cache_root, "r2_index"),
+        "BENCH_STEP_DELAY": str(args.step_delay),
+        "BENCH_STARTUP_DELAY": str(args.startup_delay),
+        "BENCH_CHECKPOINT_BYTES": str(int(args.checkpoint_mb * 1024 * 1024)),
+        "BENCH_LOG_LINES": str(args.log_lines),
+        "BENCH_MARKER_DIR": marker_dir,
+        "CHECKPOINT_POLL_INTERVAL": "0.5",
+    })
+    os.chdir(workdir)
+    sys.path.insert(0, SRC_DIR)
+    import main
+    import train
+    from checkpoint_uploader import CheckpointUploader
+    from latent_cache import LatentCache
+    from workspace import WorkspaceManager
+
+    main.download_images = functools.partial(main.download_images, max_workers=args.concurrency)
+    timer = StageTimer()
+    timer.wrap(main, "download_images", "download")
+    timer.wrap(main, "preprocess_images", "preprocess")
+    timer.wrap(main, "deduplicate_images", "dedup")
+    timer.wrap(main, "fine_tune_function", "config_and_training")
+    timer.wrap(train, "run_streaming", "trainer_process")
+    spawn_calls = []
+    run_streaming = train.run_streaming
+
+    def record_spawn(*a, **kw):
+        spawn_calls.append(time.time())
+        return run_streaming(*a, **kw)
+
+    train.run_streaming = record_spawn
+    timer.wrap(CheckpointUploader, "finish", "upload_tail")
+    timer.wrap(LatentCache, "save", "latent_store")
+    timer.wrap(WorkspaceManager, "release", "cleanup")
+
+    images = make_images(args.images, args.image_size)
+    image_server = start_image_server(images, args.latency)
+    image_urls = [f"http://127.0.0.1:{image_server.server_address[1]}/{i}.jpg" for i in range(args.images)]
+
+    s3_server, credentials = None, {"access_key_id": "", "secret_access_key": "", "endpoint_url": ""}
+    if not args.no_upload:
+        try:
+            s3_server, credentials = start_s3_server("bench")
+        except ImportError:
+            print("moto/boto3 not installed, running without uploads", file=sys.stderr)
+
+    try:
+        from runpod.serverless.utils.rp_validator import validate
+        from rp_schemas import INPUT_SCHEMA
+    except ImportError:
+        validate = None
+
+    jobs = []
+    start = time.perf_counter()
+    for index in range(args.jobs):
+        job_input = {
+            "image_urls": image_urls,
+            "trigger_word": f"benchtok{index}" if args.vary_trigger else "benchtok",
+            "model_id": f"bench-{index}",
+            "steps": args.steps,
+            "r2_bucket_name": "bench",
+            "r2_access_key_id": credentials["access_key_id"],
+            "r2_secret_access_key": credentials["secret_access_key"],
+            "r2_endpoint_url": credentials["endpoint_url"],
+        }
+        validation_start = time.perf_counter()
+        if validate is not None:
+            job_input = validate(job_input, INPUT_SCHEMA)["validated_input"]
+        validation_seconds = time.perf_counter() - validation_start
+        job_start = time.perf_counter()
+        job = main.run_job(
+            image_urls=job_input["image_urls"],
+            trigger_word=job_input["trigger_word"],
+            model_id=job_input["model_id"],
+            caption_dropout_rate=job_input.get("caption_dropout_rate", 0.0),
+            batch_size=job_input.get("batch_size", 1),
+            steps=job_input["steps"],
+            optimizer=job_input.get("optimizer", "adamw8bit"),
+            lr=job_input.get("lr", 1e-4),
+            quantize=job_input.get("quantize", False),
+            r2_bucket_name=job_input["r2_bucket_name"] if s3_server else "",
+            r2_access_key_id=job_input["r2_access_key_id"],
+            r2_secret_access_key=job_input["r2_secret_access_key"],
+            r2_endpoint_url=job_input["r2_endpoint_url"],
+            r2_path_in_bucket="Loras",
+        )
+        jobs.append({
+            "status": job["status"],
+            "seconds": time.perf_counter() - job_start,
+            "validation_seconds": validation_seconds,
+            "stage_timings": job["stage_timings"],
+            "download_bytes": job.get("download_report", {}).get("bytes", 0),
+            "compaction": job.get("compaction"),
+            "spans": span_seconds(job["metrics"].to_dict()["spans"]),
+            "latents_restored": sum(
+                span.get("items", 0) for span in job["metrics"].to_dict()["spans"] if span["name"] == "latent_restore"
+            ),
+        })
+    total_seconds = time.perf_counter() - start
+
+    # Trainer spawn latency: from run_streaming being called to run.py starting
+    started, latents = [], []
+    for name in os.listdir(marker_dir):
+        with open(os.path.join(marker_dir, name)) as f:
+            if name.startswith("latents-"):
+                latents.append(json.load(f))
+            else:
+                started.append(float(f.read()))
+    spawn_seconds = [s - c for s, c in zip(sorted(started), sorted(spawn_calls))]
+
+    # Jobs run back to back, so trainer runs pair with jobs in start order
+    failures = []
+    for index, (job, counts) in enumerate(zip(jobs, sorted(latents, key=lambda c: c["started"]))):
+        job.update(latents_loaded=counts["loaded"], latents_encoded=counts["encoded"])
+        if job["latents_restored"] != counts["loaded"]:
+            failures.append(
+                f"job {index}: restored {job['latents_restored']} latents, the trainer loaded {counts['loaded']}"
+            )
+        if index > 0 and not args.vary_trigger and counts["encoded"]:
+            failures.append(f"job {index}: encoded {counts['encoded']} latents an earlier job on the same images stored")
+
+    upload_bytes = 0
+    if s3_server is not None:
+        import boto3
+        client = boto3.client(
+            "s3", endpoint_url=credentials["endpoint_url"], aws_access_key_id="bench",
+            aws_secret_access_key="bench", region_name="us-east-1"
+        )
+        for page in client.get_paginator("list_objects_v2").paginate(Bucket="bench"):
+            upload_bytes += sum(obj["Size"] for obj in page.get("Contents", []))
+        s3_server.stop()
+    image_server.shutdown()
+
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    results = {
+        "params": vars(args),
+        "total_seconds": total_seconds,
+        "jobs_per_hour": args.jobs / total_seconds * 3600 if total_seconds else None,
+        "stages": {
+            stage: {"seconds": seconds, "calls": timer.calls[stage], "mean_seconds": seconds / timer.calls[stage]}
+            for stage, seconds in sorted(timer.seconds.items())
+        },
+        "trainer_spawn_seconds": sum(spawn_seconds) / len(spawn_seconds) if spawn_seconds else None,
+        "peak_rss_mb": usage_self.ru_maxrss / 1024,
+        "peak_child_rss_mb": usage_children.ru_maxrss / 1024,
+        "bytes_downloaded": sum(job["download_bytes"] for job in jobs),
+        "bytes_uploaded": upload_bytes,
+        "jobs": jobs,
+        "failures": failures,
+    }
+    if "config_and_training" in results["stages"] and "trainer_process" in results["stages"]:
+        results["stages"]["config_write"] = {
+            "seconds": results["stages"]["config_and_training"]["seconds"] - results["stages"]["trainer_process"]["seconds"]
+        }
+    if not args.keep_workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline):
+    """
+    Prints per-stage and total deltas of results against a baseline run.
+    """
+    print(f"{'stage':<24}{'baseline':>12}{'current':>12}{'delta':>10}")
+    rows = [("total", baseline["total_seconds"], results["total_seconds"])]
+    for stage, values in results["stages"].items():
+        if stage in baseline["stages"]:
+            rows.append((stage, baseline["stages"][stage]["seconds"], values["seconds"]))
+    rows.append(("peak_rss_mb", baseline["peak_rss_mb"], results["peak_rss_mb"]))
+    for name, before, after in rows:
+        delta = (after - before) / before * 100 if before else 0.0
+        print(f"{name:<24}{before:>12.3f}{after:>12.3f}{delta:>9.1f}%")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=20, help="images per job")
+    parser.add_argument("--image-size", type=int, default=1536, help="width of the generated images in pixels")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the image server waits per request")
+    parser.add_argument("--concurrency", type=int, default=8, help="image download workers")
+    parser.add_argument("--jobs", type=int, default=1, help="jobs to run back to back")
+    parser.add_argument("--vary-trigger", action="store_true", help="give every job its own trigger word, and so its own image names")
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--step-delay", type=float, default=0.01, help="seconds per fake training step")
+    parser.add_argument("--startup-delay", type=float, default=0.0, help="fake model load time in seconds")
+    parser.add_argument("--checkpoint-mb", type=float, default=8.0, help="size of every checkpoint")
+    parser.add_argument("--log-lines", type=int, default=0, help="extra trainer log lines per step")
+    parser.add_argument("--no-upload", action="store_true", help="skip the S3 stand-in")
+    parser.add_argument("--cache-dir", help="persistent cache folder, to benchmark warm caches")
+    parser.add_argument("--keep-workdir", action="store_true")
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--compare", help="baseline JSON results to compare against")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run_benchmark(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    for failure in results["failures"]:
+        print(f"FAIL {failure}", file=sys.stderr)
+    sys.exit(1 if results["failures"] else 0)
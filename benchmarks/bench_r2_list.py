@@ -0,0 +1,176 @@
+"""
+Benchmark and regression check for R2 listing and the local artifact index
+(cloudflare_util.list_objects, artifact_index.ArtifactIndex) against a moto
+S3 server seeded with many objects under Loras/<model_id>/:
+
+    python benchmarks/bench_r2_list.py
+    python benchmarks/bench_r2_list.py --models 500 --objects-per-model 20 --latency 0.02
+
+Reports listing time and request counts for the old single-call listing,
+the paginated listing with and without fan-out, full and incremental index
+refreshes, existence checks and a repeated upload as JSON. Exits with
+status 1 when a listing misses objects or the index gives a wrong answer.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+BUCKET = "bench"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class RequestCounter:
+    """
+    Counts API calls made through a boto3 client and adds a fixed latency to
+    each, standing in for the round trip to R2.
+    """
+
+    def __init__(self, client, latency):
+        self.calls = 0
+        self.latency = latency
+        client.meta.events.register("before-call", self.before_call)
+
+    def before_call(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+
+    def measure(self, f):
+        calls, start = self.calls, time.perf_counter()
+        result = f()
+        return result, {"seconds": round(time.perf_counter() - start, 4), "requests": self.calls - calls}
+
+
+def seed(client, models, objects_per_model, large_model_objects):
+    keys = [f"Loras/model-{m:05d}/lora_{o:09d}.safetensors" for m in range(models) for o in range(objects_per_model)]
+    keys += [f"Loras/large-model/lora_{o:09d}.safetensors" for o in range(large_model_objects)]
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        list(executor.map(lambda key: client.put_object(Bucket=BUCKET, Key=key, Body=key.encode()), keys))
+    return keys
+
+
+def run_benchmark(args):
+    sys.path.insert(0, SRC_DIR)
+    from moto.server import ThreadedMotoServer
+    import boto3
+    from cloudflare_util import get_r2_client, list_objects, upload
+    from artifact_index import ArtifactIndex
+
+    port = free_port()
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    r2 = {
+        "bucket_name": BUCKET, "access_key_id": "bench", "secret_access_key": "bench",
+        "endpoint_url": f"http://127.0.0.1:{port}"
+    }
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    seeder = boto3.client("s3", endpoint_url=r2["endpoint_url"], aws_access_key_id="bench", aws_secret_access_key="bench", region_name="us-east-1")
+    seeder.create_bucket(Bucket=BUCKET)
+    keys = seed(seeder, args.models, args.objects_per_model, args.large_model_objects)
+
+    client = get_r2_client(r2["access_key_id"], r2["secret_access_key"], r2["endpoint_url"])
+    counter = RequestCounter(client, args.latency)
+    credentials = (r2["access_key_id"], r2["secret_access_key"], r2["endpoint_url"])
+    failures = []
+    results = {"params": vars(args), "objects": len(keys)}
+
+    # The listing list_objects made before: one call, at most 1000 keys
+    single, results["single_call"] = counter.measure(lambda: client.list_objects_v2(Bucket=BUCKET, Prefix="Loras/").get("Contents", []))
+    results["single_call"]["keys"] = len(single)
+
+    sequential, results["paginated"] = counter.measure(lambda: list_objects(BUCKET, "Loras/", *credentials, max_workers=1))
+    concurrent, results["paginated_fan_out"] = counter.measure(lambda: list_objects(BUCKET, "Loras/", *credentials, max_workers=args.workers))
+    for name, listing in (("paginated", sequential), ("paginated_fan_out", concurrent)):
+        results[name]["keys"] = len(listing)
+        if sorted(obj["Key"] for obj in listing) != sorted(keys):
+            failures.append(f"{name} listed {len(listing)} of {len(keys)} objects")
+
+    workdir = tempfile.mkdtemp(prefix="bench_r2_list_")
+    index = ArtifactIndex(r2, path=os.path.join(workdir, "index.json"))
+    _, results["index_full_refresh"] = counter.measure(lambda: index.refresh("Loras/", max_workers=args.workers))
+    _, results["index_incremental_refresh"] = counter.measure(lambda: index.refresh("Loras/", max_age=3600, max_workers=args.workers))
+
+    # Changes behind the index's back: a new model, a deleted model and a new checkpoint
+    seeder.put_object(Bucket=BUCKET, Key="Loras/new-model/lora.safetensors", Body=b"new")
+    seeder.delete_object(Bucket=BUCKET, Key="Loras/model-00000/lora_000000000.safetensors")
+    for o in range(args.objects_per_model):
+        seeder.delete_object(Bucket=BUCKET, Key=f"Loras/model-00001/lora_{o:09d}.safetensors")
+    seeder.put_object(Bucket=BUCKET, Key="Loras/model-00002/extra.safetensors", Body=b"extra")
+    for folder in ("Loras/model-00000/", "Loras/model-00002/"):
+        index.listed[folder] = 0.0
+    changed, results["index_stale_refresh"] = counter.measure(lambda: index.refresh("Loras/", max_age=3600, max_workers=args.workers))
+    results["index_stale_refresh"]["folders_listed"] = changed
+    expected = sorted(obj["Key"] for obj in list_objects(BUCKET, "Loras/", *credentials))
+    if sorted(index.objects) != expected:
+        failures.append(f"index holds {len(index.objects)} objects after the stale refresh, R2 holds {len(expected)}")
+
+    exists, results["exists_indexed"] = counter.measure(lambda: (index.exists("Loras/model-00003/"), index.exists("Loras/missing/")))
+    if exists != (True, False) or results["exists_indexed"]["requests"]:
+        failures.append(f"indexed existence checks returned {exists} with {results['exists_indexed']['requests']} requests")
+    cold = ArtifactIndex(r2, path=os.path.join(workdir, "cold.json"))
+    exists, results["exists_cold"] = counter.measure(lambda: (cold.exists("Loras/model-00003/"), cold.exists("Loras/missing/")))
+    if exists != (True, False):
+        failures.append(f"cold existence checks returned {exists}")
+
+    # A second upload of the same file is skipped; a changed file is sent again
+    path = os.path.join(workdir, "lora.safetensors")
+    with open(path, 'wb') as f:
+        f.write(os.urandom(args.upload_mb * 1024 * 1024))
+    upload_kwargs = dict(
+        bucket_name=BUCKET, access_key_id="bench", secret_access_key="bench", endpoint_url=r2["endpoint_url"],
+        file_path=path, r2_path_in_bucket="Loras", unique_id="uploaded-model", index=index
+    )
+    for name in ("upload_first", "upload_repeat"):
+        outcome, results[name] = counter.measure(lambda: upload(**upload_kwargs))
+        results[name]["message"] = outcome[1]
+    with open(path, 'ab') as f:
+        f.write(b"changed")
+    outcome, results["upload_changed"] = counter.measure(lambda: upload(**upload_kwargs))
+    results["upload_changed"]["message"] = outcome[1]
+    if [results[name]["message"] for name in ("upload_first", "upload_repeat", "upload_changed")] != ["Upload successful", "Already uploaded", "Upload successful"]:
+        failures.append("repeated uploads were not skipped exactly when unchanged")
+
+    server.stop()
+    results["failures"] = failures
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", type=int, default=200, help="model folders under Loras/")
+    parser.add_argument("--objects-per-model", type=int, default=10)
+    parser.add_argument("--large-model-objects", type=int, default=2500, help="objects in one extra folder")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds added to every request")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent list requests")
+    parser.add_argument("--upload-mb", type=int, default=8)
+    parser.add_argument("--output", help="write JSON results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmark(args)
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    if results["failures"]:
+        for failure in results["failures"]:
+            print(f"FAIL {failure}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Load test of the full train_handler path through src/local_runner.py:
+N worker processes run jobs from a generated JSONL file against the same
+local stand-ins as bench_job.py (image server, moto S3 server, fake_run.py
+as ai-toolkit's run.py):
+
+    python benchmarks/bench_runner.py --workers 4 --jobs 16
+    python benchmarks/bench_runner.py --workers 4 --jobs 40 --rate 0.5 --output results.json
+
+Reports throughput, queueing delay and run time as JSON. A second, smaller
+run on one worker checks that a job exceeding the timeout is killed and the
+worker replaced (skipped with --no-timeout-check). Exits with status 1 when
+a job fails or the timeout is not enforced.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+sys.path.insert(0, BENCH_DIR)
+
+from bench_job import make_images, start_image_server, start_s3_server
+
+
+def write_jobs(path, count, image_urls, credentials, steps, bucket):
+    with open(path, 'w') as f:
+        for index in range(count):
+            job_input = {
+                "image_urls": image_urls,
+                "trigger_word": "benchtok",
+                "model_id": f"bench-{index}",
+                "steps": steps[index % len(steps)],
+                "r2_bucket_name": bucket,
+                "r2_access_key_id": credentials["access_key_id"],
+                "r2_secret_access_key": credentials["secret_access_key"],
+                "r2_endpoint_url": credentials["endpoint_url"],
+                "r2_path_in_bucket": "Loras",
+            }
+            f.write(json.dumps({"id": f"bench-{index}", "input": job_input}) + "\n")
+
+
+def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix="bench-runner-")
+    toolkit_dir = os.path.join(workdir, "ai-toolkit")
+    os.makedirs(toolkit_dir)
+    shutil.copy(os.path.join(BENCH_DIR, "fake_run.py"), os.path.join(toolkit_dir, "run.py"))
+    cache_root = os.path.join(workdir, "cache")
+    # Inherited by the spawned workers
+    os.environ.update({
+        "IMAGE_CACHE_DIR": os.path.join(cache_root, "images"),
+        "LATENT_CACHE_DIR": os.path.join(cache_root, "latents"),
+        "EMBEDDING_CACHE_DIR": os.path.join(cache_root, "embeddings"),
+        "R2_INDEX_DIR": os.path.join(cache_root, "r2_index"),
+        "BENCH_STEP_DELAY": str(args.step_delay),
+        "BENCH_CHECKPOINT_BYTES": str(int(args.checkpoint_mb * 1024 * 1024)),
+        "CHECKPOINT_POLL_INTERVAL": "0.5",
+    })
+    os.environ.pop("METRICS_JSONL", None)
+    os.chdir(workdir)
+    sys.path.insert(0, SRC_DIR)
+    from local_runner import run
+
+    images = make_images(args.images, args.image_size)
+    image_server = start_image_server(images, args.latency)
+    image_urls = [f"http://127.0.0.1:{image_server.server_address[1]}/{i}.jpg" for i in range(args.images)]
+    s3_server, credentials = start_s3_server("bench")
+
+    failures = []
+    results = {"params": vars(args)}
+    try:
+        jobs_path = os.path.join(workdir, "jobs.jsonl")
+        write_jobs(jobs_path, args.jobs, image_urls, credentials, [args.steps], "bench")
+        summary = run(jobs_path, os.path.join(workdir, "load"), workers=args.workers, rate=args.rate)
+        results["load"] = summary
+        if summary["jobs"] != args.jobs or summary["statuses"].get("success", 0) != args.jobs:
+            failures.append(f"load run: {summary['statuses']} of {args.jobs} jobs")
+
+        if not args.no_timeout_check:
+            # short, too long, short on one worker: the second is killed and the third runs on a fresh worker
+            timeout = args.steps * args.step_delay * 20 + 10
+            long_steps = int(timeout * 2 / args.step_delay)
+            jobs_path = os.path.join(workdir, "timeout.jsonl")
+            write_jobs(jobs_path, 3, image_urls, credentials, [args.steps, long_steps, args.steps], "bench")
+            summary = run(jobs_path, os.path.join(workdir, "timeout"), workers=1, timeout=timeout)
+            results["timeout"] = summary
+            if summary["timed_out"] != 1 or summary["statuses"].get("success", 0) != 2:
+                failures.append(f"timeout run: {summary['timed_out']} timed out, statuses {summary['statuses']}")
+    finally:
+        s3_server.stop()
+        image_server.shutdown()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    results["failures"] = failures
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--jobs", type=int, default=6)
+    parser.add_argument("--rate", type=float, default=0.0, help="jobs submitted per second (0: all at once)")
+    parser.add_argument("--images", type=int, default=10, help="images per job")
+    parser.add_argument("--image-size", type=int, default=1024, help="width of the generated images in pixels")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the image server waits per request")
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--step-delay", type=float, default=0.01, help="seconds per fake training step")
+    parser.add_argument("--checkpoint-mb", type=float, default=4.0, help="size of every checkpoint")
+    parser.add_argument("--no-timeout-check", action="store_true")
+    parser.add_argument("--keep-workdir", action="store_true")
+    parser.add_argument("--output", help="write JSON results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmark(args)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if results["failures"]:
+        for failure in results["failures"]:
+            print(f"FAIL {failure}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
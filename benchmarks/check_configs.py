@@ -0,0 +1,59 @@
+"""
+Golden file check for the generated ai-toolkit configs.
+
+Renders every preset in training_config.PRESETS with default job settings
+and placeholder paths and compares the YAML byte for byte against
+benchmarks/golden/<preset>.yaml. golden/default.yaml is what train.py wrote
+before presets existed, so the default preset keeps existing jobs unchanged:
+
+    python benchmarks/check_configs.py
+    python benchmarks/check_configs.py --update   # after an intended change
+
+Exits with status 1 on a difference so it can gate CI.
+"""
+import os
+import sys
+import difflib
+import argparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_DIR = os.path.join(BENCH_DIR, "golden")
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "src"))
+
+from training_config import PRESETS, example_yaml  # noqa: E402
+
+
+def check(update=False):
+    failures = []
+    for name in sorted(PRESETS):
+        path = os.path.join(GOLDEN_DIR, f"{name}.yaml")
+        rendered = example_yaml(name)
+        if update:
+            with open(path, 'w') as f:
+                f.write(rendered)
+            continue
+        if not os.path.exists(path):
+            failures.append(f"{name}: no golden file at {path}")
+            continue
+        with open(path) as f:
+            golden = f.read()
+        if rendered != golden:
+            diff = difflib.unified_diff(golden.splitlines(True), rendered.splitlines(True), f"golden/{name}.yaml", name)
+            failures.append(f"{name}: config differs from golden file\n{''.join(diff)}")
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--update", action="store_true", help="rewrite the golden files from the current presets")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    failures = check(update=args.update)
+    for failure in failures:
+        print(f"REGRESSION: {failure}", file=sys.stderr)
+    if not failures:
+        print(f"{len(PRESETS)} preset configs {'updated' if args.update else 'match their golden files'}")
+    sys.exit(1 if failures else 0)
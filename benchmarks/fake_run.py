@@ -0,0 +1,168 @@
+"""
+Stand-in for ai-toolkit's run.py used by the benchmarks.
+
+Reads the generated config.yaml, prints tqdm-style progress lines, writes
+fake latents for every dataset image and checkpoints every save_every steps.
+Behaviour is tuned through environment variables:
+
+    BENCH_STEP_DELAY         seconds per training step (default 0.01)
+    BENCH_STARTUP_DELAY      seconds before the first step, i.e. model load (default 0)
+    BENCH_CHECKPOINT_BYTES   size of every checkpoint file (default 1 MiB)
+    BENCH_LOG_LINES          extra log lines printed per step (default 0)
+    BENCH_EXIT_CODE          exit code to finish with (default 0)
+    BENCH_FAIL_AT_STEP       die with exit code 1 at this step, like a preempted worker
+    BENCH_MARKER_DIR         folder to record the process start time in
+
+Like ai-toolkit, it names latents "<image stem>_<hash>.safetensors" with the
+image's file name in the hash, loads the ones already on disk instead of
+encoding them and, with BENCH_MARKER_DIR set, records how many it loaded in
+latents-<pid>.json. It resumes from the newest <name>_<step>.safetensors in
+its output folder and writes optimizer.pt next to every checkpoint. The final
+<name>.safetensors is a real float32 LoRA of the configured rank, about
+BENCH_CHECKPOINT_BYTES in size, so it can be compacted.
+"""
+import os
+import sys
+import json
+import time
+import base64
+import struct
+import hashlib
+import yaml
+
+
+def latent_path(image_path, resolution):
+    """
+    ai-toolkit's FileItemDTO.get_latent_path: an md5 of the latent info dict,
+    which starts with the image's file name, then its scale and crop.
+    """
+    info = {
+        "filename": os.path.basename(image_path),
+        "scale_to_width": resolution,
+        "scale_to_height": resolution,
+        "crop_x": 0,
+        "crop_y": 0,
+        "crop_width": resolution,
+        "crop_height": resolution,
+    }
+    digest = hashlib.md5(json.dumps(info, sort_keys=True).encode("utf-8")).digest()
+    hash_str = base64.urlsafe_b64encode(digest).decode("ascii").replace("=", "")
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(os.path.dirname(image_path), "_latent_cache", f"{stem}_{hash_str}.safetensors")
+
+
+def write_lora(path, network, size):
+    """
+    Random float32 lora_A/lora_B pairs, one per target module (8 without targets).
+    """
+    import numpy as np
+    rank = network["linear"]
+    modules = network.get("network_kwargs", {}).get("only_if_contains") or [f"transformer.blocks.{i}.proj" for i in range(8)]
+    features = max(rank, size // (8 * rank * len(modules)))
+    rng = np.random.default_rng(0)
+    header, chunks, offset = {}, [], 0
+    for module in modules:
+        for name, shape in ((f"{module}.lora_A.weight", (rank, features)), (f"{module}.lora_B.weight", (features, rank))):
+            raw = (rng.standard_normal(shape, dtype=np.float32) * 1e-2).tobytes()
+            header[name] = {"dtype": "F32", "shape": list(shape), "data_offsets": [offset, offset + len(raw)]}
+            chunks.append(raw)
+            offset += len(raw)
+    encoded = json.dumps(header).encode()
+    encoded += b" " * (-len(encoded) % 8)
+    with open(path, 'wb') as f:
+        f.write(struct.pack("<Q", len(encoded)) + encoded + b"".join(chunks))
+
+
+def main():
+    started = time.time()
+    marker_dir = os.environ.get("BENCH_MARKER_DIR")
+    if marker_dir:
+        with open(os.path.join(marker_dir, f"started-{os.getpid()}"), 'w') as f:
+            f.write(str(started))
+
+    step_delay = float(os.environ.get("BENCH_STEP_DELAY", 0.01))
+    startup_delay = float(os.environ.get("BENCH_STARTUP_DELAY", 0))
+    checkpoint_bytes = int(os.environ.get("BENCH_CHECKPOINT_BYTES", 1024 * 1024))
+    log_lines = int(os.environ.get("BENCH_LOG_LINES", 0))
+    exit_code = int(os.environ.get("BENCH_EXIT_CODE", 0))
+    fail_at_step = int(os.environ.get("BENCH_FAIL_AT_STEP", 0))
+
+    with open(sys.argv[1]) as f:
+        config = yaml.safe_load(f)
+    process = config["config"]["process"][0]
+    name = config["config"]["name"]
+    steps = process["train"]["steps"]
+    save_every = process["save"].get("save_every") or steps
+    keep = process["save"].get("max_step_saves_to_keep")
+    dataset_folder = process["datasets"][0]["folder_path"]
+    output_folder = os.path.join(process["training_folder"], name)
+    os.makedirs(output_folder, exist_ok=True)
+
+    print(f"Loading model {process['model']['name_or_path']}", flush=True)
+    time.sleep(startup_delay)
+
+    # Latents, one per image and resolution bucket
+    os.makedirs(os.path.join(dataset_folder, "_latent_cache"), exist_ok=True)
+    images = [n for n in sorted(os.listdir(dataset_folder)) if n.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    latents = {"loaded": 0, "encoded": 0}
+    for index, image in enumerate(images):
+        for resolution in process["datasets"][0]["resolution"]:
+            path = latent_path(os.path.join(dataset_folder, image), resolution)
+            if os.path.exists(path):
+                latents["loaded"] += 1
+            else:
+                latents["encoded"] += 1
+                with open(path, 'wb') as f:
+                    f.write(b"\0" * 4096)
+        sys.stderr.write(f"\rCaching latents to disk: {100 * (index + 1) // len(images)}%|#| {index + 1}/{len(images)} [00:00<00:00, 50.0it/s]")
+    sys.stderr.write("\n")
+    if marker_dir:
+        with open(os.path.join(marker_dir, f"latents-{os.getpid()}.json"), 'w') as f:
+            json.dump({"started": started, **latents}, f)
+
+    payload = os.urandom(min(checkpoint_bytes, 1024 * 1024))
+    saved = []
+
+    def write_checkpoint(path):
+        with open(path, 'wb') as f:
+            remaining = checkpoint_bytes
+            while remaining > 0:
+                f.write(payload[:remaining])
+                remaining -= len(payload)
+
+    first_step = 1
+    previous = sorted(n for n in os.listdir(output_folder) if n.startswith(f"{name}_") and n.endswith(".safetensors"))
+    if previous:
+        first_step = int(previous[-1][len(name) + 1:-len(".safetensors")]) + 1
+        print(f"Resuming from {previous[-1]}, step {first_step}", flush=True)
+
+    step_started = time.time()
+    for step in range(first_step, steps + 1):
+        if step == fail_at_step:
+            sys.exit(1)
+        time.sleep(step_delay)
+        for line in range(log_lines):
+            print(f"debug line {line} of step {step}")
+        elapsed = time.time() - step_started
+        rate = (step - first_step + 1) / elapsed if elapsed else 0.0
+        sys.stderr.write(
+            f"\r{name}: {100 * step // steps}%|#| {step}/{steps} "
+            f"[00:00<00:00, {rate:.2f}it/s, lr: 1.0e-04 loss: {1.0 / step:.3e}]"
+        )
+        if step % save_every == 0 and step != steps:
+            path = os.path.join(output_folder, f"{name}_{step:09d}.safetensors")
+            write_checkpoint(path)
+            with open(os.path.join(output_folder, "optimizer.pt"), 'wb') as f:
+                f.write(payload[:1024])
+            saved.append(path)
+            while keep and len(saved) > keep:
+                os.remove(saved.pop(0))
+    sys.stderr.write("\n")
+
+    if exit_code == 0:
+        write_lora(os.path.join(output_folder, f"{name}.safetensors"), process["network"], checkpoint_bytes)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
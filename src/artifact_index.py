@@ -0,0 +1,207 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+from pathlib import Path
+
+DEFAULT_INDEX_DIR = os.environ.get("R2_INDEX_DIR", os.path.join(os.getcwd(), "cache", "r2_index"))
+# Prefixes listed more recently than this are answered from the index without a request
+DEFAULT_MAX_AGE = float(os.environ.get("R2_INDEX_MAX_AGE", 3600))  # seconds
+
+
+def folder_of(key):
+    return key.rsplit("/", 1)[0] + "/" if "/" in key else ""
+
+
+class ArtifactIndex:
+    """
+    Local index of the objects in an R2 bucket (key -> size, ETag, mtime),
+    stored as JSON under cache/r2_index. Listings are recorded per prefix, so
+    the index is refreshed one model folder at a time, and the worker's own
+    uploads are added as they finish instead of being listed again.
+    """
+
+    def __init__(self, r2, path=None, max_age=DEFAULT_MAX_AGE):
+        from cloudflare_util import get_r2_client
+        self.r2 = r2
+        self.bucket = r2["bucket_name"]
+        self.client = get_r2_client(r2["access_key_id"], r2["secret_access_key"], r2["endpoint_url"])
+        endpoint = hashlib.sha1(r2["endpoint_url"].encode()).hexdigest()[:8]
+        self.path = path or os.path.join(DEFAULT_INDEX_DIR, f"{self.bucket}-{endpoint}.json")
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.objects, self.listed = data["objects"], data["listed"]
+        except (OSError, ValueError, KeyError):
+            self.objects, self.listed = {}, {}
+
+    def save(self):
+        with self.lock:
+            data = json.dumps({"objects": self.objects, "listed": self.listed})
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def is_fresh(self, prefix, max_age=None):
+        """
+        Whether prefix lies in a listing younger than max_age.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        now = time.time()
+        with self.lock:
+            # Only prefixes of prefix can cover it
+            times = [self.listed.get(prefix[:end]) for end in range(len(prefix) + 1)]
+        return any(at is not None and now - at < max_age for at in times)
+
+    def _replace(self, prefix, objects, listed_at):
+        for key in [key for key in self.objects if key.startswith(prefix)]:
+            del self.objects[key]
+        self._add(objects)
+        self.listed[prefix] = listed_at
+
+    def _add(self, objects):
+        for obj in objects:
+            self.objects[obj["Key"]] = {"size": obj["Size"], "etag": obj["ETag"].strip('"'), "mtime": obj["LastModified"].timestamp()}
+
+    def refresh(self, prefix, max_age=None, max_workers=None):
+        """
+        Lists prefix into the index, fanning out over its folders. Folders
+        listed within max_age are kept as they are; by default all are listed.
+        Returns the number of folders listed.
+        """
+        from cloudflare_util import DEFAULT_LIST_CONCURRENCY, _list_pages, list_prefixes
+        listed_at = time.time()
+        objects, folders = _list_pages(self.client, self.bucket, prefix, delimiter="/")
+        with self.lock:
+            stale = [folder for folder in folders if max_age is None or listed_at - self.listed.get(folder, 0.0) >= max_age]
+        listing = list_prefixes(self.client, self.bucket, stale, max_workers or DEFAULT_LIST_CONCURRENCY)
+        current = set(folders)
+        with self.lock:
+            # One pass over the index: drop keys directly under prefix, in relisted folders and in folders that are gone
+            for key in [key for key in self.objects if key.startswith(prefix)]:
+                rest = key[len(prefix):]
+                folder = prefix + rest.split("/", 1)[0] + "/" if "/" in rest else None
+                if folder is None or folder in listing or folder not in current:
+                    del self.objects[key]
+            self._add(objects)
+            for folder, folder_objects in listing.items():
+                self._add(folder_objects)
+                self.listed[folder] = listed_at
+            self.listed[prefix] = min([listed_at] + [self.listed.get(folder, listed_at) for folder in folders])
+        self.save()
+        logging.info(f"Indexed {prefix}: listed {len(stale)} of {len(folders)} folders")
+        return len(stale)
+
+    def _ensure_fresh(self, prefix):
+        if not self.is_fresh(prefix):
+            from cloudflare_util import _list_pages
+            listed_at = time.time()
+            objects, _ = _list_pages(self.client, self.bucket, prefix)
+            with self.lock:
+                self._replace(prefix, objects, listed_at)
+            self.save()
+
+    def get(self, key):
+        """
+        The index entry {size, etag, mtime} for key, or None. A stale entry's
+        folder is listed again first.
+        """
+        self._ensure_fresh(folder_of(key))
+        with self.lock:
+            return self.objects.get(key)
+
+    def exists(self, prefix):
+        """
+        Whether any object starts with prefix, e.g. "Loras/<model_id>/". Lists
+        just that prefix when the index has nothing recent for it.
+        """
+        self._ensure_fresh(prefix)
+        with self.lock:
+            return any(key.startswith(prefix) for key in self.objects)
+
+    def record(self, key, size, etag):
+        with self.lock:
+            self.objects[key] = {"size": size, "etag": etag, "mtime": time.time()}
+        self.save()
+
+    def contains_file(self, key, path, chunk_size=None):
+        """
+        Whether key already holds the contents of path. A size mismatch is
+        decided from the index; a candidate match is hashed and confirmed with
+        a HEAD request, so a stale index can cost an upload but never skip one.
+        """
+        from botocore.exceptions import ClientError
+        from cloudflare_util import DEFAULT_CHUNK_SIZE, file_etag
+        entry = self.get(key)
+        path = Path(path)
+        if entry is None or entry["size"] != path.stat().st_size:
+            return False
+        if file_etag(path, chunk_size or DEFAULT_CHUNK_SIZE) != entry["etag"]:
+            return False
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                with self.lock:
+                    self.objects.pop(key, None)
+                return False
+            raise
+        return response["ETag"].strip('"') == entry["etag"]
+
+    def stats(self, prefix=""):
+        with self.lock:
+            sizes = [entry["size"] for key, entry in self.objects.items() if key.startswith(prefix)]
+            folders = {folder_of(key) for key in self.objects if key.startswith(prefix)}
+        return {"objects": len(sizes), "bytes": sum(sizes), "folders": len(folders)}
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_artifact_index(r2):
+    """
+    One index per bucket and credentials, shared by all jobs on the worker.
+    """
+    key = (r2["endpoint_url"], r2["bucket_name"], r2["access_key_id"])
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = ArtifactIndex(r2)
+        return _indexes[key]
+
+
+if __name__ == "__main__":
+    # python artifact_index.py refresh Loras/ | exists Loras/<model_id>/ | stats [prefix]
+    parser = argparse.ArgumentParser(description="Local index of the artifacts in an R2 bucket")
+    parser.add_argument("command", choices=("refresh", "exists", "stats"))
+    parser.add_argument("prefix", nargs="?", default="")
+    parser.add_argument("--bucket", default=os.environ.get("R2_BUCKET_NAME"))
+    parser.add_argument("--endpoint-url", default=os.environ.get("R2_ENDPOINT_URL"))
+    parser.add_argument("--access-key-id", default=os.environ.get("R2_ACCESS_KEY_ID"))
+    parser.add_argument("--secret-access-key", default=os.environ.get("R2_SECRET_ACCESS_KEY"))
+    parser.add_argument("--max-age", type=float, help="with refresh, keep folders listed within this many seconds")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    index = ArtifactIndex({
+        "bucket_name": args.bucket,
+        "endpoint_url": args.endpoint_url,
+        "access_key_id": args.access_key_id,
+        "secret_access_key": args.secret_access_key
+    })
+    if args.command == "refresh":
+        index.refresh(args.prefix, max_age=args.max_age)
+        print(json.dumps(index.stats(args.prefix)))
+    elif args.command == "exists":
+        exists = index.exists(args.prefix)
+        print(json.dumps({"prefix": args.prefix, "exists": exists}))
+        sys.exit(0 if exists else 1)
+    else:
+        print(json.dumps(index.stats(args.prefix)))
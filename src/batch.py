@@ -0,0 +1,47 @@
+import time
+import logging
+
+
+def run_batch(items, run_item):
+    """
+    Runs a batch of training specs back to back on this worker.
+
+    items is a list of (spec, error) pairs, where error is set for specs that
+    failed validation; run_item(index, spec) trains one spec and returns its
+    result dict with a "status". A failing item is recorded and the batch
+    moves on. Returns the per-item results plus batch totals; an empty batch
+    has failed.
+    """
+    results = []
+    start = time.perf_counter()
+    for index, (spec, error) in enumerate(items):
+        item_start = time.perf_counter()
+        if error is not None:
+            result = {"status": "failed", "error": error}
+        else:
+            try:
+                result = run_item(index, spec)
+            except Exception as e:
+                logging.error(f"Batch item {index} failed: {e}")
+                result = {"status": "failed", "error": str(e)}
+        result["index"] = index
+        result["seconds"] = time.perf_counter() - item_start
+        results.append(result)
+        logging.info(f"Batch item {index + 1}/{len(items)} finished: {result['status']}")
+
+    succeeded = sum(1 for result in results if result["status"] in ("success", "dry_run"))
+    if not results:
+        status = "failed"  # nothing was trained
+    elif succeeded == len(results):
+        status = "success"
+    elif succeeded:
+        status = "partial"
+    else:
+        status = "failed"
+    return {
+        "status": status,
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "seconds": time.perf_counter() - start,
+        "items": results,
+    }
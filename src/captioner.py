@@ -0,0 +1,267 @@
+import os
+import re
+import json
+import time
+import fcntl
+import importlib
+import threading
+import multiprocessing
+
+# Backend used when a job asks for automatic captions, as "module:Class"
+DEFAULT_BACKEND = os.environ.get("CAPTION_BACKEND", "captioner:BlipCaptioner")
+DEFAULT_MODEL = os.environ.get("CAPTION_MODEL", "Salesforce/blip-image-captioning-base")
+DEFAULT_BATCH_SIZE = int(os.environ.get("CAPTION_BATCH_SIZE", 8))
+# Captions cached by image content hash, one file per backend
+DEFAULT_CACHE_DIR = os.environ.get("CAPTION_CACHE_DIR", os.path.join(os.getcwd(), "cache", "captions"))
+
+
+class CaptionBackend:
+    """
+    Interface for captioners. caption() receives a batch of image paths and
+    returns one caption per image; name identifies the backend and model in
+    the caption cache.
+    """
+    name = "backend"
+
+    def load(self):
+        pass
+
+    def caption(self, paths):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class TriggerWordCaptioner(CaptionBackend):
+    """
+    Rule-based stand-in that captions every image with the trigger word alone.
+    """
+    name = "trigger-word"
+
+    def caption(self, paths):
+        return ["" for _ in paths]
+
+
+class BlipCaptioner(CaptionBackend):
+    """
+    BLIP captioning through transformers. Small enough to run on CPU; uses the
+    GPU when one is available.
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL, max_new_tokens=40):
+        self.model_name = model_name
+        self.max_new_tokens = max_new_tokens
+        self.name = f"blip-{model_name}"
+        self.model = None
+
+    def load(self):
+        if self.model is not None:
+            return
+        import torch
+        from transformers import BlipForConditionalGeneration, BlipProcessor
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.dtype = torch.float16 if self.device == "cuda" else torch.float32
+        self.processor = BlipProcessor.from_pretrained(self.model_name)
+        self.model = BlipForConditionalGeneration.from_pretrained(self.model_name, torch_dtype=self.dtype).to(self.device).eval()
+
+    def caption(self, paths):
+        import torch
+        from PIL import Image
+        images = []
+        for path in paths:
+            with Image.open(path) as image:
+                images.append(image.convert("RGB"))
+        inputs = self.processor(images=images, return_tensors="pt").to(self.device, self.dtype)
+        with torch.inference_mode():
+            output = self.model.generate(**inputs, max_new_tokens=self.max_new_tokens)
+        return [text.strip() for text in self.processor.batch_decode(output, skip_special_tokens=True)]
+
+
+def _load_backend(spec):
+    module_name, class_name = spec.split(":")
+    backend = getattr(importlib.import_module(module_name), class_name)()
+    backend.load()
+    return backend
+
+
+def _serve(spec, conn):
+    """
+    Captioner process: loads the backend, then captions batches of paths
+    received over conn until it receives None.
+    """
+    try:
+        backend = _load_backend(spec)
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    conn.send(("ready", backend.name))
+    while True:
+        paths = conn.recv()
+        if paths is None:
+            return
+        try:
+            conn.send(("ok", backend.caption(paths)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class CaptionProcess(CaptionBackend):
+    """
+    Runs a backend in its own spawned process for the length of one caption
+    stage. The handler process never imports torch, and the model's GPU
+    memory is returned when the process exits, before training starts.
+    """
+
+    def __init__(self, spec=DEFAULT_BACKEND):
+        self.spec = spec
+        self.name = spec
+        self.process = None
+
+    def load(self):
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_serve, args=(self.spec, child_conn), name="captioner", daemon=True)
+        self.process.start()
+        child_conn.close()
+        try:
+            self.name = self._receive()
+        except RuntimeError:
+            self.close()
+            raise
+        return self
+
+    def _receive(self):
+        try:
+            kind, value = self.conn.recv()
+        except EOFError:
+            self.process.join(timeout=5)
+            raise RuntimeError(f"Captioner process exited with code {self.process.exitcode}")
+        if kind == "error":
+            raise RuntimeError(f"Captioner {self.spec} failed: {value}")
+        return value
+
+    def caption(self, paths):
+        self.conn.send(list(paths))
+        return self._receive()
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=30)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+        self.process = None
+
+
+def get_backend(spec=DEFAULT_BACKEND):
+    """
+    Starts the backend "module:Class" in a captioner process; close() it
+    when the job's images are captioned.
+    """
+    return CaptionProcess(spec).load()
+
+
+class CaptionCache:
+    """
+    Captions keyed by image sha256, stored as one JSON file per backend.
+    The file may be shared by several processes, so put_many re-reads it
+    under an exclusive flock and merges before writing.
+    """
+
+    def __init__(self, backend_name, cache_dir=DEFAULT_CACHE_DIR):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, re.sub(r"[^\w.-]+", "_", backend_name) + ".json")
+        self.lock = threading.Lock()
+        self.captions = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, digest):
+        with self.lock:
+            return self.captions.get(digest)
+
+    def put_many(self, captions):
+        with self.lock, open(f"{self.path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Keep what other processes stored since this one last read the file
+                self.captions = {**self._read(), **self.captions, **captions}
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(self.captions, f)
+                os.replace(tmp_path, self.path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def inject_trigger(caption, trigger_word):
+    """
+    Puts the trigger word in front of the caption unless it already mentions it
+    (ai-toolkit's "[trigger]" placeholder counts).
+    """
+    caption = " ".join(caption.split())
+    if not caption:
+        return trigger_word
+    if "[trigger]" in caption or trigger_word.lower() in caption.lower():
+        return caption
+    return f"{trigger_word}, {caption}"
+
+
+def caption_images(dataset_folder_path, images, trigger_word, captions=None, backend=None, cache=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Writes "<stem>.txt" next to every manifest image. Supplied captions
+    ({file: caption}) win; other images are captioned by backend in batches,
+    reusing cached captions for images seen before. Without a backend the
+    caption is the trigger word alone. Returns a report that includes the
+    written captions by file.
+    """
+    captions = captions or {}
+    start = time.perf_counter()
+    report = {"backend": backend.name if backend is not None else None, "supplied": 0, "cached": 0, "generated": 0, "trigger_only": 0}
+    results = {}
+    pending = []
+    for image in images:
+        if captions.get(image["file"]):
+            results[image["file"]] = captions[image["file"]]
+            report["supplied"] += 1
+        elif backend is None:
+            results[image["file"]] = ""
+            report["trigger_only"] += 1
+        elif cache is not None and cache.get(image["sha256"]) is not None:
+            results[image["file"]] = cache.get(image["sha256"])
+            report["cached"] += 1
+        else:
+            pending.append(image)
+
+    for offset in range(0, len(pending), batch_size):
+        batch = pending[offset:offset + batch_size]
+        generated = backend.caption([os.path.join(dataset_folder_path, image["file"]) for image in batch])
+        for image, caption in zip(batch, generated):
+            results[image["file"]] = caption
+        if cache is not None:
+            cache.put_many({image["sha256"]: caption for image, caption in zip(batch, generated)})
+        report["generated"] += len(batch)
+
+    report["captions"] = {}
+    for file, caption in results.items():
+        stem = os.path.splitext(file)[0]
+        report["captions"][file] = inject_trigger(caption, trigger_word)
+        with open(os.path.join(dataset_folder_path, f"{stem}.txt"), 'w') as f:
+            f.write(report["captions"][file])
+
+    # Text embeddings can only be precomputed when every prompt is the trigger word
+    report["uniform"] = all(caption == trigger_word for caption in report["captions"].values())
+    report["seconds"] = time.perf_counter() - start
+    return report
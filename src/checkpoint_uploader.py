@@ -0,0 +1,155 @@
+import os
+import shutil
+import logging
+import threading
+from cloudflare_util import UploadQueue, upload
+from resume import checkpoint_step, optimizer_name
+
+# How often the training output folder is scanned for new checkpoints
+DEFAULT_POLL_INTERVAL = float(os.environ.get("CHECKPOINT_POLL_INTERVAL", 15.0))  # seconds
+CHECKPOINT_EXTENSIONS = ('.safetensors',)
+# Optimizer state ai-toolkit writes next to the checkpoints, needed to resume a run
+OPTIMIZER_NAMES = ('optimizer.pt',)
+STAGING_DIR = ".uploading"
+
+
+class CheckpointUploader:
+    """
+    Watches the folder ai-toolkit saves LoRA checkpoints to and uploads every
+    checkpoint once it has finished writing, while training is still running.
+
+    A file counts as finished once its size and mtime are unchanged between two
+    scans. Files are hardlinked into a staging folder before upload so that
+    ai-toolkit pruning old checkpoints (max_step_saves_to_keep) does not break
+    an upload in flight. Optimizer state, which ai-toolkit rewrites in place,
+    is copied instead and uploaded as optimizer_<step>.pt, with the step of
+    the newest checkpoint saved before it. on_upload, if given, is called
+    with the uploaded name after every successful upload. Files named in
+    hold are left for finish(), so the final LoRA can be compacted before it
+    is uploaded.
+    """
+
+    def __init__(self, watch_dir, upload_kwargs, poll_interval=DEFAULT_POLL_INTERVAL, upload_queue=None, on_upload=None, hold=()):
+        self.watch_dir = watch_dir
+        self.upload_kwargs = upload_kwargs
+        self.on_upload = on_upload
+        self.hold = set(hold)
+        self.poll_interval = poll_interval
+        self.upload_queue = upload_queue or UploadQueue()
+        self.pending = {}  # name -> (size, mtime) seen on the previous scan
+        self.uploaded = {}  # name -> (size, mtime) already queued
+        self.queued = []  # names in upload order, matching the queue's results
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="checkpoint-watcher", daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                self.scan()
+            except OSError as e:
+                logging.error(f"Checkpoint scan of {self.watch_dir} failed: {e}")
+
+    def skip_existing(self):
+        """
+        Treats the files already in the folder, such as a checkpoint restored
+        to resume from, as uploaded.
+        """
+        if not os.path.isdir(self.watch_dir):
+            return
+        for name in os.listdir(self.watch_dir):
+            path = os.path.join(self.watch_dir, name)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                self.uploaded[name] = (stat.st_size, stat.st_mtime)
+
+    def scan(self, final=False):
+        """
+        Queues checkpoints that have stopped changing. With final=True every
+        checkpoint is treated as finished, since the trainer has exited.
+        """
+        if not os.path.isdir(self.watch_dir):
+            return
+        for name in sorted(os.listdir(self.watch_dir)):
+            path = os.path.join(self.watch_dir, name)
+            if not (name.endswith(CHECKPOINT_EXTENSIONS) or name in OPTIMIZER_NAMES) or not os.path.isfile(path):
+                continue
+            if name in self.hold and not final:
+                continue
+            stat = os.stat(path)
+            signature = (stat.st_size, stat.st_mtime)
+            if self.uploaded.get(name) == signature:
+                continue
+            if final or self.pending.get(name) == signature:
+                self._queue(name, path, signature)
+            else:
+                self.pending[name] = signature
+
+    def _optimizer_step(self, mtime):
+        """
+        Step of the optimizer state written at mtime: ai-toolkit saves the
+        step checkpoint first, so it is the newest checkpoint not newer than it.
+        """
+        steps = []
+        for name in os.listdir(self.watch_dir):
+            step = checkpoint_step(name)
+            if step is not None and os.path.getmtime(os.path.join(self.watch_dir, name)) <= mtime:
+                steps.append(step)
+        return max(steps, default=None)
+
+    def _queue(self, name, path, signature):
+        # One staging folder per queued upload keeps the object name intact even
+        # when a rewritten file is queued while its previous version is in flight
+        staging_dir = os.path.join(self.watch_dir, STAGING_DIR, str(len(self.queued)))
+        os.makedirs(staging_dir, exist_ok=True)
+        upload_name = name
+        if name in OPTIMIZER_NAMES:
+            step = self._optimizer_step(signature[1])
+            if step is None:
+                logging.warning(f"No checkpoint matches {name}, it will not be used to resume")
+            else:
+                upload_name = optimizer_name(step)
+        staged_path = os.path.join(staging_dir, upload_name)
+        try:
+            if name in OPTIMIZER_NAMES:
+                shutil.copyfile(path, staged_path)
+            else:
+                os.link(path, staged_path)
+        except OSError:
+            staged_path = path
+            upload_name = name
+        self.uploaded[name] = signature
+        self.pending.pop(name, None)
+        self.queued.append(upload_name)
+        logging.info(f"Queueing checkpoint upload: {upload_name}")
+
+        def task():
+            try:
+                result = upload(file_path=staged_path, async_upload=False, **self.upload_kwargs)
+                if result[0] and self.on_upload is not None:
+                    try:
+                        self.on_upload(upload_name)
+                    except Exception as e:
+                        logging.error(f"Upload callback for {upload_name} failed: {e}")
+                return result
+            finally:
+                if staged_path != path:
+                    shutil.rmtree(staging_dir, ignore_errors=True)
+
+        self.upload_queue.submit(task)
+
+    def finish(self):
+        """
+        Stops watching, queues whatever the trainer left behind and waits for all
+        uploads. Returns {file name: (success, message)} for every uploaded file.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.scan(final=True)
+        results = self.upload_queue.join()
+        return dict(zip(self.queued, results))
@@ -1,33 +1,241 @@
 import argparse
+import base64
+import hashlib
 import logging
-from typing import Union, Tuple
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Optional, Union, Tuple
 from pathlib import Path
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import threading
+from telemetry import span
 
 # from library.utils import fire_in_thread, setup_logging
 
+# Multipart transfer tuning
+DEFAULT_CHUNK_SIZE = int(os.environ.get("R2_UPLOAD_CHUNK_SIZE", 64 * 1024 * 1024))
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("R2_UPLOAD_CONCURRENCY", 8))
+MIN_CHUNK_SIZE = 5 * 1024 * 1024  # S3/R2 minimum size for every part but the last
+# Concurrent list requests when a listing fans out over sub-prefixes
+DEFAULT_LIST_CONCURRENCY = int(os.environ.get("R2_LIST_CONCURRENCY", 8))
 
-def fire_in_thread(f, *args, **kwargs):
-    threading.Thread(target=f, args=args, kwargs=kwargs).start()
 
-# Setup logging
-def setup_logging():
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-    logger = logging.getLogger(__name__)
-    return logger
+class UploadQueue:
+    """
+    Background upload queue. Unlike a fire-and-forget thread, every submitted
+    upload is tracked so callers can join the queue and inspect the results.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="r2-upload")
+        self.futures = []
+        self.lock = threading.Lock()
+
+    def submit(self, f, *args, **kwargs) -> Future:
+        future = self.executor.submit(f, *args, **kwargs)
+        with self.lock:
+            self.futures.append(future)
+        return future
+
+    def join(self) -> list:
+        """
+        Waits for every upload submitted so far and returns their (success, message)
+        results in submission order. Errors are logged and reported as failures.
+        """
+        with self.lock:
+            futures, self.futures = self.futures, []
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f"Background upload failed: {e}")
+                results.append((False, str(e)))
+        for success, message in results:
+            if not success:
+                logger.error(f"Background upload failed: {message}")
+        return results
+
+
+_default_upload_queue = None
+_default_upload_queue_lock = threading.Lock()
+
+
+def get_upload_queue() -> UploadQueue:
+    global _default_upload_queue
+    with _default_upload_queue_lock:
+        if _default_upload_queue is None:
+            _default_upload_queue = UploadQueue()
+        return _default_upload_queue
 
-setup_logging()
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=None)
 def get_r2_client(access_key_id: str, secret_access_key: str, endpoint_url: str):
+    # Clients are thread-safe, so one per credential set is shared by all uploads
     return boto3.client(
         's3',
         endpoint_url=endpoint_url,
         aws_access_key_id=access_key_id,
-        aws_secret_access_key=secret_access_key
+        aws_secret_access_key=secret_access_key,
+        config=Config(max_pool_connections=max(10, DEFAULT_MAX_CONCURRENCY * 2))
+    )
+
+
+def _read_part(path: Path, offset: int, size: int) -> bytes:
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def _md5(data: bytes) -> Tuple[str, str]:
+    digest = hashlib.md5(data).digest()
+    return digest.hex(), base64.b64encode(digest).decode()
+
+
+def file_etag(path: Path, chunk_size: int = DEFAULT_CHUNK_SIZE) -> str:
+    """
+    The ETag multipart_upload produces for path: the MD5 for a single put, or
+    the MD5 of the part digests followed by "-<parts>" for a multipart upload.
+    """
+    chunk_size = max(chunk_size, MIN_CHUNK_SIZE)
+    file_size = path.stat().st_size
+    digests = []
+    with open(path, 'rb') as f:
+        for _ in range(max(1, (file_size + chunk_size - 1) // chunk_size)):
+            digests.append(hashlib.md5(f.read(chunk_size)).digest())
+    if file_size <= chunk_size:
+        return digests[0].hex()
+    return f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+
+def _find_pending_upload(client, bucket_name: str, object_key: str) -> Optional[str]:
+    """
+    Returns the id of the most recent unfinished multipart upload for object_key.
+    """
+    response = client.list_multipart_uploads(Bucket=bucket_name, Prefix=object_key)
+    uploads = [u for u in response.get('Uploads', []) if u['Key'] == object_key]
+    if not uploads:
+        return None
+    return max(uploads, key=lambda u: u['Initiated'])['UploadId']
+
+
+def _list_parts(client, bucket_name: str, object_key: str, upload_id: str) -> dict:
+    parts = {}
+    paginator = client.get_paginator('list_parts')
+    for page in paginator.paginate(Bucket=bucket_name, Key=object_key, UploadId=upload_id):
+        for part in page.get('Parts', []):
+            parts[part['PartNumber']] = part
+    return parts
+
+
+def multipart_upload(
+    client,
+    bucket_name: str,
+    src_path: Path,
+    object_key: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    progress_callback: Optional[Callable[[int, int], None]] = None
+) -> dict:
+    """
+    Uploads src_path in parallel parts, resuming an interrupted multipart upload
+    of the same key when one exists. Every request carries the data's
+    Content-MD5, which the server verifies before storing it; ETags are not
+    compared with the MD5, since R2 and encrypted S3 objects need not use it.
+    Returns transfer stats: bytes, bytes_resumed, seconds, throughput and the object's ETag.
+    """
+    chunk_size = max(chunk_size, MIN_CHUNK_SIZE)
+    file_size = src_path.stat().st_size
+    start = time.perf_counter()
+    done = {"bytes": 0}
+    lock = threading.Lock()
+
+    def report(n: int):
+        with lock:
+            done["bytes"] += n
+            transferred = done["bytes"]
+        if progress_callback is not None:
+            progress_callback(transferred, file_size)
+
+    # Small files go up in a single checked request
+    if file_size <= chunk_size:
+        data = src_path.read_bytes()
+        _, md5_b64 = _md5(data)
+        response = client.put_object(Bucket=bucket_name, Key=object_key, Body=data, ContentMD5=md5_b64)
+        report(file_size)
+        seconds = time.perf_counter() - start
+        return {
+            "bytes": file_size,
+            "bytes_resumed": 0,
+            "seconds": seconds,
+            "bytes_per_second": file_size / seconds if seconds else None,
+            "etag": response['ETag'].strip('"')
+        }
+
+    part_count = (file_size + chunk_size - 1) // chunk_size
+    upload_id = _find_pending_upload(client, bucket_name, object_key)
+    existing = {}
+    if upload_id is not None:
+        existing = _list_parts(client, bucket_name, object_key, upload_id)
+        logger.info(f"Resuming multipart upload of {object_key} ({len(existing)}/{part_count} parts present)")
+    else:
+        upload_id = client.create_multipart_upload(Bucket=bucket_name, Key=object_key)['UploadId']
+
+    def send_part(part_number: int) -> dict:
+        offset = (part_number - 1) * chunk_size
+        data = _read_part(src_path, offset, chunk_size)
+        md5_hex, md5_b64 = _md5(data)
+        previous = existing.get(part_number)
+        # Only an MD5 ETag proves a pending part intact; any other is sent again
+        if previous is not None and previous['Size'] == len(data) and previous['ETag'].strip('"') == md5_hex:
+            report(len(data))
+            return {"PartNumber": part_number, "ETag": previous['ETag'], "resumed": len(data)}
+        response = client.upload_part(
+            Bucket=bucket_name,
+            Key=object_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data,
+            ContentMD5=md5_b64
+        )
+        report(len(data))
+        return {"PartNumber": part_number, "ETag": response['ETag'], "resumed": 0}
+
+    # Parts that fail leave the upload pending so a later call can resume it
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        parts = list(executor.map(send_part, range(1, part_count + 1)))
+
+    response = client.complete_multipart_upload(
+        Bucket=bucket_name,
+        Key=object_key,
+        UploadId=upload_id,
+        MultipartUpload={"Parts": [{"PartNumber": p["PartNumber"], "ETag": p["ETag"]} for p in parts]}
     )
+    seconds = time.perf_counter() - start
+    resumed = sum(p["resumed"] for p in parts)
+    sent = file_size - resumed
+    return {
+        "bytes": file_size,
+        "bytes_resumed": resumed,
+        "seconds": seconds,
+        "bytes_per_second": sent / seconds if seconds else None,
+        "etag": response['ETag'].strip('"')
+    }
+
+
+def _index_contains(index, object_key: str, src_path: Path, chunk_size: int) -> bool:
+    # The index only ever saves work; when it cannot answer, upload
+    try:
+        return index.contains_file(object_key, src_path, chunk_size)
+    except Exception as e:
+        logger.warning(f"Artifact index lookup of {object_key} failed, uploading: {e}")
+        return False
+
 
 def upload(
     bucket_name: str,
@@ -37,8 +245,22 @@ def upload(
     file_path: Union[str, Path],
     r2_path_in_bucket: str,
     unique_id: str,
-    async_upload: bool = False
+    async_upload: bool = False,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    upload_queue: Optional[UploadQueue] = None,
+    metrics=None,
+    index=None
 ) -> Union[Tuple[bool, str], None]:
+    """
+    Uploads file_path to <r2_path_in_bucket>/<unique_id>/<file name>.
+    With async_upload the upload is queued on upload_queue (or the shared
+    queue) and None is returned; join the queue to collect the result.
+    metrics, if given, is a JobMetrics that records an upload span. index,
+    if given, is an ArtifactIndex: files it holds unchanged are not sent
+    again, and uploaded files are recorded in it.
+    """
     client = get_r2_client(access_key_id, secret_access_key, endpoint_url)
 
     def uploader() -> Tuple[bool, str]:
@@ -46,11 +268,34 @@ def upload(
             src_path = Path(file_path)
             if not src_path.exists():
                 raise FileNotFoundError(f"File not found: {file_path}")
-            
+
             object_key = f"{r2_path_in_bucket}/{unique_id}/{src_path.name}"
-            
-            client.upload_file(str(src_path), bucket_name, object_key)
-            logger.info(f"Upload successful: {file_path} -> {bucket_name}/{object_key}")
+            if index is not None and _index_contains(index, object_key, src_path, chunk_size):
+                logger.info(f"Skipping upload of {file_path}: {bucket_name}/{object_key} is identical")
+                return True, "Already uploaded"
+
+            with span(metrics, "upload", file=src_path.name) as record:
+                stats = multipart_upload(
+                    client,
+                    bucket_name,
+                    src_path,
+                    object_key,
+                    chunk_size=chunk_size,
+                    max_concurrency=max_concurrency,
+                    progress_callback=progress_callback
+                )
+                record.update(bytes=stats["bytes"], bytes_resumed=stats["bytes_resumed"])
+            if index is not None:
+                try:
+                    index.record(object_key, stats["bytes"], stats["etag"])
+                except OSError as e:
+                    logger.warning(f"Failed to record {object_key} in the artifact index: {e}")
+            throughput = stats["bytes_per_second"] or 0
+            logger.info(
+                f"Upload successful: {file_path} -> {bucket_name}/{object_key} "
+                f"({stats['bytes']} bytes in {stats['seconds']:.2f}s, {throughput / 1024 ** 2:.1f} MiB/s, "
+                f"{stats['bytes_resumed']} bytes resumed)"
+            )
             return True, "Upload successful"
         except ClientError as e:
             error_msg = f"Failed to upload to R2: {str(e)}"
@@ -64,22 +309,60 @@ def upload(
             return False, error_msg
 
     if async_upload:
-        fire_in_thread(uploader)
+        (upload_queue or get_upload_queue()).submit(uploader)
         return None
     else:
         return uploader()
 
+def _list_pages(client, bucket_name: str, prefix: str, delimiter: Optional[str] = None) -> Tuple[list, list]:
+    """
+    Returns (objects, common prefixes) under prefix, following continuation
+    tokens past the 1000 keys a single list_objects_v2 call returns.
+    """
+    kwargs = {"Bucket": bucket_name, "Prefix": prefix}
+    if delimiter is not None:
+        kwargs["Delimiter"] = delimiter
+    objects, prefixes = [], []
+    for page in client.get_paginator('list_objects_v2').paginate(**kwargs):
+        objects.extend(page.get('Contents', []))
+        prefixes.extend(p['Prefix'] for p in page.get('CommonPrefixes', []))
+    return objects, prefixes
+
+
+def list_prefixes(client, bucket_name: str, prefixes: list, max_workers: int = DEFAULT_LIST_CONCURRENCY) -> dict:
+    """
+    Lists several prefixes concurrently. Returns {prefix: [objects]}.
+    """
+    if not prefixes:
+        return {}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(prefixes))), thread_name_prefix="r2-list") as executor:
+        return dict(zip(prefixes, executor.map(lambda prefix: _list_pages(client, bucket_name, prefix)[0], prefixes)))
+
+
+def list_tree(client, bucket_name: str, prefix: str, max_workers: int = DEFAULT_LIST_CONCURRENCY) -> dict:
+    """
+    Lists everything under prefix. One delimited listing finds the folders
+    directly below it (the model ids under Loras/), which are then listed
+    concurrently. Returns {folder: [objects]}, with the objects directly under
+    prefix keyed by prefix itself.
+    """
+    objects, folders = _list_pages(client, bucket_name, prefix, delimiter="/")
+    listing = list_prefixes(client, bucket_name, folders, max_workers)
+    listing[prefix] = objects
+    return listing
+
+
 def list_objects(
     bucket_name: str,
     prefix: str,
     access_key_id: str,
     secret_access_key: str,
     endpoint_url: str,
-):
+    max_workers: int = DEFAULT_LIST_CONCURRENCY
+) -> list:
+    """
+    Every object under prefix, however many there are. Errors raise
+    (ClientError, BotoCoreError) rather than looking like an empty prefix.
+    """
     client = get_r2_client(access_key_id, secret_access_key, endpoint_url)
-    try:
-        response = client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-        return response.get('Contents', [])
-    except Exception as e:
-        logger.error(f"Failed to list objects in R2 bucket: {e}")
-        return []
\ No newline at end of file
+    return [obj for objects in list_tree(client, bucket_name, prefix, max_workers).values() for obj in objects]
@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import time
+import struct
+from dataclasses import dataclass
+import numpy as np
+
+# Defaults for the final LoRA; step checkpoints keep the trainer's dtype so resumed runs lose nothing
+DEFAULT_DTYPE = os.environ.get("COMPACT_DTYPE", "float16")
+# Layers whose update is this small relative to the largest one are dropped
+DEFAULT_DROP_THRESHOLD = float(os.environ.get("COMPACT_DROP_THRESHOLD", 1e-6))
+
+# safetensors dtype names; BF16 has no numpy type and is handled as raw uint16
+SAFETENSORS_DTYPES = {
+    "F64": np.float64, "F32": np.float32, "F16": np.float16, "BF16": np.uint16,
+    "I64": np.int64, "I32": np.int32, "I16": np.int16, "I8": np.int8, "U8": np.uint8, "BOOL": np.bool_,
+}
+# Keys match training_config.DTYPE_BYTES, which the job input is validated against
+TARGET_DTYPES = {"float32": "F32", "fp32": "F32", "float16": "F16", "fp16": "F16", "bf16": "BF16", "bfloat16": "BF16"}
+SAFETENSORS_NAMES = {np.dtype(value): key for key, value in SAFETENSORS_DTYPES.items() if key != "BF16"}
+
+# (down, up) weight suffixes of the LoRA formats ai-toolkit can write
+LORA_SUFFIXES = ((".lora_A.weight", ".lora_B.weight"), (".lora_down.weight", ".lora_up.weight"))
+ALPHA_SUFFIX = ".alpha"
+
+
+@dataclass
+class CompactionSettings:
+    """
+    What to do to the final LoRA before upload. rank caps every layer's rank
+    and energy keeps the smallest rank that holds that fraction of a layer's
+    squared singular values; 0 and 1.0 leave ranks alone.
+    """
+    dtype: str = DEFAULT_DTYPE
+    rank: int = 0
+    energy: float = 1.0
+    drop_threshold: float = DEFAULT_DROP_THRESHOLD
+
+    def validate(self):
+        if self.dtype not in TARGET_DTYPES:
+            raise ValueError(f"Unknown LoRA dtype {self.dtype!r}, expected one of {sorted(TARGET_DTYPES)}")
+        if self.rank < 0:
+            raise ValueError(f"rank must not be negative, got {self.rank}")
+        if not 0.0 < self.energy <= 1.0:
+            raise ValueError(f"energy must be in (0, 1], got {self.energy}")
+
+
+def bf16_to_float32(values):
+    return (values.astype(np.uint32) << 16).view(np.float32)
+
+
+def float32_to_bf16(values):
+    # Round to nearest even on the 16 dropped mantissa bits
+    bits = np.ascontiguousarray(values, dtype=np.float32).reshape(np.shape(values)).view(np.uint32)
+    rounding = ((bits >> 16) & 1) + np.uint32(0x7FFF)
+    return ((bits + rounding) >> 16).astype(np.uint16)
+
+
+def _round(array, dtype):
+    if array.dtype.kind != "f":
+        return array
+    if dtype == "BF16":
+        return bf16_to_float32(float32_to_bf16(array))
+    return array.astype(SAFETENSORS_DTYPES[dtype]).astype(np.float32)
+
+
+def read_safetensors(path):
+    """
+    Returns ({name: array}, metadata). BF16 tensors are widened to float32.
+    """
+    with open(path, 'rb') as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+        data = f.read()
+    metadata = header.pop("__metadata__", None) or {}
+    tensors = {}
+    for name, info in header.items():
+        if info["dtype"] not in SAFETENSORS_DTYPES:
+            raise ValueError(f"Unsupported safetensors dtype {info['dtype']} for {name}")
+        begin, end = info["data_offsets"]
+        array = np.frombuffer(data[begin:end], dtype=SAFETENSORS_DTYPES[info["dtype"]]).reshape(info["shape"])
+        tensors[name] = bf16_to_float32(array) if info["dtype"] == "BF16" else array
+    return tensors, metadata
+
+
+def write_safetensors(path, tensors, metadata=None, dtype=None):
+    """
+    Writes tensors to path atomically, converting floating tensors to dtype
+    ("F16", "BF16", ...) when given.
+    """
+    header = {"__metadata__": metadata} if metadata else {}
+    chunks = []
+    offset = 0
+    for name in sorted(tensors):
+        array = tensors[name]
+        if array.dtype.kind == "f" and dtype is not None:
+            name_dtype = dtype
+            array = float32_to_bf16(array) if dtype == "BF16" else array.astype(SAFETENSORS_DTYPES[dtype])
+        else:
+            name_dtype = SAFETENSORS_NAMES[array.dtype]
+        raw = np.ascontiguousarray(array).tobytes()
+        header[name] = {"dtype": name_dtype, "shape": list(array.shape), "data_offsets": [offset, offset + len(raw)]}
+        chunks.append(raw)
+        offset += len(raw)
+    encoded = json.dumps(header, separators=(",", ":")).encode()
+    # safetensors pads the header so the tensor data starts 8-byte aligned
+    encoded += b" " * (-len(encoded) % 8)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(struct.pack("<Q", len(encoded)))
+        f.write(encoded)
+        for raw in chunks:
+            f.write(raw)
+    os.replace(tmp_path, path)
+
+
+def find_layers(tensors):
+    """
+    Groups LoRA tensors by layer: {prefix: (down key, up key, alpha key or None)}.
+    """
+    layers = {}
+    for name in tensors:
+        for down_suffix, up_suffix in LORA_SUFFIXES:
+            if name.endswith(down_suffix):
+                prefix = name[:-len(down_suffix)]
+                if prefix + up_suffix in tensors:
+                    alpha = prefix + ALPHA_SUFFIX
+                    layers[prefix] = (name, prefix + up_suffix, alpha if alpha in tensors else None)
+    return layers
+
+
+def _factors(tensors, down_key, up_key, alpha_key):
+    """
+    The layer update as float64 (up, down) with up @ down == scale * B @ A.
+    """
+    down = tensors[down_key].astype(np.float64)
+    rank = down.shape[0]
+    scale = float(tensors[alpha_key].reshape(-1)[0]) / rank if alpha_key is not None else 1.0
+    up = tensors[up_key].astype(np.float64)
+    return up.reshape(up.shape[0], -1) * scale, down.reshape(rank, -1)
+
+
+def _inner(up1, down1, up2, down2):
+    # Frobenius inner product <up1 @ down1, up2 @ down2> without forming either matrix
+    return float(np.trace((up1.T @ up2) @ (down2 @ down1.T)))
+
+
+def _keep_rank(singular_values, rank, energy):
+    keep = len(singular_values)
+    if energy < 1.0:
+        squared = singular_values ** 2
+        cumulative = np.cumsum(squared) / max(squared.sum(), np.finfo(np.float64).tiny)
+        keep = int(np.searchsorted(cumulative, energy)) + 1
+    if rank:
+        keep = min(keep, rank)
+    return max(1, min(keep, len(singular_values)))
+
+
+def resize_layer(up, down, rank=0, energy=1.0):
+    """
+    SVD of the rank-r update up @ down, computed from QR factors so the full
+    weight-sized matrix is never formed. Returns (up, down) truncated to the
+    chosen rank with the singular values split evenly between them.
+    """
+    q_up, r_up = np.linalg.qr(up)
+    q_down, r_down = np.linalg.qr(down.T)
+    u, s, vt = np.linalg.svd(r_up @ r_down.T)
+    keep = _keep_rank(s, rank, energy)
+    root = np.sqrt(s[:keep])
+    return (q_up @ u[:, :keep]) * root, (root[:, None] * vt[:keep]) @ q_down.T
+
+
+def compact_lora(src, dst=None, settings=None):
+    """
+    Converts a LoRA safetensors file to settings.dtype, drops near-zero layers
+    and optionally reduces ranks, writing dst (src, in place, by default).
+    Returns a report with the sizes and the relative Frobenius error of the
+    compacted updates against the originals, after the dtype conversion.
+    """
+    settings = settings or CompactionSettings()
+    settings.validate()
+    dst = dst or src
+    start = time.perf_counter()
+    bytes_before = os.path.getsize(src)
+    tensors, metadata = read_safetensors(src)
+    dtype = TARGET_DTYPES[settings.dtype]
+    layers = find_layers(tensors)
+
+    # Layers are processed one at a time; float64 copies of a full-model LoRA would not fit in memory
+    norms = {}
+    for prefix, keys in layers.items():
+        up, down = _factors(tensors, *keys)
+        norms[prefix] = np.sqrt(max(_inner(up, down, up, down), 0.0))
+    largest = max(norms.values(), default=0.0)
+
+    squared_errors = {}
+    ranks_before, ranks_after = [], []
+    for prefix, (down_key, up_key, alpha_key) in layers.items():
+        ranks_before.append(tensors[down_key].shape[0])
+        if norms[prefix] < settings.drop_threshold * largest:
+            for key in (down_key, up_key, alpha_key):
+                tensors.pop(key, None)
+            squared_errors[prefix] = norms[prefix] ** 2
+            continue
+        original_up, original_down = _factors(tensors, down_key, up_key, alpha_key)
+        if settings.rank or settings.energy < 1.0:
+            up, down = resize_layer(original_up, original_down, settings.rank, settings.energy)
+            rank = down.shape[0]
+            # The factors now carry the alpha/rank scale, so alpha becomes the rank
+            up_shape, down_shape = tensors[up_key].shape, tensors[down_key].shape
+            tensors[up_key] = up.reshape((up_shape[0], rank) + tuple(up_shape[2:])).astype(np.float32)
+            tensors[down_key] = down.reshape((rank,) + tuple(down_shape[1:])).astype(np.float32)
+            if alpha_key is not None:
+                tensors[alpha_key] = np.full(tensors[alpha_key].shape, rank, dtype=np.float32)
+        ranks_after.append(tensors[down_key].shape[0])
+
+        # Measure the error of what is actually written, i.e. after rounding to the target dtype
+        rounded = {key: _round(tensors[key], dtype) for key in (down_key, up_key, alpha_key) if key is not None}
+        up, down = _factors(rounded, down_key, up_key, alpha_key)
+        squared_errors[prefix] = max(0.0, norms[prefix] ** 2 + _inner(up, down, up, down) - 2 * _inner(original_up, original_down, up, down))
+
+    if ranks_after != ranks_before and metadata.get("ss_network_dim"):
+        metadata = {**metadata, "ss_network_dim": str(max(ranks_after)) if len(set(ranks_after)) == 1 else "Dynamic"}
+    write_safetensors(dst, tensors, metadata, dtype)
+
+    bytes_after = os.path.getsize(dst)
+    total = np.sqrt(sum(norm ** 2 for norm in norms.values()))
+    layer_errors = [np.sqrt(error) / norms[prefix] for prefix, error in squared_errors.items() if norms[prefix] > 0]
+    return {
+        "dtype": settings.dtype,
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "reduction": 1 - bytes_after / bytes_before if bytes_before else 0.0,
+        "layers": len(layers),
+        "dropped": len(layers) - len(ranks_after),
+        "rank_before": max(ranks_before, default=None),
+        "rank_after": max(ranks_after, default=None),
+        "relative_error": float(np.sqrt(sum(squared_errors.values())) / total) if total > 0 else 0.0,
+        "max_layer_error": float(max(layer_errors, default=0.0)),
+        "seconds": time.perf_counter() - start,
+    }
+
+
+if __name__ == "__main__":
+    # python compaction.py <lora.safetensors> <out.safetensors> [dtype] [rank] [energy]
+    if len(sys.argv) < 3:
+        sys.exit("usage: compaction.py <lora.safetensors> <out.safetensors> [dtype] [rank] [energy]")
+    options = CompactionSettings(
+        dtype=sys.argv[3] if len(sys.argv) > 3 else DEFAULT_DTYPE,
+        rank=int(sys.argv[4]) if len(sys.argv) > 4 else 0,
+        energy=float(sys.argv[5]) if len(sys.argv) > 5 else 1.0
+    )
+    print(json.dumps(compact_lora(sys.argv[1], sys.argv[2], options), indent=2))
@@ -0,0 +1,231 @@
+import os
+import sys
+import json
+import logging
+import threading
+from training_config import DTYPE_BYTES, lora_parameters
+from workspace import estimate_footprint
+
+# Fitted coefficients are stored here by "python cost_model.py fit"
+DEFAULT_MODEL_PATH = os.environ.get("COST_MODEL_PATH", os.path.join(os.getcwd(), "cache", "cost_model.json"))
+METRICS_JSONL = os.environ.get("METRICS_JSONL")
+
+# Per-stage linear models: seconds = intercept + sum(coefficient * feature)
+STAGE_TERMS = {
+    "download": ("images",),
+    "preprocess": ("images",),
+    "dedup": ("images",),
+    "caption": ("images",),
+    # Model load, latent caching over every bucket, then the training steps
+    "training": ("cache_megapixels", "step_megapixels"),
+    "upload_wait": ("checkpoint_mb",),
+}
+
+# Uncalibrated coefficients for an A100-class worker, replaced once enough runs are recorded
+PRIORS = {
+    "download": [1.0, 0.3],
+    "preprocess": [0.5, 0.1],
+    "dedup": [0.1, 0.01],
+    "caption": [0.1, 0.01],
+    "training": [90.0, 0.4, 0.75],
+    "upload_wait": [1.0, 0.01],
+}
+PRIOR_PEAK_RSS_MB = 32_000
+PRIOR_DISK_SCALE = 1.0
+
+# Analytic VRAM model for FLUX.1-dev
+TRANSFORMER_GB = {False: 23.8, True: 12.0}  # bf16 / 8-bit quantized
+TEXT_ENCODERS_GB = {False: 9.8, True: 5.0}
+VAE_GB = 0.2
+ACTIVATION_GB_PER_MEGAPIXEL = {True: 3.0, False: 12.0}  # with / without gradient checkpointing
+OPTIMIZER_STATE_BYTES = {"adamw8bit": 2, "adamw": 8, "adamw32bit": 8, "lion": 4, "prodigy": 16}
+
+# Worker limits; jobs estimated to exceed them are rejected
+WORKER_MAX_SECONDS = float(os.environ.get("WORKER_MAX_SECONDS", 0)) or None
+WORKER_VRAM_GB = float(os.environ.get("WORKER_VRAM_GB", 0)) or None
+WORKER_MAX_RSS_MB = float(os.environ.get("WORKER_MAX_RSS_MB", 0)) or None
+
+
+def job_features(params, image_count):
+    """
+    Model inputs derived from a job's ai-toolkit process and image count.
+    """
+    pixels = [resolution ** 2 / 1e6 for resolution in params["datasets"][0]["resolution"]]
+    train = params["train"]
+    save_every = params["save"].get("save_every") or train["steps"]
+    checkpoints = train["steps"] // save_every + 1
+    checkpoint_bytes = lora_parameters(params["network"]) * DTYPE_BYTES.get(params["save"]["dtype"], 4)
+    return {
+        "images": image_count,
+        "steps": train["steps"],
+        "batch_size": train["batch_size"],
+        "cache_megapixels": image_count * sum(pixels),
+        # ai-toolkit spreads steps over the buckets, so a step costs the mean bucket size
+        "step_megapixels": train["steps"] * train["batch_size"] * sum(pixels) / len(pixels),
+        "checkpoint_mb": checkpoints * checkpoint_bytes / 1024 ** 2,
+        "lora_parameters": lora_parameters(params["network"]),
+        "max_megapixels": max(pixels),
+        "quantize": bool(params["model"].get("quantize")),
+        "unload_text_encoder": bool(train.get("unload_text_encoder")),
+        "gradient_checkpointing": bool(train.get("gradient_checkpointing", True)),
+        "optimizer": train["optimizer"],
+        "footprint_estimate": estimate_footprint(params, image_count),
+    }
+
+
+def peak_vram_gb(features):
+    """
+    Base model, text encoders (unless unloaded), LoRA weights with gradients,
+    optimizer state and EMA copy, plus activations for the largest bucket.
+    """
+    quantize = features["quantize"]
+    text_encoders = 0.0 if features["unload_text_encoder"] else TEXT_ENCODERS_GB[quantize]
+    per_parameter = 4 + 4 + OPTIMIZER_STATE_BYTES.get(features["optimizer"], 8) + 4
+    lora = features["lora_parameters"] * per_parameter / 1024 ** 3
+    activations = ACTIVATION_GB_PER_MEGAPIXEL[features["gradient_checkpointing"]] * features["max_megapixels"] * features["batch_size"]
+    return TRANSFORMER_GB[quantize] + text_encoders + VAE_GB + lora + activations
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))]
+
+
+class CostModel:
+    """
+    Predicts per-stage wall-clock time, peak memory and disk use of a job.
+    Stage times are linear in the job features and are fitted by least
+    squares over recorded telemetry (JobMetrics JSONL); stages without enough
+    runs keep the priors. VRAM comes from the analytic model above.
+    """
+
+    def __init__(self, coefficients=None, peak_rss_mb=PRIOR_PEAK_RSS_MB, disk_scale=PRIOR_DISK_SCALE, samples=None):
+        self.coefficients = {stage: list(values) for stage, values in (coefficients or PRIORS).items()}
+        self.peak_rss_mb = peak_rss_mb
+        self.disk_scale = disk_scale
+        self.samples = samples or {}
+
+    @classmethod
+    def fit(cls, records, prior=None):
+        """
+        Fits the model to telemetry records (JobMetrics.to_dict() with
+        "features"). Coefficients are clipped at zero so sparse data cannot
+        predict negative time.
+        """
+        import numpy as np
+        prior = prior or cls()
+        records = [record for record in records if record.get("features")]
+        coefficients = dict(prior.coefficients)
+        samples = {}
+        for stage, terms in STAGE_TERMS.items():
+            rows, targets = [], []
+            for record in records:
+                seconds = [span["seconds"] for span in record["spans"] if span["name"] == stage and "error" not in span]
+                if seconds:
+                    rows.append([1.0] + [float(record["features"][term]) for term in terms])
+                    targets.append(sum(seconds))
+            samples[stage] = len(rows)
+            if len(rows) < len(terms) + 2:
+                continue
+            solution, *_ = np.linalg.lstsq(np.array(rows), np.array(targets), rcond=None)
+            coefficients[stage] = [max(0.0, float(value)) for value in solution]
+
+        rss = [record["peak_rss_mb"] + record.get("peak_child_rss_mb", 0) for record in records if "peak_rss_mb" in record]
+        ratios = [
+            span["disk_bytes"] / record["features"]["footprint_estimate"]
+            for record in records for span in record["spans"]
+            if span["name"] == "cleanup" and span.get("disk_bytes") and record["features"].get("footprint_estimate")
+        ]
+        return cls(
+            coefficients,
+            peak_rss_mb=_percentile(rss, 95) if rss else prior.peak_rss_mb,
+            disk_scale=_percentile(ratios, 90) if ratios else prior.disk_scale,
+            samples=samples
+        )
+
+    def estimate(self, params, image_count):
+        features = job_features(params, image_count)
+        stages = {}
+        for stage, terms in STAGE_TERMS.items():
+            intercept, *weights = self.coefficients[stage]
+            stages[stage] = intercept + sum(weight * features[term] for weight, term in zip(weights, terms))
+        return {
+            "stages": {stage: round(seconds, 2) for stage, seconds in stages.items()},
+            "total_seconds": round(sum(stages.values()), 2),
+            "peak_vram_gb": round(peak_vram_gb(features), 2),
+            "peak_rss_mb": round(self.peak_rss_mb),
+            "disk_bytes": int(features["footprint_estimate"] * self.disk_scale),
+            "calibrated": {stage: self.samples.get(stage, 0) >= len(terms) + 2 for stage, terms in STAGE_TERMS.items()},
+        }
+
+    def to_dict(self):
+        return {"coefficients": self.coefficients, "peak_rss_mb": self.peak_rss_mb, "disk_scale": self.disk_scale, "samples": self.samples}
+
+    def save(self, path=DEFAULT_MODEL_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=DEFAULT_MODEL_PATH):
+        with open(path) as f:
+            data = json.load(f)
+        # Stages added after the model was fitted fall back to their priors
+        return cls({**PRIORS, **data["coefficients"]}, data["peak_rss_mb"], data["disk_scale"], data.get("samples"))
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+_default_model = None
+_default_model_lock = threading.Lock()
+
+
+def get_cost_model():
+    """
+    The worker's model: the saved fit if there is one, else a fit over
+    METRICS_JSONL, else the priors.
+    """
+    global _default_model
+    with _default_model_lock:
+        if _default_model is None:
+            if os.path.isfile(DEFAULT_MODEL_PATH):
+                _default_model = CostModel.load(DEFAULT_MODEL_PATH)
+            elif METRICS_JSONL and os.path.isfile(METRICS_JSONL):
+                try:
+                    _default_model = CostModel.fit(read_records(METRICS_JSONL))
+                except (OSError, ValueError, KeyError) as e:
+                    logging.error(f"Could not fit cost model from {METRICS_JSONL}: {e}")
+            if _default_model is None:
+                _default_model = CostModel()
+        return _default_model
+
+
+def check_limits(estimate, free_disk_bytes=None):
+    """
+    Returns the worker limits the estimate exceeds as [{limit, estimate, maximum}].
+    """
+    checks = [
+        ("seconds", estimate["total_seconds"], WORKER_MAX_SECONDS),
+        ("vram_gb", estimate["peak_vram_gb"], WORKER_VRAM_GB),
+        ("rss_mb", estimate["peak_rss_mb"], WORKER_MAX_RSS_MB),
+        ("disk_bytes", estimate["disk_bytes"], free_disk_bytes),
+    ]
+    return [
+        {"limit": name, "estimate": value, "maximum": maximum}
+        for name, value, maximum in checks
+        if maximum is not None and value > maximum
+    ]
+
+
+if __name__ == "__main__":
+    # python cost_model.py fit <metrics.jsonl> [model.json]
+    if len(sys.argv) < 3 or sys.argv[1] != "fit":
+        sys.exit("usage: cost_model.py fit <metrics.jsonl> [model.json]")
+    model = CostModel.fit(read_records(sys.argv[2]))
+    model.save(sys.argv[3] if len(sys.argv) > 3 else DEFAULT_MODEL_PATH)
+    print(json.dumps(model.to_dict(), indent=2))
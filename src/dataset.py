@@ -1,32 +1,132 @@
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
 import requests
+from requests.adapters import HTTPAdapter
 
-def download_images(image_urls, dataset_folder_path, trigger_word):
-    # Ensure the dataset folder exists
-    os.makedirs(dataset_folder_path, exist_ok=True)
-    
-    for index, url in enumerate(image_urls):
+# Download tuning
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_TIMEOUT = (5, 60)  # (connect, read) seconds
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5  # seconds, doubled after every failed attempt
+CHUNK_SIZE = 1024 * 1024
+# Downloads are saved under this neutral extension until preprocessing
+RAW_EXTENSION = ".img"
+
+# One pooled keep-alive session per host, shared by all download threads
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url, pool_size=DEFAULT_MAX_WORKERS):
+    host = urlparse(url).netloc
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[host] = session
+        return session
+
+
+def should_retry(status_code):
+    """
+    Whether a failed request may succeed on retry: connection errors and
+    timeouts (no status), rate limiting and server errors. Other client
+    errors will not get better.
+    """
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+def download_file(url, file_path, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    """
+    Streams a single URL to file_path, retrying with exponential backoff.
+    Returns the number of bytes written.
+    """
+    session = get_session(url)
+    tmp_path = f"{file_path}.part"
+    for attempt in range(retries + 1):
         try:
-            # Fetch the image
-            response = requests.get(url)
-            response.raise_for_status()  # Raise an error for bad responses
-
-            # Determine the image extension
-            image_extension = url.split('.')[-1]  # Get the extension from the URL
-            image_name = f"{trigger_word} ({index + 1}).{image_extension}"  # Create the new image name
-            
-            # Define the complete file path
-            file_path = os.path.join(dataset_folder_path, image_name)
-
-            # Write the image to a file
-            with open(file_path, 'wb') as f:
-                f.write(response.content)
-
-            print(f"Downloaded: {file_path}")  # Log the downloaded file
+            with session.get(url, stream=True, timeout=timeout) as response:
+                response.raise_for_status()  # Raise an error for bad responses
+                size = 0
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        f.write(chunk)
+                        size += len(chunk)
+            os.replace(tmp_path, file_path)
+            return size
         except requests.exceptions.RequestException as e:
-            print(f"Failed to download {url}: {e}")  # Log any errors
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            status_code = e.response.status_code if e.response is not None else None
+            if attempt >= retries or not should_retry(status_code):
+                raise
+            time.sleep(backoff * (2 ** attempt))
+
+
+def download_images(
+    image_urls,
+    dataset_folder_path,
+    trigger_word,
+    max_workers=DEFAULT_MAX_WORKERS,
+    timeout=DEFAULT_TIMEOUT,
+    retries=DEFAULT_RETRIES,
+    cache=None
+):
+    """
+    Downloads all images concurrently into dataset_folder_path.
+    When an ImageCache is given, cached images are linked in instead of downloaded.
+    Returns a report with per-image and total timing and cache statistics.
+    """
+    # Ensure the dataset folder exists
+    os.makedirs(dataset_folder_path, exist_ok=True)
 
+    def fetch(index, url):
+        # URL extensions say little (.php, .jfif, none at all); the real format is
+        # sniffed when the image is preprocessed, which also picks the final extension
+        image_name = f"{trigger_word} ({index + 1}){RAW_EXTENSION}"  # Create the new image name
 
+        # Define the complete file path
+        file_path = os.path.join(dataset_folder_path, image_name)
 
+        start = time.perf_counter()
+        if cache is not None:
+            size = cache.get(url, file_path)
+            if size is not None:
+                return {"url": url, "path": file_path, "bytes": size, "seconds": time.perf_counter() - start, "cached": True}
+        size = download_file(url, file_path, timeout=timeout, retries=retries)
+        if cache is not None:
+            # The image is downloaded either way; a cache failure only costs the next job a download
+            try:
+                cache.put(url, file_path)
+            except OSError as e:
+                print(f"Failed to cache {url}: {e}")
+        return {"url": url, "path": file_path, "bytes": size, "seconds": time.perf_counter() - start, "cached": False}
 
+    report = {"downloaded": [], "failed": [], "bytes": 0, "seconds": 0.0, "cache_hits": 0, "cache_misses": 0, "bytes_saved": 0}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(image_urls) or 1))) as executor:
+        futures = {executor.submit(fetch, index, url): url for index, url in enumerate(image_urls)}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                item = future.result()
+                report["downloaded"].append(item)
+                if item["cached"]:
+                    report["cache_hits"] += 1
+                    report["bytes_saved"] += item["bytes"]
+                else:
+                    report["cache_misses"] += 1
+                    report["bytes"] += item["bytes"]
+                print(f"Downloaded: {item['path']} ({item['bytes']} bytes in {item['seconds']:.2f}s)")  # Log the downloaded file
+            except (requests.exceptions.RequestException, OSError) as e:
+                report["failed"].append({"url": url, "error": str(e)})
+                print(f"Failed to download {url}: {e}")  # Log any errors
+    report["seconds"] = time.perf_counter() - start
 
+    return report
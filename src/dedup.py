@@ -0,0 +1,113 @@
+import os
+import json
+import logging
+import numpy as np
+from PIL import Image
+from preprocess import MANIFEST_NAME
+
+HASH_SIZE = 8  # 8x8 low-frequency DCT block -> 64-bit hash
+SAMPLE_SIZE = 32
+# Hashes at most this many bits apart are treated as the same photo
+DEFAULT_MAX_DISTANCE = int(os.environ.get("DEDUP_MAX_DISTANCE", 6))
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+DCT = _dct_matrix(SAMPLE_SIZE)
+
+
+def load_samples(paths):
+    """
+    Loads images as an (N, 32, 32) float32 batch of downscaled grayscale samples.
+    """
+    batch = np.empty((len(paths), SAMPLE_SIZE, SAMPLE_SIZE), dtype=np.float32)
+    for index, path in enumerate(paths):
+        with Image.open(path) as image:
+            image.draft("L", (SAMPLE_SIZE * 4, SAMPLE_SIZE * 4))  # cheap JPEG downscale on decode
+            batch[index] = np.asarray(image.convert("L").resize((SAMPLE_SIZE, SAMPLE_SIZE), Image.BILINEAR), dtype=np.float32)
+    return batch
+
+
+def phash(batch):
+    """
+    Perceptual hashes for a batch of samples, computed for the whole batch at
+    once. Returns an (N, 64) bool array of hash bits.
+    """
+    coefficients = np.einsum("ij,njk,lk->nil", DCT, batch, DCT)[:, :HASH_SIZE, :HASH_SIZE]
+    coefficients = coefficients.reshape(len(batch), -1)
+    # Compare against the median of the AC terms; the DC term only encodes brightness
+    median = np.median(coefficients[:, 1:], axis=1, keepdims=True)
+    return coefficients > median
+
+
+def hamming_matrix(bits):
+    """
+    Pairwise Hamming distances between hashes, as two matrix products.
+    """
+    ones = bits.astype(np.float32)
+    zeros = 1.0 - ones
+    return (ones @ zeros.T + zeros @ ones.T).astype(np.int32)
+
+
+def find_duplicates(bits, sizes, max_distance=DEFAULT_MAX_DISTANCE):
+    """
+    Groups near-identical images. The largest image of each group is kept.
+    Returns {duplicate index: (kept index, distance)}.
+    """
+    distances = hamming_matrix(bits)
+    order = sorted(range(len(bits)), key=lambda i: -sizes[i])
+    kept = []
+    duplicates = {}
+    for index in order:
+        if kept:
+            nearest = min(kept, key=lambda k: distances[index, k])
+            if distances[index, nearest] <= max_distance:
+                duplicates[index] = (nearest, int(distances[index, nearest]))
+                continue
+        kept.append(index)
+    return duplicates
+
+
+def deduplicate_images(dataset_folder_path, max_distance=DEFAULT_MAX_DISTANCE, remove=True):
+    """
+    Finds exact and near-duplicate images among the preprocessed images listed
+    in the dataset's manifest and, with remove=True, deletes them. ai-toolkit
+    has no per-image loss weights, so duplicates are dropped rather than
+    down-weighted. Returns a report of the duplicates found.
+    """
+    manifest_path = os.path.join(dataset_folder_path, MANIFEST_NAME)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    images = manifest["images"]
+    report = {"max_distance": max_distance, "removed": remove, "duplicates": []}
+    if len(images) < 2:
+        return report
+
+    paths = [os.path.join(dataset_folder_path, image["file"]) for image in images]
+    bits = phash(load_samples(paths))
+    sizes = [image["width"] * image["height"] for image in images]
+    duplicates = find_duplicates(bits, sizes, max_distance)
+
+    for index, (kept, distance) in sorted(duplicates.items()):
+        report["duplicates"].append({
+            "file": images[index]["file"],
+            "duplicate_of": images[kept]["file"],
+            "distance": distance,
+            "exact": images[index]["sha256"] == images[kept]["sha256"],
+        })
+        logging.info(f"Duplicate image {images[index]['file']} of {images[kept]['file']} (distance {distance})")
+
+    if remove and duplicates:
+        for index in duplicates:
+            os.remove(paths[index])
+        manifest["images"] = [image for index, image in enumerate(images) if index not in duplicates]
+        manifest["duplicates"] = report["duplicates"]
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+    return report
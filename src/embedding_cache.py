@@ -0,0 +1,156 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+# Text-encoder outputs cached on local disk, shared across jobs
+DEFAULT_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", os.path.join(os.getcwd(), "cache", "embeddings"))
+DEFAULT_MAX_BYTES = int(os.environ.get("EMBEDDING_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+MEMORY_ENTRIES = 64
+
+
+def _to_cpu(value):
+    # Tensors and ai-toolkit's PromptEmbeds both expose detach()/to()
+    if hasattr(value, "detach"):
+        value = value.detach()
+    if hasattr(value, "to"):
+        value = value.to("cpu")
+    return value
+
+
+class EmbeddingCache:
+    """
+    Disk cache of text-encoder outputs keyed by (encoder id, text). Since the
+    text encoders are frozen (train_text_encoder is False), an embedding never
+    changes for a given caption and can be reused by every job.
+
+    Only the warm worker (WARM_WORKER=1) uses it, by routing ai-toolkit's
+    encode_prompt through cached(). Jobs run by run.py encode as ai-toolkit
+    does; there cache_text_embeddings only sets unload_text_encoder.
+    benchmarks/bench_embedding_cache.py checks it with a small CPU encoder.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Bytes on disk as of the last prune plus this process's writes since
+        self.total_bytes = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, encoder_id, text):
+        encoder_key = hashlib.sha256(encoder_id.encode()).hexdigest()[:16]
+        text_key = hashlib.sha256(text.encode()).hexdigest()
+        return os.path.join(self.cache_dir, encoder_key, f"{text_key}.pt")
+
+    def get(self, encoder_id, text):
+        import torch
+        path = self.path(encoder_id, text)
+        with self.lock:
+            if path in self.memory:
+                self.memory.move_to_end(path)
+                self.hits += 1
+                return self.memory[path]
+        try:
+            value = torch.load(path, map_location="cpu", weights_only=False)
+        except (OSError, EOFError, RuntimeError):
+            with self.lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass  # pruned by another worker since it was loaded; the value is still good
+        with self.lock:
+            self.hits += 1
+            self._remember(path, value)
+        return value
+
+    def put(self, encoder_id, text, value):
+        import torch
+        value = _to_cpu(value)
+        path = self.path(encoder_id, text)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique per thread, since other workers may cache the same text concurrently
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        torch.save(value, tmp_path)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self._remember(path, value)
+            if self.total_bytes is not None:
+                self.total_bytes += size
+            over_limit = self.total_bytes is None or self.total_bytes > self.max_bytes
+        if over_limit:
+            self.prune()
+        return value
+
+    def _remember(self, path, value):
+        self.memory[path] = value
+        self.memory.move_to_end(path)
+        while len(self.memory) > MEMORY_ENTRIES:
+            self.memory.popitem(last=False)
+
+    @staticmethod
+    def key(prompt, args=(), kwargs=None):
+        """
+        Text the cache is keyed on for an encoder call. Returns None when the
+        call's arguments cannot be serialized and so cannot be cached.
+        """
+        try:
+            return json.dumps([prompt, list(args), kwargs or {}], sort_keys=True)
+        except TypeError:
+            return None
+
+    def cached(self, encoder_id, encode_fn, to_device=None, uncacheable=None):
+        """
+        Wraps encode_fn(prompt, *args, **kwargs) so repeated calls are served
+        from the cache, within max_bytes. to_device, if given, prepares a cached CPU value for the
+        model; uncacheable(prompt, args, kwargs) can veto caching a call, e.g.
+        when caption dropout makes the result random.
+        """
+        def encode(prompt, *args, **kwargs):
+            key = self.key(prompt, args, kwargs)
+            if key is None or (uncacheable is not None and uncacheable(prompt, args, kwargs)):
+                return encode_fn(prompt, *args, **kwargs)
+            value = self.get(encoder_id, key)
+            if value is None:
+                value = self.put(encoder_id, key, encode_fn(prompt, *args, **kwargs))
+            return to_device(value) if to_device is not None else value
+        return encode
+
+    def prune(self):
+        """
+        Removes the least recently used embeddings until the cache fits in
+        max_bytes. Files other processes remove meanwhile are skipped.
+        """
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue  # being written by put
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                logging.info(f"Evicted {path} from embedding cache")
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self.lock:
+                self.memory.pop(path, None)
+        with self.lock:
+            self.total_bytes = total
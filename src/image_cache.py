@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+# Persistent cache of downloaded images shared across jobs
+DEFAULT_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", os.path.join(os.getcwd(), "cache", "images"))
+DEFAULT_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def link_or_copy(src, dst):
+    """
+    Hardlinks src to dst, falling back to a symlink and then a plain copy.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.abspath(src), dst)
+        return
+    except OSError:
+        pass
+    shutil.copyfile(src, dst)
+
+
+class ImageCache:
+    """
+    Content-addressed image store. Blobs live under blobs/<sha256> and an
+    index maps source URLs to blobs; the least recently used blobs are
+    evicted once the cache grows past max_bytes. The folder may be shared by
+    several processes: every index update re-reads index.json under an
+    exclusive flock on the .lock file.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.blob_dir = os.path.join(cache_dir, "blobs")
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock_path = os.path.join(cache_dir, ".lock")
+        self.lock = threading.Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+        with self._locked():
+            self.index = self._load_index()
+            self._evict()
+            self._save_index()
+
+    @contextmanager
+    def _locked(self):
+        """
+        Serializes index updates across threads and processes.
+        """
+        with self.lock, open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        index.setdefault("urls", {})
+        index.setdefault("blobs", {})
+        return index
+
+    def _load_index(self):
+        index = self._read_index()
+        # Drop entries whose blob disappeared from disk
+        for digest in list(index["blobs"]):
+            if not os.path.isfile(self.blob_path(digest)):
+                del index["blobs"][digest]
+        index["urls"] = {url: digest for url, digest in index["urls"].items() if digest in index["blobs"]}
+        # Blobs missing from the index (a writer died between the two) count
+        # towards max_bytes and are evicted first
+        for name in os.listdir(self.blob_dir):
+            if name.endswith(".tmp") or name in index["blobs"]:
+                continue
+            try:
+                stat = os.stat(self.blob_path(name))
+            except FileNotFoundError:
+                continue
+            index["blobs"][name] = {"size": stat.st_size, "last_used": stat.st_mtime}
+        return index
+
+    def _save_index(self):
+        tmp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest)
+
+    def total_bytes(self):
+        return sum(entry["size"] for entry in self.index["blobs"].values())
+
+    def contains(self, url):
+        with self._locked():
+            self.index = self._read_index()
+            return url in self.index["urls"]
+
+    def get(self, url, dst):
+        """
+        Links the cached copy of url to dst. Returns the blob size, or None on a miss.
+        """
+        with self._locked():
+            self.index = self._read_index()
+            digest = self.index["urls"].get(url)
+            if digest is None:
+                return None
+            entry = self.index["blobs"][digest]
+            try:
+                link_or_copy(self.blob_path(digest), dst)
+            except OSError as e:
+                logging.warning(f"Image cache entry for {url} unusable: {e}")
+                return None
+            entry["last_used"] = time.time()
+            self._save_index()
+            return entry["size"]
+
+    def put(self, url, src, digest=None):
+        """
+        Adds the file at src to the cache under url and returns its content hash.
+        """
+        digest = digest or hash_file(src)
+        with self._locked():
+            self.index = self._read_index()
+            blob = self.blob_path(digest)
+            if not os.path.isfile(blob):
+                tmp_path = f"{blob}.{os.getpid()}.{threading.get_ident()}.tmp"
+                shutil.copyfile(src, tmp_path)
+                os.replace(tmp_path, blob)
+            self.index["blobs"][digest] = {"size": os.path.getsize(blob), "last_used": time.time()}
+            self.index["urls"][url] = digest
+            self._evict()
+            self._save_index()
+        return digest
+
+    def _evict(self):
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        for digest, entry in sorted(self.index["blobs"].items(), key=lambda item: item[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.blob_path(digest))
+            except FileNotFoundError:
+                pass
+            total -= entry["size"]
+            del self.index["blobs"][digest]
+            logging.info(f"Evicted {digest} ({entry['size']} bytes) from image cache")
+        self.index["urls"] = {url: d for url, d in self.index["urls"].items() if d in self.index["blobs"]}
@@ -0,0 +1,155 @@
+import os
+import re
+import time
+import shutil
+import logging
+import threading
+from image_cache import hash_file, link_or_copy
+
+# Persistent store for ai-toolkit's VAE latents, kept outside the per-job folder
+DEFAULT_CACHE_DIR = os.environ.get("LATENT_CACHE_DIR", os.path.join(os.getcwd(), "cache", "latents"))
+DEFAULT_MAX_BYTES = int(os.environ.get("LATENT_CACHE_MAX_BYTES", 20 * 1024 ** 3))
+DEFAULT_MAX_AGE = int(os.environ.get("LATENT_CACHE_MAX_AGE", 14 * 24 * 3600))  # seconds
+
+# Folder ai-toolkit writes latents to, next to the dataset images
+TOOLKIT_LATENT_DIR = "_latent_cache"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+
+
+def model_key(model_name):
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', model_name)
+
+
+class LatentCache:
+    """
+    Stores ai-toolkit latent files as <model>/<image sha256>/<latent file name>.
+    The store may be shared by several processes: files are written under
+    per-thread temporary names and renamed into place, so concurrent saves of
+    the same latent never see each other's partial copies.
+
+    ai-toolkit names each latent "<image stem>_<hash>.safetensors" and only
+    loads one whose name matches: the hash (FileItemDTO.get_latent_info_dict)
+    covers the image's file name as well as its resolution and crop settings.
+    Latents are therefore kept under their own name and restored only for an
+    image with the same content and file name, e.g. a resubmitted job, since
+    dataset images are named after the trigger word and URL order.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_dir(self, model_name, digest):
+        return os.path.join(self.cache_dir, model_key(model_name), digest)
+
+    def _dataset_images(self, dataset_folder_path):
+        images = {}
+        for entry in os.listdir(dataset_folder_path):
+            path = os.path.join(dataset_folder_path, entry)
+            if os.path.isfile(path) and entry.lower().endswith(IMAGE_EXTENSIONS):
+                images[os.path.splitext(entry)[0]] = hash_file(path)
+        return images
+
+    def restore(self, dataset_folder_path, model_name):
+        """
+        Links cached latents for the dataset's images into its _latent_cache
+        folder, under the names ai-toolkit looks for. Returns the number of
+        latent files restored.
+        """
+        latent_dir = os.path.join(dataset_folder_path, TOOLKIT_LATENT_DIR)
+        restored = 0
+        for stem, digest in self._dataset_images(dataset_folder_path).items():
+            entry_dir = self.entry_dir(model_name, digest)
+            # prune may remove entries while they are restored; a vanished one is a miss
+            try:
+                latent_files = os.listdir(entry_dir)
+            except FileNotFoundError:
+                continue
+            os.makedirs(latent_dir, exist_ok=True)
+            for latent_file in latent_files:
+                # Latents of the same image under another name would never be read
+                if not latent_file.startswith(f"{stem}_") or latent_file.endswith(".tmp"):
+                    continue
+                src = os.path.join(entry_dir, latent_file)
+                try:
+                    os.utime(src)  # mark as recently used, before prune can pick it
+                    link_or_copy(src, os.path.join(latent_dir, latent_file))
+                except FileNotFoundError:
+                    continue
+                restored += 1
+        return restored
+
+    def save(self, dataset_folder_path, model_name):
+        """
+        Copies latents ai-toolkit produced for this dataset into the store.
+        Returns the number of new latent files stored.
+        """
+        latent_dir = os.path.join(dataset_folder_path, TOOLKIT_LATENT_DIR)
+        if not os.path.isdir(latent_dir):
+            return 0
+        images = self._dataset_images(dataset_folder_path)
+        # Longest stems first so "x (1)" never claims the latents of "x (10)"
+        stems = sorted(images, key=len, reverse=True)
+        saved = 0
+        for latent_file in os.listdir(latent_dir):
+            stem = next((s for s in stems if latent_file.startswith(f"{s}_")), None)
+            if stem is None:
+                continue
+            entry_dir = self.entry_dir(model_name, images[stem])
+            dst = os.path.join(entry_dir, latent_file)
+            if os.path.exists(dst):
+                continue
+            tmp_path = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                os.makedirs(entry_dir, exist_ok=True)
+                shutil.copyfile(os.path.join(latent_dir, latent_file), tmp_path)
+                os.replace(tmp_path, dst)
+            except FileNotFoundError:
+                # Another process pruned the entry's folder between makedirs and the copy
+                continue
+            saved += 1
+        self.prune()
+        return saved
+
+    def prune(self):
+        """
+        Removes latents older than max_age, then the least recently used ones
+        until the store fits in max_bytes. Returns the number of bytes freed.
+        Files that other jobs or workers remove meanwhile are skipped.
+        """
+        now = time.time()
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue  # being written by save
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        freed = 0
+        for mtime, size, path in files:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                freed += size
+            except FileNotFoundError:
+                pass
+            total -= size
+            # Drop the image's folder once its last latent is gone
+            parent = os.path.dirname(path)
+            try:
+                if parent != self.cache_dir and not os.listdir(parent):
+                    os.rmdir(parent)
+            except OSError:
+                pass  # gone already, or a latent was just saved into it
+        if freed:
+            logging.info(f"Pruned {freed} bytes from latent cache")
+        return freed
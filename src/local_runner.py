@@ -0,0 +1,391 @@
+import os
+import sys
+import json
+import time
+import random
+import signal
+import logging
+import argparse
+import threading
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+DEFAULT_WORKERS = int(os.environ.get("RUNNER_WORKERS", 1))
+# Jobs running longer than this are killed along with their trainer process
+DEFAULT_JOB_TIMEOUT = float(os.environ.get("RUNNER_JOB_TIMEOUT", 0)) or None  # seconds
+POLL_INTERVAL = 1.0  # seconds between queue folder scans
+CLAIMED_SUFFIX = ".claimed"
+
+
+def read_jobs(path):
+    """
+    Jobs from a JSONL file: one runpod job ({"id", "input"}) or bare input per line.
+    """
+    jobs = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            if "input" not in job:
+                job = {"input": job}
+            job.setdefault("id", f"local-{len(jobs)}")
+            jobs.append(job)
+    return jobs
+
+
+class FolderQueue:
+    """
+    A local job queue: every *.json file dropped into the folder is one job,
+    claimed by renaming it so several runners can share the folder.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def poll(self):
+        jobs = []
+        names = sorted(name for name in os.listdir(self.path) if name.endswith(".json"))
+        for name in names:
+            path = os.path.join(self.path, name)
+            try:
+                queued_at = os.path.getmtime(path)
+                os.rename(path, path + CLAIMED_SUFFIX)
+            except FileNotFoundError:
+                continue  # claimed by another runner
+            try:
+                with open(path + CLAIMED_SUFFIX) as f:
+                    job = json.load(f)
+            except ValueError as e:
+                logging.error(f"Skipping unreadable job file {name}: {e}")
+                continue
+            if "input" not in job:
+                job = {"input": job}
+            job.setdefault("id", os.path.splitext(name)[0])
+            job["queued_at"] = queued_at
+            jobs.append(job)
+        return jobs
+
+
+def _error_stage(output):
+    error = output.get("error")
+    return error.get("stage") if isinstance(error, dict) else None
+
+
+def _worker_main(index, conn, env):
+    """
+    Worker process: runs rp_handler.train_handler for one job at a time and
+    reports progress and results over conn.
+    """
+    # Own process group, so a timeout kills the trainer subprocess with the worker
+    os.setsid()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.environ.update(env)
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s - worker-{index} - %(levelname)s - %(message)s')
+
+    import rp_handler
+    # Progress arrives from the trainer's reader threads while the main thread may be sending
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    rp_handler.send_progress = lambda job, update: send(("progress", job["id"], update))
+    rp_handler.STARTUP.prewarm()
+    rp_handler.MODELS = rp_handler.ModelHandler()
+    send(("ready", os.getpid()))
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        send(("started", job["id"], time.time()))
+        try:
+            output = rp_handler.train_handler(job)
+        except Exception as e:
+            logging.exception(f"Job {job['id']} raised")
+            output = {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+        send(("finished", job["id"], time.time(), output))
+
+
+class Worker:
+    """
+    One worker process and its pipe. Not a daemon: the job path starts its
+    own processes, so run() stops workers through close() instead.
+    """
+
+    def __init__(self, index, env, context):
+        self.index = index
+        self.env = env
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(index, child_conn, env), name=f"runner-worker-{index}")
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.job = None
+        self.started_at = None
+        self.progress = None
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class LocalRunner:
+    """
+    Runs training jobs outside runpod: dispatches them to N worker processes,
+    each with its own scratch folder and optionally its own GPU, kills jobs
+    that exceed the timeout, and appends every result to results.jsonl in
+    the output folder with its queueing delay and run time. Workers share the
+    image, latent, caption and embedding caches, which are safe for
+    concurrent processes; job metrics go to metrics.jsonl.
+    """
+
+    def __init__(self, output_dir, workers=DEFAULT_WORKERS, timeout=DEFAULT_JOB_TIMEOUT, devices=None, scratch_dir=None):
+        from workspace import DEFAULT_SCRATCH_DIR
+        self.output_dir = output_dir
+        self.timeout = timeout
+        self.devices = devices or []
+        self.scratch_dir = scratch_dir or DEFAULT_SCRATCH_DIR
+        os.makedirs(output_dir, exist_ok=True)
+        self.results_path = os.path.join(output_dir, "results.jsonl")
+        self.metrics_path = os.environ.get("METRICS_JSONL") or os.path.join(output_dir, "metrics.jsonl")
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = [self._start_worker(index) for index in range(workers)]
+        self.pending = deque()
+        self.results = []
+
+    def _start_worker(self, index):
+        env = {"SCRATCH_DIR": os.path.join(self.scratch_dir, f"worker-{index}"), "METRICS_JSONL": self.metrics_path}
+        if self.devices:
+            env["CUDA_VISIBLE_DEVICES"] = self.devices[index % len(self.devices)]
+        return Worker(index, env, self.context)
+
+    def _restart(self, worker):
+        """
+        Replaces a killed or crashed worker and removes the workspace it left.
+        """
+        from workspace import WorkspaceManager
+        worker.kill()
+        try:
+            WorkspaceManager(root=worker.env["SCRATCH_DIR"]).sweep()
+        except OSError as e:
+            logging.error(f"Failed to sweep {worker.env['SCRATCH_DIR']}: {e}")
+        self.workers[worker.index] = self._start_worker(worker.index)
+
+    def submit(self, job, queued_at=None):
+        job = dict(job)
+        job["queued_at"] = job.get("queued_at") or queued_at or time.time()
+        self.pending.append(job)
+
+    def _record(self, worker, output, finished_at):
+        job = worker.job
+        started_at = worker.started_at or finished_at
+        result = {
+            "id": job["id"],
+            "worker": worker.index,
+            "status": output.get("status", "failed" if "error" in output else "success"),
+            "queued_at": job["queued_at"],
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "queue_seconds": started_at - job["queued_at"],
+            "run_seconds": finished_at - started_at,
+            "output": output,
+        }
+        self.results.append(result)
+        with open(self.results_path, 'a') as f:
+            f.write(json.dumps(result, default=str) + "\n")
+        logging.info(f"Job {job['id']} on worker {worker.index}: {result['status']} in {result['run_seconds']:.1f}s")
+        worker.job = worker.started_at = worker.progress = None
+
+    def _dispatch(self):
+        for worker in self.workers:
+            if not self.pending:
+                return
+            if worker.ready and worker.job is None:
+                worker.job = self.pending.popleft()
+                worker.conn.send({key: value for key, value in worker.job.items() if key != "queued_at"})
+
+    def _handle(self, worker, message):
+        kind = message[0]
+        if kind == "ready":
+            worker.ready = True
+        elif kind == "started":
+            worker.started_at = message[2]
+        elif kind == "progress":
+            worker.progress = message[2]
+        elif kind == "finished":
+            self._record(worker, message[3], message[2])
+
+    def _check_timeouts(self, now):
+        for worker in list(self.workers):
+            if self.timeout is None or worker.started_at is None or now - worker.started_at <= self.timeout:
+                continue
+            logging.error(f"Job {worker.job['id']} exceeded {self.timeout}s on worker {worker.index}, killing it")
+            error = {"stage": "timeout", "seconds": self.timeout, "last_progress": worker.progress}
+            self._record(worker, {"status": "failed", "error": error}, now)
+            self._restart(worker)
+
+    def wait_ready(self, timeout=None):
+        """
+        Waits until every worker has imported the handler and loaded its
+        models. Returns the seconds waited.
+        """
+        start = time.time()
+        while not all(worker.ready for worker in self.workers):
+            if timeout is not None and time.time() - start > timeout:
+                break
+            self.step(max_wait=POLL_INTERVAL)
+        return time.time() - start
+
+    def busy(self):
+        return bool(self.pending) or any(worker.job is not None for worker in self.workers)
+
+    def step(self, max_wait=POLL_INTERVAL):
+        """
+        Dispatches pending jobs and handles worker messages for up to max_wait seconds.
+        """
+        self._dispatch()
+        now = time.time()
+        deadlines = [worker.started_at + self.timeout - now for worker in self.workers if self.timeout and worker.started_at]
+        by_conn = {worker.conn: worker for worker in self.workers}
+        for conn in wait(list(by_conn), timeout=max(0.0, min([max_wait] + deadlines))):
+            worker = by_conn[conn]
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                code = worker.process.exitcode
+                logging.error(f"Worker {worker.index} exited with code {code}")
+                if not worker.ready:
+                    # Restarting would fail the same way, e.g. rp_handler does not import
+                    raise RuntimeError(f"Worker {worker.index} exited with code {code} before it was ready")
+                if worker.job is not None:
+                    self._record(worker, {"status": "failed", "error": {"stage": "worker", "exit_code": code}}, time.time())
+                self._restart(worker)
+                continue
+            self._handle(worker, message)
+        self._check_timeouts(time.time())
+        self._dispatch()
+
+    def close(self):
+        for worker in self.workers:
+            if worker.job is None and worker.process.is_alive():
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+                worker.process.join(timeout=10)
+            if worker.process.is_alive():
+                worker.kill()
+
+    def summary(self, seconds):
+        """
+        Throughput, queueing delay and run time over the finished jobs, plus
+        per-stage timings from the job metrics.
+        """
+        # Not imported at the top: workers import this module before their environment is set
+        from telemetry import _percentile, summarize
+
+        def distribution(values):
+            if not values:
+                return None
+            return {"mean": sum(values) / len(values), "p50": _percentile(values, 50), "p95": _percentile(values, 95), "max": max(values)}
+
+        statuses = {}
+        for result in self.results:
+            statuses[result["status"]] = statuses.get(result["status"], 0) + 1
+        summary = {
+            "jobs": len(self.results),
+            "workers": len(self.workers),
+            "timeout": self.timeout,
+            "statuses": statuses,
+            "timed_out": sum(1 for result in self.results if _error_stage(result["output"]) == "timeout"),
+            "seconds": seconds,
+            "jobs_per_hour": len(self.results) / seconds * 3600 if seconds else None,
+            "queue_seconds": distribution([result["queue_seconds"] for result in self.results]),
+            "run_seconds": distribution([result["run_seconds"] for result in self.results]),
+        }
+        if os.path.isfile(self.metrics_path):
+            summary["stages"] = summarize(self.metrics_path)
+        return summary
+
+
+def run(source, output_dir, workers=DEFAULT_WORKERS, timeout=DEFAULT_JOB_TIMEOUT, devices=None, scratch_dir=None, rate=0.0, follow=False):
+    """
+    Runs the jobs of a JSONL file, or of a queue folder (with follow=True,
+    until interrupted), and writes summary.json next to results.jsonl.
+    With rate, JSONL jobs arrive at that many jobs per second (Poisson)
+    instead of all at once. Returns the summary.
+    """
+    jobs = None if os.path.isdir(source) else read_jobs(source)
+    runner = LocalRunner(output_dir, workers, timeout, devices, scratch_dir)
+    start, startup_seconds = time.time(), 0.0
+    arrivals = deque()
+    folder = None
+    try:
+        # Worker start-up is reported on its own rather than as queueing delay
+        startup_seconds = runner.wait_ready()
+        start = time.time()
+        if jobs is None:
+            folder = FolderQueue(source)
+        else:
+            arrival = start
+            arrival_times = random.Random(0)
+            for job in jobs:
+                arrivals.append((arrival, job))
+                if rate:
+                    arrival += arrival_times.expovariate(rate)
+
+        while True:
+            now = time.time()
+            while arrivals and arrivals[0][0] <= now:
+                queued_at, job = arrivals.popleft()
+                runner.submit(job, queued_at)
+            if folder is not None:
+                for job in folder.poll():
+                    runner.submit(job)
+            if not (arrivals or runner.busy() or follow):
+                break
+            next_arrival = arrivals[0][0] - now if arrivals else POLL_INTERVAL
+            runner.step(max_wait=min(POLL_INTERVAL, max(0.0, next_arrival)))
+    except KeyboardInterrupt:
+        logging.info("Interrupted, stopping workers")
+    finally:
+        runner.close()
+        summary = runner.summary(time.time() - start)
+        summary["startup_seconds"] = startup_seconds
+        with open(os.path.join(output_dir, "summary.json"), 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+if __name__ == "__main__":
+    # python local_runner.py jobs.jsonl --workers 4 --timeout 3600 --output-dir runs/load-test
+    # python local_runner.py queue/ --follow --devices 0,1
+    parser = argparse.ArgumentParser(description="Run training jobs locally through train_handler with several worker processes")
+    parser.add_argument("source", help="JSONL file of jobs, or a folder of *.json job files")
+    parser.add_argument("--output-dir", default=os.path.join(os.getcwd(), "runs", time.strftime("%Y%m%d-%H%M%S")))
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_JOB_TIMEOUT, help="seconds a job may run")
+    parser.add_argument("--devices", help="comma separated CUDA devices, assigned to workers round robin")
+    parser.add_argument("--scratch-dir", help="root of the per-worker scratch folders")
+    parser.add_argument("--rate", type=float, default=0.0, help="JSONL jobs submitted per second (0: all at once)")
+    parser.add_argument("--follow", action="store_true", help="keep polling the queue folder until interrupted")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    summary = run(
+        args.source, args.output_dir, args.workers, args.timeout,
+        args.devices.split(",") if args.devices else None, args.scratch_dir, args.rate, args.follow
+    )
+    print(json.dumps(summary, indent=2))
+    sys.exit(0 if summary["jobs"] and summary["statuses"].get("success", 0) + summary["statuses"].get("dry_run", 0) == summary["jobs"] else 1)
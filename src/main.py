@@ -1,9 +1,23 @@
 import os
+import time
 import logging
 from train import fine_tune_function
-from cloudflare_util import upload
+from checkpoint_uploader import CHECKPOINT_EXTENSIONS, CheckpointUploader
 from dataset import download_images
-import shutil
+from image_cache import ImageCache
+from latent_cache import LatentCache
+from pipeline import JobPipeline, Stage
+from preprocess import preprocess_images
+from dedup import deduplicate_images
+from telemetry import JobMetrics, span
+from captioner import CaptionCache, caption_images, get_backend
+from workspace import estimate_footprint, get_workspace_manager
+from preflight import MIN_IMAGES, run_preflight
+from resume import ResumeManifest, job_fingerprint
+from training_config import TrainingSettings, build_process, get_preset
+from cost_model import check_limits, get_cost_model, job_features
+from compaction import DEFAULT_DTYPE, CompactionSettings, compact_lora
+from artifact_index import get_artifact_index
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -19,7 +33,67 @@ def log_files_in_dir(directory):
         logging.info(f"Error listing files in '{directory}': {e}")
 
 
-def lora_train(
+def has_r2(job):
+    return all(job["r2"][key] for key in ("bucket_name", "access_key_id", "secret_access_key", "endpoint_url"))
+
+
+def training_params(
+    trigger_word,
+    caption_dropout_rate,
+    batch_size,
+    steps,
+    optimizer,
+    lr,
+    quantize,
+    cache_text_embeddings,
+    preset,
+    folder_path,
+    dataset_folder_path
+):
+    """
+    The ai-toolkit process for a job: the preset (None for the default one)
+    combined with the user parameters.
+    """
+    settings = TrainingSettings(
+        trigger_word=trigger_word,
+        steps=steps,
+        batch_size=batch_size,
+        lr=lr,
+        optimizer=optimizer,
+        caption_dropout_rate=caption_dropout_rate,
+        quantize=quantize,
+        unload_text_encoder=cache_text_embeddings
+    )
+    return build_process(get_preset(preset or "default"), settings, folder_path, dataset_folder_path)
+
+
+def estimate_job(
+    image_urls,
+    trigger_word,
+    caption_dropout_rate,
+    batch_size,
+    steps,
+    optimizer,
+    lr,
+    quantize,
+    cache_text_embeddings=False,
+    preset="default",
+    **_
+):
+    """
+    Predicts the job's stage times, peak memory and disk use without running
+    it. Takes the arguments of create_job and returns (estimate, exceeded
+    worker limits).
+    """
+    params = training_params(
+        trigger_word, caption_dropout_rate, batch_size, steps, optimizer, lr, quantize,
+        cache_text_embeddings, preset, "", ""
+    )
+    estimate = get_cost_model().estimate(params, len(image_urls))
+    return estimate, check_limits(estimate, get_workspace_manager().free_bytes())
+
+
+def create_job(
     image_urls,
     trigger_word,
     model_id,
@@ -33,139 +107,467 @@ def lora_train(
     r2_access_key_id,
     r2_secret_access_key,
     r2_endpoint_url,
-    r2_path_in_bucket
+    r2_path_in_bucket,
+    use_latent_cache=True,
+    cache_text_embeddings=False,
+    remove_duplicates=True,
+    captions=None,
+    auto_caption=False,
+    preset="default",
+    compact_dtype=None,
+    compact_rank=0,
+    compact_energy=1.0,
+    progress=None,
+    trainer=None
 ):
     """
-    Lora training function that combines user parameters with default configuration
+    Builds the job state shared by the prepare/train/finish stages: folder
+    paths, the training configuration combined from user parameters and
+    the named preset (see training_config.PRESETS) and how the final LoRA is
+    compacted before upload.
     """
-    
-
-    
-    # Folder Paths
-    folder_path = os.makedirs(os.path.join(os.getcwd(), "ai-toolkit", "output", model_id), exist_ok=True) or os.path.join(os.getcwd(), "ai-toolkit", "output", model_id)
+    # Folder Paths: a private workspace on the scratch volume, so jobs sharing a model_id don't collide
+    workspace_manager = get_workspace_manager()
+    workspace = workspace_manager.allocate(model_id)
+    folder_path = workspace.path
     dataset_folder_path = os.path.join(folder_path, "images") 
     model_folder_path = os.path.join(folder_path, trigger_word)
     
     lora_path = os.path.join(model_folder_path, f"{trigger_word}.safetensors") 
     
-    fine_tune_params = {
-        "type": "sd_trainer",
-        "training_folder": folder_path,
-        "device": "cuda:0",
+    try:
+        fine_tune_params = training_params(
+            trigger_word, caption_dropout_rate, batch_size, steps, optimizer, lr, quantize,
+            cache_text_embeddings, preset, folder_path, dataset_folder_path
+        )
+        # None, as INPUT_SCHEMA defaults them, keeps the settings' defaults
+        compaction = CompactionSettings(
+            dtype=compact_dtype or DEFAULT_DTYPE,
+            rank=compact_rank if compact_rank is not None else 0,
+            energy=compact_energy if compact_energy is not None else 1.0
+        )
+        compaction.validate()
+    except ValueError:
+        workspace_manager.release(workspace)
+        raise
+
+    # Fail now rather than filling the disk halfway through training
+    workspace_manager.reserve(workspace, estimate_footprint(fine_tune_params, len(image_urls)))
+
+    metrics = JobMetrics(model_id)
+    metrics.features = job_features(fine_tune_params, len(image_urls))
+
+    return {
+        "image_urls": image_urls,
         "trigger_word": trigger_word,
-        
-        # Network configuration
-        "network": {
-            "type": "lora",
-            "linear": 16,
-            "linear_alpha": 16
-        },
-        
-        # Save configuration
-        "save": {
-            "dtype": "float16",
-            "save_every": 250,
-            "max_step_saves_to_keep": 4,
-            "push_to_hub": False
-        },
-        
-        # Dataset configuration
-        "datasets": [{
-            "folder_path": dataset_folder_path,
-            "caption_ext": "txt",
-            "caption_dropout_rate": caption_dropout_rate,
-            "shuffle_tokens": False,
-            "cache_latents_to_disk": True,
-            "resolution": [512, 768, 1024]
-        }],
-        
-        # Training configuration
-        "train": {
-            "batch_size": batch_size,
-            "steps": steps,
-            "gradient_accumulation_steps": 1,
-            "train_unet": True,
-            "train_text_encoder": False,
-            "gradient_checkpointing": True,
-            "noise_scheduler": "flowmatch",
-            "optimizer": optimizer,
-            "lr": lr,
-            "ema_config": {
-                "use_ema": True,
-                "ema_decay": 0.99
-            },
-            "dtype": "bf16"
-        },
-        
-        # Model configuration
-        "model": {
-            "name_or_path": "black-forest-labs/FLUX.1-dev",
-            "is_flux": True,
-            "quantize": quantize
+        "model_id": model_id,
+        "workspace": workspace,
+        "folder_path": folder_path,
+        "dataset_folder_path": dataset_folder_path,
+        "model_folder_path": model_folder_path,
+        "lora_path": lora_path,
+        "fine_tune_params": fine_tune_params,
+        "r2": {
+            "bucket_name": r2_bucket_name,
+            "access_key_id": r2_access_key_id,
+            "secret_access_key": r2_secret_access_key,
+            "endpoint_url": r2_endpoint_url,
+            "r2_path_in_bucket": r2_path_in_bucket,
+            "unique_id": model_id
         },
-        
-        # Sample configuration
-        "sample": {
-            "sampler": "flowmatch",
-            "sample_every": 250,
-            "width": 1024,
-            "height": 1024,
-            "prompts": ["a man holding a sign that says, 'this is a sign'"],
-            "neg": "",
-            "seed": 42,
-            "walk_seed": True,
-            "guidance_scale": 1,
-            "sample_steps": 4
-        }
+        "latent_cache": LatentCache() if use_latent_cache else None,
+        "remove_duplicates": remove_duplicates,
+        "captions": captions or [],
+        "auto_caption": auto_caption,
+        "compaction_settings": compaction,
+        "metrics": metrics,
+        "progress": progress,
+        "trainer": trainer,
+        "status": "failed"
     }
 
-     # Call the function with the images, folder path, and trigger word
+
+def prepare_job(job):
+    """
+    CPU/network stage: downloads and normalizes the dataset and restores cached latents.
+    """
+    progress = job["progress"]
+    metrics = job["metrics"]
+    dataset_folder_path = job["dataset_folder_path"]
+
+    image_cache = ImageCache()
+
+    # Cheap checks first, so a bad job fails in seconds instead of after a model load
+    if progress is not None:
+        progress.set_phase("download")
+    with span(metrics, "preflight") as record:
+        preflight = run_preflight(job["image_urls"], job["r2"], os.path.join(os.getcwd(), "ai-toolkit"), cache=image_cache)
+        record["failed_checks"] = len(preflight["errors"])
+    job["preflight"] = preflight
+    if not preflight["ok"]:
+        job["error"] = {"stage": "preflight", "checks": preflight["errors"], "failed_images": preflight["images"]["failed"]}
+        return job
+
+    # Continue a preempted run of the same job from its last uploaded checkpoint
+    job["resume"] = None
+    if has_r2(job):
+        try:
+            resume = ResumeManifest(job["r2"])
+            resume.start(job_fingerprint(job), resume.load())
+            job["resume"] = resume
+            if resume.state["checkpoint"]:
+                logging.info(f"Resuming from {resume.state['checkpoint']} (step {resume.state['step']})")
+        except Exception as e:
+            logging.error(f"Resume manifest unavailable, job will not be resumable: {e}")
+
+    # Call the function with the images, folder path, and trigger word
     logging.info('Preparing Dataset...')
-    download_images(image_urls, dataset_folder_path, trigger_word)
-    logging.info('Dataset Preparation Done...')
+    with span(metrics, "download", folder=dataset_folder_path) as record:
+        download_report = download_images(preflight["images"]["usable"], dataset_folder_path, job["trigger_word"], cache=image_cache)
+        record.update(
+            bytes=download_report["bytes"],
+            items=len(download_report["downloaded"]),
+            failed=len(download_report["failed"]),
+            cache_hits=download_report["cache_hits"]
+        )
+    logging.info(
+        f"Dataset Preparation Done: {len(download_report['downloaded'])}/{len(job['image_urls'])} images, "
+        f"{download_report['bytes']} bytes in {download_report['seconds']:.2f}s "
+        f"(cache hits: {download_report['cache_hits']}, misses: {download_report['cache_misses']}, "
+        f"bytes saved: {download_report['bytes_saved']})"
+    )
+    job["download_report"] = download_report
+
+    # Decode, validate, orient and downscale once here rather than on the GPU box
+    resolutions = job["fine_tune_params"]["datasets"][0]["resolution"]
+    with span(metrics, "preprocess", folder=dataset_folder_path) as record:
+        manifest = preprocess_images(dataset_folder_path, resolutions)
+        record.update(items=len(manifest["images"]), rejected=len(manifest["rejected"]))
+    logging.info(
+        f"Preprocessed {len(manifest['images'])} images in {manifest['seconds']:.2f}s, "
+        f"rejected {len(manifest['rejected'])}"
+    )
+    job["manifest"] = manifest
+
+    # Repeated uploads and burst shots waste latent caching and skew the LoRA
+    with span(metrics, "dedup") as record:
+        dedup_report = deduplicate_images(dataset_folder_path, remove=job["remove_duplicates"])
+        record["duplicates"] = len(dedup_report["duplicates"])
+    logging.info(f"Found {len(dedup_report['duplicates'])} duplicate images")
+    if job["remove_duplicates"]:
+        removed = {duplicate["file"] for duplicate in dedup_report["duplicates"]}
+        manifest["images"] = [image for image in manifest["images"] if image["file"] not in removed]
+    job["dedup_report"] = dedup_report
+    if len(manifest["images"]) < MIN_IMAGES:
+        message = f"{len(manifest['images'])} usable images after download and preprocessing, at least {MIN_IMAGES} required"
+        logging.error(message)
+        job["error"] = {"stage": "dataset", "checks": [{"check": "images", "message": message}]}
+        return job
 
+    # caption_ext is "txt": write "<image>.txt" so captions and caption dropout take effect
+    with span(metrics, "caption") as record:
+        caption_report = caption_job(job)
+        record.update(items=len(manifest["images"]), generated=caption_report["generated"], cached=caption_report["cached"])
+    logging.info(
+        f"Captioned {len(manifest['images'])} images in {caption_report['seconds']:.2f}s "
+        f"(supplied: {caption_report['supplied']}, cached: {caption_report['cached']}, "
+        f"generated: {caption_report['generated']})"
+    )
+    job["caption_report"] = caption_report
+
+    # Reuse VAE latents encoded by earlier jobs on the same images
+    latent_cache = job["latent_cache"]
+    if latent_cache is not None:
+        # The cache is optional: ai-toolkit encodes whatever is not restored
+        try:
+            model_name = job["fine_tune_params"]["model"]["name_or_path"]
+            with span(metrics, "latent_restore") as record:
+                restored = latent_cache.restore(dataset_folder_path, model_name)
+                record["items"] = restored
+            logging.info(f"Restored {restored} cached latent files")
+        except OSError as e:
+            logging.error(f"Failed to restore cached latents, training without them: {e}")
+    return job
+
+
+def caption_job(job):
+    """
+    Writes caption files for the job's images: captions supplied with the job
+    (one per image URL), else the captioning backend's output when
+    auto_caption is set, else the trigger word.
+    """
+    supplied = {}
+    urls = {os.path.basename(item["path"]): item["url"] for item in job["download_report"]["downloaded"]}
+    for image in job["manifest"]["images"]:
+        url = urls.get(image["source"])
+        if url is not None:
+            index = job["image_urls"].index(url)
+            if index < len(job["captions"]) and isinstance(job["captions"][index], str):
+                supplied[image["file"]] = job["captions"][index]
+
+    # Captions generated by an earlier attempt of this job are reused rather than regenerated
+    resume = job.get("resume")
+    resumed_captions = resume.state["captions"] if resume is not None else {}
+    for image in job["manifest"]["images"]:
+        if image["file"] not in supplied and image["sha256"] in resumed_captions:
+            supplied[image["file"]] = resumed_captions[image["sha256"]]
+
+    backend = cache = None
+    if job["auto_caption"]:
+        try:
+            backend = get_backend()
+            cache = CaptionCache(backend.name)
+        except Exception as e:
+            logging.error(f"Captioner unavailable, captioning with the trigger word: {e}")
+            backend = None
+
+    try:
+        report = caption_images(job["dataset_folder_path"], job["manifest"]["images"], job["trigger_word"], supplied, backend, cache)
+    finally:
+        if backend is not None:
+            backend.close()
+    if resume is not None:
+        resume.update(captions={image["sha256"]: report["captions"][image["file"]] for image in job["manifest"]["images"]})
+
+    # Precomputed text embeddings only cover the trigger word; keep the encoders for varied captions
+    train_params = job["fine_tune_params"]["train"]
+    if train_params["unload_text_encoder"] and not report["uniform"]:
+        logging.info("Captions vary per image, keeping the text encoders loaded")
+        train_params["unload_text_encoder"] = False
+    return report
+
+
+def train_job(job):
+    """
+    GPU stage: runs the trainer while checkpoints are uploaded in the background.
+    """
+    progress = job["progress"]
+    metrics = job["metrics"]
+    if job.get("error") is not None:
+        logging.error("Skipping training: job failed before training")
+        return job
+
+    # ai-toolkit continues from the newest checkpoint and optimizer state in its output folder
+    resume = job.get("resume")
+    if resume is not None and resume.state["checkpoint"]:
+        try:
+            with span(metrics, "resume_restore", folder=job["model_folder_path"]) as record:
+                restored = resume.restore(job["model_folder_path"])
+                record["items"] = len(restored)
+            logging.info(f"Restored {restored} to resume from step {resume.state['step']}")
+            job["resumed_from_step"] = resume.state["step"]
+        except Exception as e:
+            # Resubmissions would fail the same way while the manifest points at it
+            logging.error(f"Failed to restore {resume.state['checkpoint']}, training from scratch: {e}")
+            try:
+                resume.reset()
+            except Exception as e:
+                logging.error(f"Failed to reset resume manifest: {e}")
+
+    # Ship checkpoints to R2 as ai-toolkit saves them instead of after training
+    if has_r2(job):
+        checkpoint_uploader = CheckpointUploader(
+            job["model_folder_path"],
+            # The index lets a resubmitted job skip checkpoints R2 already holds unchanged
+            {**job["r2"], "metrics": metrics, "index": get_artifact_index(job["r2"])},
+            on_upload=resume.record_upload if resume is not None else None,
+            # Uploaded by finish_job once compacted
+            hold=(os.path.basename(job["lora_path"]),)
+        )
+        checkpoint_uploader.skip_existing()
+        job["checkpoint_uploader"] = checkpoint_uploader.start()
 
     # Start the fine-tuning process
     logging.info('Starting fine-tuning...')
-    status = fine_tune_function(fine_tune_params, folder_path)
+    if progress is not None:
+        # ai-toolkit labels its step bar with the job name, the trigger word
+        progress.set_phase("training", training_label=job["fine_tune_params"]["trigger_word"])
+    status = fine_tune_function(
+        job["fine_tune_params"],
+        job["folder_path"],
+        on_progress=progress.update if progress is not None else None,
+        trainer=job["trainer"],
+        metrics=metrics
+    )
     logging.info(f"Training status: {status}")
+    job["status"] = status
+    return job
 
-    # Check the status of training
-    if status == "success":
-        logging.info("Training completed successfully")
-        # Upload when training is successful
-        if all([r2_bucket_name, r2_access_key_id, r2_secret_access_key, r2_endpoint_url]):
-            result = upload(
-                bucket_name=r2_bucket_name,
-                access_key_id=r2_access_key_id,
-                secret_access_key=r2_secret_access_key,
-                endpoint_url=r2_endpoint_url,
-                file_path=lora_path,
-                r2_path_in_bucket=r2_path_in_bucket,
-                unique_id=model_id,
-                async_upload=False
-            )
-            
-            if result is not None:
-                success, message = result
-                if success:
-                    logging.info("Train and Upload was successful!")
+
+def finish_job(job):
+    """
+    Upload/cleanup stage: compacts the final LoRA, waits for checkpoint
+    uploads, stores latents and removes the job folder. Runs even when an
+    earlier stage failed.
+    """
+    progress = job["progress"]
+    metrics = job["metrics"]
+    status = job["status"]
+    lora_path = job["lora_path"]
+    checkpoint_uploader = job.get("checkpoint_uploader")
+
+    try:
+        # Shrink the artifact inference workers download while step checkpoints finish uploading
+        if status == "success" and checkpoint_uploader is not None and os.path.isfile(lora_path):
+            if progress is not None:
+                progress.set_phase("compact")
+            try:
+                with span(metrics, "compact") as record:
+                    job["compaction"] = compact_lora(lora_path, settings=job["compaction_settings"])
+                    record["bytes"] = job["compaction"]["bytes_after"]
+                logging.info(f"Compacted final LoRA: {job['compaction']}")
+            except (OSError, ValueError, KeyError) as e:
+                logging.error(f"Failed to compact {lora_path}, uploading it as saved: {e}")
+
+        # Wait for the remaining checkpoint uploads, including intermediate ones of a failed run
+        upload_results = {}
+        if checkpoint_uploader is not None:
+            if progress is not None:
+                progress.set_phase("upload")
+            with span(metrics, "upload_wait") as record:
+                upload_results = checkpoint_uploader.finish()
+                record["items"] = len(upload_results)
+            # Optimizer state is uploaded for resuming only and is not an artifact
+            uploaded = [name for name, (success, _) in upload_results.items() if success and name.endswith(CHECKPOINT_EXTENSIONS)]
+            logging.info(f"Uploaded checkpoints: {uploaded}")
+            r2 = job["r2"]
+            job["artifacts"] = [f"{r2['r2_path_in_bucket']}/{r2['unique_id']}/{name}" for name in uploaded]
+
+        # Check the status of training
+        if status == "success":
+            logging.info("Training completed successfully")
+            if checkpoint_uploader is not None:
+                result = upload_results.get(os.path.basename(lora_path))
+                if result is None:
+                    logging.error(f"Upload failed When Training Was Success: {lora_path} was not found")
                 else:
-                    logging.error(f"Upload failed When Training Was Success: {message}")
-            else:
-                logging.info("Async upload initiated. Check logs for results.")
-    else:
-        logging.error("Training failed, Nothing Uploaded!")
-        # Log files in current working directory (assumed to be 'src')
-        log_files_in_dir(os.getcwd())
-        # Log files in ai-toolkit folder
-        ai_toolkit_dir = os.path.join(os.getcwd(), 'ai-toolkit')
-        if os.path.isdir(ai_toolkit_dir):
-            log_files_in_dir(ai_toolkit_dir)
+                    success, message = result
+                    if success:
+                        logging.info("Train and Upload was successful!")
+                    else:
+                        logging.error(f"Upload failed When Training Was Success: {message}")
         else:
-            print(f"'ai-toolkit' directory not found at {ai_toolkit_dir}")
-    
-    # Clean up temporary folder
-    shutil.rmtree(folder_path)
-    
-    return status
\ No newline at end of file
+            logging.error("Training failed, final LoRA not uploaded!")
+            # Log files in current working directory (assumed to be 'src')
+            log_files_in_dir(os.getcwd())
+            # Log files in ai-toolkit folder
+            ai_toolkit_dir = os.path.join(os.getcwd(), 'ai-toolkit')
+            if os.path.isdir(ai_toolkit_dir):
+                log_files_in_dir(ai_toolkit_dir)
+            else:
+                print(f"'ai-toolkit' directory not found at {ai_toolkit_dir}")
+
+        # Keep the latents ai-toolkit encoded before the job folder is removed
+        latent_cache = job["latent_cache"]
+        if latent_cache is not None:
+            try:
+                model_name = job["fine_tune_params"]["model"]["name_or_path"]
+                with span(metrics, "latent_store") as record:
+                    saved = latent_cache.save(job["dataset_folder_path"], model_name)
+                    record["items"] = saved
+                logging.info(f"Stored {saved} new latent files in latent cache")
+            except OSError as e:
+                logging.error(f"Failed to store latents in latent cache: {e}")
+
+        # A failed run stays resumable; a successful one is not resumed again
+        if job.get("resume") is not None:
+            try:
+                job["resume"].update(status=status)
+            except Exception as e:
+                logging.error(f"Failed to update resume manifest: {e}")
+    finally:
+        # Runs even if uploads or the latent cache raised, so failed jobs don't leak disk
+        try:
+            with span(metrics, "cleanup") as record:
+                job["workspace_report"] = get_workspace_manager().release(job["workspace"])
+                record["disk_bytes"] = job["workspace_report"]["bytes_used"]
+        finally:
+            # Stops the RSS sampler thread even when finishing raised
+            metrics.stop()
+
+    job["status"] = status
+    try:
+        metrics.write_jsonl()
+    except OSError as e:
+        logging.error(f"Failed to write job metrics: {e}")
+    return status
+
+
+def run_job(*args, **kwargs):
+    """
+    Runs all stages of one job and returns the job state.
+    Takes the arguments of create_job; progress, if given, is a ProgressReporter
+    that receives phase and step updates and trainer, if given, is a WarmTrainer
+    with the base model already loaded.
+    """
+    job = create_job(*args, **kwargs)
+    job["stage_timings"] = {}
+
+    def timed(name, stage):
+        start = time.perf_counter()
+        try:
+            stage(job)
+        finally:
+            job["stage_timings"][name] = {"queued": 0.0, "seconds": time.perf_counter() - start}
+
+    try:
+        timed("prepare", prepare_job)
+        timed("train", train_job)
+    finally:
+        timed("finish", finish_job)
+    return job
+
+
+def job_result(job):
+    """
+    JSON-serializable summary of a finished job for the handler response.
+    """
+    download_report = job.get("download_report", {})
+    manifest = job.get("manifest", {})
+    return {
+        "status": job["status"],
+        "artifacts": job.get("artifacts", []),
+        "stage_timings": job.get("stage_timings", {}),
+        "metrics": job["metrics"].to_dict(),
+        "workspace": job.get("workspace_report"),
+        "error": job.get("error"),
+        "resumed_from_step": job.get("resumed_from_step"),
+        "compaction": job.get("compaction"),
+        "dataset": {
+            "downloaded": len(download_report.get("downloaded", [])),
+            "failed_downloads": job.get("preflight", {}).get("images", {}).get("failed", []) + download_report.get("failed", []),
+            "rejected": [
+                {"source": entry["source"], "reason": entry["rejected"]}
+                for entry in manifest.get("rejected", [])
+            ],
+            "duplicates": job.get("dedup_report", {}).get("duplicates", []),
+            "captions": {
+                key: job.get("caption_report", {}).get(key, 0)
+                for key in ("supplied", "cached", "generated", "trigger_only")
+            },
+            "images": len(manifest.get("images", [])),
+        }
+    }
+
+
+def lora_train(*args, **kwargs):
+    """
+    Lora training function that combines user parameters with default configuration.
+    Takes the arguments of create_job and returns "success" or "failed".
+    """
+    return run_job(*args, **kwargs)["status"]
+
+
+def create_pipeline(prepare_workers=1, queue_size=1):
+    """
+    Staged pipeline for running several jobs on one worker: the next job's
+    download and latent restore run while the current job trains, and the
+    finished job's uploads and cleanup overlap with the next job's start.
+    Submit jobs built with create_job; the future resolves to the job, whose
+    "status" and "stage_timings" describe the run.
+    """
+    return JobPipeline([
+        Stage("prepare", prepare_job, workers=prepare_workers, queue_size=queue_size),
+        Stage("train", train_job, workers=1, queue_size=queue_size),
+        Stage("finish", finish_job, workers=1, queue_size=queue_size + 1, always=True),
+    ])
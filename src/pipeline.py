@@ -0,0 +1,114 @@
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+
+class Stage:
+    """
+    One pipeline stage: fn(job), which updates the job in place, run by
+    `workers` threads that take jobs from a bounded queue. Stages with
+    always=True also run for jobs that failed in an earlier stage, e.g. cleanup.
+    """
+
+    def __init__(self, name, fn, workers=1, queue_size=1, always=False):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.always = always
+        self.lock = threading.Lock()
+        self.metrics = {"jobs": 0, "failures": 0, "busy_seconds": 0.0, "wait_seconds": 0.0, "max_queue": 0}
+
+
+class JobPipeline:
+    """
+    Runs jobs through a sequence of stages so that different jobs occupy
+    different stages at the same time, e.g. the next job downloads while the
+    current one trains. A full stage queue blocks the stage before it, so
+    work never piles up ahead of the GPU.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.threads = []
+        for index, stage in enumerate(stages):
+            for worker in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(index,),
+                    name=f"pipeline-{stage.name}-{worker}",
+                    daemon=True
+                )
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, job):
+        """
+        Queues a job at the first stage, blocking while that stage is full.
+        Returns a Future resolved with the job after its last stage. Per-stage
+        queue and run times are recorded in job["stage_timings"].
+        """
+        future = Future()
+        job.setdefault("stage_timings", {})
+        self._enqueue(0, {"job": job, "future": future, "error": None})
+        return future
+
+    def _enqueue(self, index, item):
+        stage = self.stages[index]
+        item["queued_at"] = time.perf_counter()
+        stage.queue.put(item)
+        with stage.lock:
+            stage.metrics["max_queue"] = max(stage.metrics["max_queue"], stage.queue.qsize())
+
+    def _work(self, index):
+        stage = self.stages[index]
+        while True:
+            item = stage.queue.get()
+            if item is None:
+                break
+            job = item["job"]
+            started = time.perf_counter()
+            wait = started - item["queued_at"]
+            failed = False
+            if item["error"] is None or stage.always:
+                try:
+                    stage.fn(job)
+                except BaseException as e:
+                    logging.error(f"Pipeline stage '{stage.name}' failed: {e}")
+                    failed = True
+                    if item["error"] is None:
+                        item["error"] = e
+            seconds = time.perf_counter() - started
+            job["stage_timings"][stage.name] = {"queued": wait, "seconds": seconds}
+            with stage.lock:
+                stage.metrics["jobs"] += 1
+                stage.metrics["failures"] += int(failed)
+                stage.metrics["busy_seconds"] += seconds
+                stage.metrics["wait_seconds"] += wait
+
+            if index + 1 < len(self.stages):
+                self._enqueue(index + 1, item)
+            elif item["error"] is not None:
+                item["future"].set_exception(item["error"])
+            else:
+                item["future"].set_result(job)
+
+    def metrics(self):
+        result = {}
+        for stage in self.stages:
+            with stage.lock:
+                result[stage.name] = dict(stage.metrics, queued=stage.queue.qsize())
+        return result
+
+    def close(self):
+        """
+        Stops the workers once the jobs already queued have drained.
+        """
+        for index, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                stage.queue.put(None)
+            for thread in self.threads:
+                if thread.name.startswith(f"pipeline-{stage.name}-"):
+                    thread.join()
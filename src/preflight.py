@@ -0,0 +1,134 @@
+import os
+import uuid
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from dataset import DEFAULT_BACKOFF, DEFAULT_RETRIES, get_session, should_retry
+
+# Jobs with fewer usable images than this are rejected before any GPU work
+MIN_IMAGES = int(os.environ.get("PREFLIGHT_MIN_IMAGES", 1))
+PROBE_TIMEOUT = (3, 5)  # (connect, read) seconds
+PROBE_WORKERS = 16
+
+
+def probe_url(url, timeout=PROBE_TIMEOUT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF):
+    """
+    Checks that url serves something that can be an image without downloading
+    it: a HEAD request, falling back to a one-byte range GET for servers that
+    reject HEAD. Transient failures are retried like downloads; if they
+    persist the probe is inconclusive and the URL stays usable, so the
+    download gets its own retries. Returns {url, ok, inconclusive, status,
+    content_type, bytes, error}.
+    """
+    session = get_session(url)
+    result = {"url": url, "ok": False, "inconclusive": False, "status": None, "content_type": None, "bytes": None, "error": None}
+    for attempt in range(retries + 1):
+        try:
+            response = session.head(url, timeout=timeout, allow_redirects=True)
+            if response.status_code in (403, 405, 501):
+                with session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=timeout) as response:
+                    pass
+            status_code, error = response.status_code, f"HTTP {response.status_code}"
+        except requests.exceptions.RequestException as e:
+            status_code, error = None, str(e)
+        if not should_retry(status_code):
+            break
+        if attempt < retries:
+            time.sleep(backoff * (2 ** attempt))
+    else:
+        result.update(ok=True, inconclusive=True, status=status_code, error=error)
+        logging.warning(f"Probe of {url} inconclusive ({error}), downloading it anyway")
+        return result
+
+    content_type = response.headers.get("Content-Type", "")
+    result.update(status=response.status_code, content_type=content_type or None)
+    if response.status_code == 200 and response.headers.get("Content-Length", "").isdigit():
+        result["bytes"] = int(response.headers["Content-Length"])
+    if response.status_code >= 400:
+        result["error"] = f"HTTP {response.status_code}"
+    elif content_type.startswith("text/"):
+        # Typically an error or login page served in place of the image
+        result["error"] = f"not an image: {content_type}"
+    elif result["bytes"] == 0:
+        result["error"] = "empty response"
+    else:
+        result["ok"] = True
+    return result
+
+
+def check_images(image_urls, min_images=MIN_IMAGES, cache=None, max_workers=PROBE_WORKERS):
+    """
+    Probes every image URL concurrently; URLs already in the image cache count
+    as usable without a request. Returns (report, error message or None).
+    """
+    def probe(url):
+        if cache is not None and cache.contains(url):
+            return {"url": url, "ok": True, "cached": True}
+        return probe_url(url)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(image_urls) or 1))) as executor:
+        results = list(executor.map(probe, image_urls))
+    report = {
+        "usable": [result["url"] for result in results if result["ok"]],
+        "inconclusive": [result["url"] for result in results if result.get("inconclusive")],
+        "failed": [{"url": result["url"], "error": result["error"]} for result in results if not result["ok"]],
+    }
+    if len(report["usable"]) < min_images:
+        return report, f"{len(report['usable'])} of {len(image_urls)} images usable, at least {min_images} required"
+    return report, None
+
+
+def check_toolkit(toolkit_dir):
+    if not os.path.isfile(os.path.join(toolkit_dir, "run.py")):
+        return f"run.py not found in {toolkit_dir}"
+    return None
+
+
+def check_r2(r2):
+    """
+    Writes and deletes a marker object under the job's R2 prefix, proving the
+    bucket exists and the credentials can both write and delete.
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+    from cloudflare_util import get_r2_client
+    client = get_r2_client(r2["access_key_id"], r2["secret_access_key"], r2["endpoint_url"])
+    key = f"{r2['r2_path_in_bucket']}/{r2['unique_id']}/.preflight-{uuid.uuid4().hex[:8]}"
+    try:
+        client.put_object(Bucket=r2["bucket_name"], Key=key, Body=b"")
+        client.delete_object(Bucket=r2["bucket_name"], Key=key)
+    except ClientError as e:
+        return f"R2 write probe failed: {e.response['Error'].get('Code')}: {e.response['Error'].get('Message')}"
+    except BotoCoreError as e:
+        return f"R2 write probe failed: {e}"
+    return None
+
+
+def run_preflight(image_urls, r2, toolkit_dir, min_images=MIN_IMAGES, cache=None):
+    """
+    Runs the image, toolkit and R2 checks concurrently. Returns a report with
+    "ok", the failed checks as [{check, message}] and the image probe results;
+    the R2 check is skipped when the job has no R2 credentials.
+    """
+    start = time.perf_counter()
+    checks = {}
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix="preflight") as executor:
+        images = executor.submit(check_images, image_urls, min_images, cache)
+        checks["toolkit"] = executor.submit(check_toolkit, toolkit_dir)
+        if all(r2[key] for key in ("bucket_name", "access_key_id", "secret_access_key", "endpoint_url")):
+            checks["r2"] = executor.submit(check_r2, r2)
+        image_report, image_error = images.result()
+
+    errors = []
+    if image_error is not None:
+        errors.append({"check": "images", "message": image_error})
+    for name, future in checks.items():
+        try:
+            message = future.result()
+        except Exception as e:
+            message = f"{type(e).__name__}: {e}"
+        if message is not None:
+            errors.append({"check": name, "message": message})
+    for error in errors:
+        logging.error(f"Preflight {error['check']} check failed: {error['message']}")
+    return {"ok": not errors, "errors": errors, "images": image_report, "seconds": time.perf_counter() - start}
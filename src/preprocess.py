@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+MANIFEST_NAME = "manifest.json"
+JPEG_QUALITY = 95
+# Refuse decompression bombs well before they reach the trainer
+MAX_PIXELS = 120_000_000
+Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+# Files in the dataset folder that are not images; everything else is sniffed
+NON_IMAGE_EXTENSIONS = ('.txt', '.json', '.tmp', '.part')
+
+
+def _to_rgb(image):
+    if image.mode == "RGB":
+        return image
+    # Flatten transparency onto white instead of letting it turn black
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def preprocess_image(src_path, max_resolution, min_resolution=256):
+    """
+    Decodes and validates one image, applies its EXIF orientation, converts it
+    to RGB and downscales it so its shorter side is at most max_resolution.
+    The normalized image replaces src_path as "<stem>.jpg" ("<stem>.png" for
+    PNG sources). Returns a manifest entry; entries for rejected images have
+    "rejected" set to the reason.
+    """
+    stem = os.path.splitext(os.path.basename(src_path))[0]
+    entry = {"source": os.path.basename(src_path), "original_bytes": os.path.getsize(src_path)}
+    try:
+        # verify() catches truncated/corrupt files, but leaves the image unusable
+        with Image.open(src_path) as probe:
+            source_format = probe.format
+            probe.verify()
+        with Image.open(src_path) as image:
+            image.load()
+            original_size = image.size
+            image = ImageOps.exif_transpose(image)
+            image = _to_rgb(image)
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        entry["rejected"] = f"unreadable image: {e}"
+        return entry
+
+    entry.update(format=source_format, original_width=original_size[0], original_height=original_size[1])
+    if min(image.size) < min_resolution:
+        entry["rejected"] = f"too small: {image.size[0]}x{image.size[1]}"
+        return entry
+
+    short_side = min(image.size)
+    if short_side > max_resolution:
+        scale = max_resolution / short_side
+        image = image.resize((round(image.size[0] * scale), round(image.size[1] * scale)), Image.LANCZOS)
+
+    extension = ".png" if source_format == "PNG" else ".jpg"
+    dst_path = os.path.join(os.path.dirname(src_path), f"{stem}{extension}")
+    tmp_path = f"{dst_path}.tmp"
+    if extension == ".png":
+        image.save(tmp_path, format="PNG")
+    else:
+        image.save(tmp_path, format="JPEG", quality=JPEG_QUALITY)
+    # The raw file may be a hardlink into the image cache; never write through it
+    os.remove(src_path)
+    os.replace(tmp_path, dst_path)
+
+    with open(dst_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    entry.update(
+        file=os.path.basename(dst_path),
+        width=image.size[0],
+        height=image.size[1],
+        bytes=os.path.getsize(dst_path),
+        sha256=digest
+    )
+    return entry
+
+
+def preprocess_images(dataset_folder_path, resolutions, max_workers=None, min_resolution=256):
+    """
+    Normalizes every downloaded image in dataset_folder_path on a process pool
+    and writes a manifest.json with dimensions and hashes. Every file other
+    than captions and the manifest is decoded whatever its extension; files
+    that are not readable images are rejected and removed from the folder.
+    Returns the manifest.
+    """
+    paths = sorted(
+        os.path.join(dataset_folder_path, name)
+        for name in os.listdir(dataset_folder_path)
+        if os.path.isfile(os.path.join(dataset_folder_path, name))
+        and not name.startswith(".")
+        and not name.lower().endswith(NON_IMAGE_EXTENSIONS)
+    )
+    start = time.perf_counter()
+    max_resolution = max(resolutions)
+    if paths:
+        with ProcessPoolExecutor(max_workers=max_workers or min(len(paths), os.cpu_count() or 1)) as executor:
+            entries = list(executor.map(preprocess_image, paths, [max_resolution] * len(paths), [min_resolution] * len(paths)))
+    else:
+        entries = []
+
+    for path, entry in zip(paths, entries):
+        if "rejected" in entry:
+            logging.warning(f"Rejected {entry['source']}: {entry['rejected']}")
+            if os.path.exists(path):
+                os.remove(path)
+
+    manifest = {
+        "max_resolution": max_resolution,
+        "images": [e for e in entries if "rejected" not in e],
+        "rejected": [e for e in entries if "rejected" in e],
+        "seconds": time.perf_counter() - start,
+    }
+    with open(os.path.join(dataset_folder_path, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
@@ -0,0 +1,97 @@
+import os
+import time
+import logging
+import threading
+
+# Minimum time between two progress updates sent to the caller
+DEFAULT_UPDATE_INTERVAL = float(os.environ.get("PROGRESS_UPDATE_INTERVAL", 10.0))  # seconds
+
+PHASES = ("download", "caching", "training", "compact", "upload")
+
+
+def phase_for_event(event, current_phase, training_label=None):
+    """
+    Maps a trainer progress event to a job phase using the progress bar label.
+    The training bar is the one labelled with the job name or reporting a
+    loss. Returns None for other bars (sampling, captioning, nested loaders),
+    which must not overwrite the training step, ETA and loss.
+    """
+    label = event.get("label", "").strip()
+    if "cach" in label.lower() or "latent" in label.lower():
+        return "caching"
+    if event.get("loss") is not None or (training_label and label == training_label):
+        if current_phase in ("download", "caching", "training"):
+            return "training"
+        return current_phase
+    return None
+
+
+class ProgressReporter:
+    """
+    Collects job progress and forwards it to send() at most once per interval.
+    Phase changes are always sent immediately.
+    """
+
+    def __init__(self, send, interval=DEFAULT_UPDATE_INTERVAL, clock=time.monotonic):
+        self.send = send
+        self.interval = interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.last_sent = None
+        self.training_label = None
+        self.state = {
+            "phase": None,
+            "step": None,
+            "total_steps": None,
+            "it_per_sec": None,
+            "eta_seconds": None,
+            "loss": None,
+        }
+
+    def set_phase(self, phase, training_label=None):
+        """
+        Enters phase. For "training", training_label is the label of the
+        trainer's step bar (ai-toolkit uses the job name).
+        """
+        with self.lock:
+            if training_label is not None:
+                self.training_label = training_label
+            if self.state["phase"] == phase:
+                return
+            self.state["phase"] = phase
+        self._emit(force=True)
+
+    def update(self, event):
+        """
+        Records a trainer progress event from trainer_process.parse_progress_line.
+        """
+        with self.lock:
+            phase = phase_for_event(event, self.state["phase"], self.training_label)
+            if phase is None:
+                return
+            phase_changed = phase != self.state["phase"]
+            if phase_changed:
+                # Rates and losses of the previous progress bar do not carry over
+                self.state.update(it_per_sec=None, eta_seconds=None, loss=None)
+            self.state["phase"] = phase
+            self.state["step"] = event["step"]
+            self.state["total_steps"] = event["total_steps"]
+            if event.get("it_per_sec"):
+                self.state["it_per_sec"] = event["it_per_sec"]
+                remaining = max(event["total_steps"] - event["step"], 0)
+                self.state["eta_seconds"] = round(remaining / event["it_per_sec"], 1)
+            if event.get("loss") is not None:
+                self.state["loss"] = event["loss"]
+        self._emit(force=phase_changed)
+
+    def _emit(self, force=False):
+        with self.lock:
+            now = self.clock()
+            if not force and self.last_sent is not None and now - self.last_sent < self.interval:
+                return
+            self.last_sent = now
+            payload = dict(self.state)
+        try:
+            self.send(payload)
+        except Exception as e:
+            logging.error(f"Failed to send progress update: {e}")
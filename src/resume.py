@@ -0,0 +1,174 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+
+MANIFEST_NAME = "job_manifest.json"
+# ai-toolkit names step checkpoints <name>_<9-digit step>.safetensors
+STEP_PATTERN = re.compile(r"_(\d{9})\.safetensors$")
+# ai-toolkit saves optimizer state here next to the checkpoints and reloads it on start
+OPTIMIZER_NAME = "optimizer.pt"
+# ai-toolkit overwrites optimizer.pt at every save, so it is uploaded as optimizer_<9-digit step>.pt
+OPTIMIZER_PATTERN = re.compile(r"^optimizer_(\d{9})\.pt$")
+
+
+def checkpoint_step(name):
+    match = STEP_PATTERN.search(name)
+    return int(match.group(1)) if match else None
+
+
+def optimizer_name(step):
+    return f"optimizer_{step:09d}.pt"
+
+
+def optimizer_step(name):
+    match = OPTIMIZER_PATTERN.match(name)
+    return int(match.group(1)) if match else None
+
+
+def job_fingerprint(job):
+    """
+    Hash of everything that shapes the trained LoRA, so a checkpoint is only
+    resumed by a resubmission of the same job. Folder paths are left out;
+    they differ between workspaces.
+    """
+    params = job["fine_tune_params"]
+    dataset = {key: value for key, value in params["datasets"][0].items() if key != "folder_path"}
+    spec = {
+        "image_urls": job["image_urls"],
+        "captions": job["captions"],
+        "trigger_word": job["trigger_word"],
+        "network": params["network"],
+        "save": params["save"],
+        "dataset": dataset,
+        "train": params["train"],
+        "model": params["model"],
+    }
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+
+
+class ResumeManifest:
+    """
+    Small JSON manifest stored in R2 next to a job's checkpoints
+    (<r2_path_in_bucket>/<model_id>/job_manifest.json). It records the newest
+    uploaded step checkpoint and optimizer state and the dataset captions, so
+    a resubmitted job can continue from where a preempted worker stopped.
+    """
+
+    def __init__(self, r2):
+        from cloudflare_util import get_r2_client
+        self.r2 = r2
+        self.client = get_r2_client(r2["access_key_id"], r2["secret_access_key"], r2["endpoint_url"])
+        self.prefix = f"{r2['r2_path_in_bucket']}/{r2['unique_id']}"
+        self.key = f"{self.prefix}/{MANIFEST_NAME}"
+        self.lock = threading.Lock()
+        self.state = None
+
+    def load(self):
+        """
+        Returns the stored manifest, or None when there is none.
+        """
+        from botocore.exceptions import ClientError
+        try:
+            response = self.client.get_object(Bucket=self.r2["bucket_name"], Key=self.key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        try:
+            return json.loads(response["Body"].read())
+        except ValueError:
+            logging.warning(f"Ignoring unreadable resume manifest {self.key}")
+            return None
+
+    def start(self, fingerprint, previous=None):
+        """
+        Begins tracking a run, continuing the previous manifest when it belongs
+        to the same job and that job did not finish.
+        """
+        with self.lock:
+            if previous is not None and previous.get("fingerprint") == fingerprint and previous.get("status") != "success":
+                self.state = dict(previous)
+            else:
+                self.state = {"fingerprint": fingerprint, "checkpoint": None, "step": 0, "optimizer": None, "optimizer_step": None, "captions": {}}
+            self.state.update(status="running", attempts=self.state.get("attempts", 0) + 1)
+            self._save()
+
+    def update(self, **fields):
+        with self.lock:
+            self.state.update(fields)
+            self._save()
+
+    def record_upload(self, name):
+        """
+        Records an uploaded checkpoint or step-suffixed optimizer state file.
+        Only newer steps replace the recorded ones, since uploads finish out
+        of order.
+        """
+        with self.lock:
+            step = checkpoint_step(name)
+            state_step = optimizer_step(name)
+            if state_step is not None:
+                if state_step <= (self.state.get("optimizer_step") or 0):
+                    return
+                self.state.update(optimizer=name, optimizer_step=state_step)
+            elif step is not None and step > self.state["step"]:
+                self.state.update(checkpoint=name, step=step)
+            else:
+                return
+            self._save()
+
+    def _save(self):
+        self.state["updated"] = time.time()
+        self.client.put_object(
+            Bucket=self.r2["bucket_name"],
+            Key=self.key,
+            Body=json.dumps(self.state).encode(),
+            ContentType="application/json"
+        )
+
+    def restore(self, dst_dir):
+        """
+        Downloads the recorded checkpoint into dst_dir, the folder ai-toolkit
+        resumes from, with the optimizer state saved at the same step as
+        optimizer.pt. Optimizer state from another step is left out; ai-toolkit
+        then starts a fresh optimizer. Returns the restored file names. If a
+        download fails, the files restored so far are removed before the error
+        is raised, so ai-toolkit never resumes from half a restore.
+        """
+        os.makedirs(dst_dir, exist_ok=True)
+        files = [(self.state.get("checkpoint"), self.state.get("checkpoint"))]
+        if self.state.get("optimizer") and self.state.get("optimizer_step") == self.state["step"]:
+            files.append((self.state["optimizer"], OPTIMIZER_NAME))
+        elif self.state.get("optimizer"):
+            logging.warning(
+                f"Not restoring optimizer state from step {self.state.get('optimizer_step')}: "
+                f"checkpoint is from step {self.state['step']}"
+            )
+        restored = []
+        try:
+            for name, local_name in files:
+                if not name:
+                    continue
+                tmp_path = os.path.join(dst_dir, f".{local_name}.part")
+                self.client.download_file(self.r2["bucket_name"], f"{self.prefix}/{name}", tmp_path)
+                os.replace(tmp_path, os.path.join(dst_dir, local_name))
+                restored.append(local_name)
+        except Exception:
+            for local_name in restored + [f".{local_name}.part" for _, local_name in files if local_name]:
+                try:
+                    os.remove(os.path.join(dst_dir, local_name))
+                except FileNotFoundError:
+                    pass
+            raise
+        return restored
+
+    def reset(self):
+        """
+        Forgets the recorded checkpoint and optimizer state, so the job trains
+        from scratch; used when they cannot be restored.
+        """
+        self.update(checkpoint=None, step=0, optimizer=None, optimizer_step=None)
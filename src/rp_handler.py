@@ -1,55 +1,253 @@
-import torch
-import runpod
-from runpod.serverless.utils import rp_upload, rp_cleanup
-from runpod.serverless.utils.rp_validator import validate
-from rp_schemas import INPUT_SCHEMA
-from main import lora_train 
+from startup import StartupTimer
 
-torch.cuda.empty_cache()
+# Started first so the report covers this module's own imports
+STARTUP = StartupTimer()
+
+import os
+import asyncio
+import logging
+import threading
+from rp_schemas import INPUT_SCHEMA, BATCH_INPUT_SCHEMA
+from batch import run_batch
+from progress import ProgressReporter
+from warm_worker import WarmTrainer
+
+# The job path (main: boto3, requests, yaml, numpy, PIL) and the runpod SDK,
+# which imports boto3 itself, are imported by the prewarm thread while the
+# worker registers, not here. torch is never needed
+# in this process: training runs in run.py or the warm worker's child.
+STARTUP.mark("handler_imported")
 
 # ------------------------------- Model Handler ------------------------------ #
 class ModelHandler:
     def __init__(self):
+        self.trainer = None
         self.load_models()
 
     def load_models(self):
-        pass  # Since your generate_image function downloads models, this is not needed
+        # Without WARM_WORKER every job starts its own run.py and loads the model itself
+        if os.environ.get("WARM_WORKER", "0") != "1":
+            return
+        model_config = {
+            "name_or_path": "black-forest-labs/FLUX.1-dev",
+            "is_flux": True,
+            "quantize": os.environ.get("WARM_WORKER_QUANTIZE", "0") == "1"
+        }
+        try:
+            self.trainer = WarmTrainer(model_config).start()
+        except Exception as e:
+            logging.error(f"Warm worker unavailable, falling back to per-job trainer: {e}")
+            self.trainer = None
 
-MODELS = ModelHandler()
+# Created when the worker starts; the warm trainer's spawned child re-imports
+# this module and must not start a second worker or trainer
+MODELS = None
+
+# Jobs accepted at once; above 1, jobs run through the staged pipeline
+PIPELINE_JOBS = int(os.environ.get("PIPELINE_JOBS", "1"))
+PIPELINE = None
+PIPELINE_LOCK = threading.Lock()
 
 # ---------------------------------- Helper ---------------------------------- #
-@torch.inference_mode()
-def train_handler(job):
+def validate(job_input, schema):
     '''
-    Handler for Lora training job
+    runpod's input validator. The runpod package imports boto3, requests and
+    yaml, so it is loaded by the prewarm thread or the first job, not here.
+    '''
+    from runpod.serverless.utils import rp_validator
+    return rp_validator.validate(job_input, schema)
+
+
+def send_progress(job, update):
+    '''
+    Publishes a progress update for the job; local_runner replaces this to run jobs outside runpod
+    '''
+    import runpod
+    runpod.serverless.progress_update(job, update)
+
+
+def lora_kwargs(job, job_input=None, progress_fields=None):
+    '''
+    Validates the job input and returns the lora_train arguments, or an error response
     '''
-    job_input = job["input"]
+    job_input = job["input"] if job_input is None else job_input
     
     # Input validation
     validated_input = validate(job_input, INPUT_SCHEMA)
     if 'errors' in validated_input:
-        return {"error": validated_input['errors']}
+        return None, {"error": validated_input['errors']}
     
     job_input = validated_input['validated_input']
-    
-    # Call your lora_train function with the validated parameters
-    result = lora_train(
-        image_urls=job_input['image_urls'],
-        trigger_word=job_input['trigger_word'],
-        model_id=job_input['model_id'],
-        caption_dropout_rate=job_input['caption_dropout_rate'],
-        batch_size=job_input['batch_size'],
-        steps=job_input['steps'],
-        optimizer=job_input['optimizer'],
-        lr=job_input['lr'],
-        quantize=job_input['quantize'],
-        r2_bucket_name=job_input['r2_bucket_name'],
-        r2_access_key_id=job_input['r2_access_key_id'],
-        r2_secret_access_key=job_input['r2_secret_access_key'],
-        r2_endpoint_url=job_input['r2_endpoint_url'],
-        r2_path_in_bucket=job_input['r2_path_in_bucket']
+
+    # Push throttled step/loss/ETA updates to callers polling the job
+    progress = ProgressReporter(
+        lambda update: send_progress(job, {**(progress_fields or {}), **update})
     )
     
-    return result
+    return {
+        "image_urls": job_input['image_urls'],
+        "trigger_word": job_input['trigger_word'],
+        "model_id": job_input['model_id'],
+        "caption_dropout_rate": job_input['caption_dropout_rate'],
+        "batch_size": job_input['batch_size'],
+        "steps": job_input['steps'],
+        "optimizer": job_input['optimizer'],
+        "lr": job_input['lr'],
+        "quantize": job_input['quantize'],
+        "r2_bucket_name": job_input['r2_bucket_name'],
+        "r2_access_key_id": job_input['r2_access_key_id'],
+        "r2_secret_access_key": job_input['r2_secret_access_key'],
+        "r2_endpoint_url": job_input['r2_endpoint_url'],
+        "r2_path_in_bucket": job_input['r2_path_in_bucket'],
+        "use_latent_cache": job_input['use_latent_cache'],
+        "cache_text_embeddings": job_input['cache_text_embeddings'],
+        "remove_duplicates": job_input['remove_duplicates'],
+        "captions": job_input['captions'],
+        "auto_caption": job_input['auto_caption'],
+        "preset": job_input['preset'],
+        "dry_run": job_input['dry_run'],
+        "compact_dtype": job_input['compact_dtype'],
+        "compact_rank": job_input['compact_rank'],
+        "compact_energy": job_input['compact_energy'],
+        "progress": progress,
+        "trainer": MODELS.trainer if MODELS is not None else None
+    }, None
+
+
+def batch_train_handler(job):
+    '''
+    Handler for a batch of Lora training jobs run back to back on this worker.
+    Items share the image and latent caches and the warm trainer; a failing
+    item does not stop the rest of the batch.
+    '''
+    validated_input = validate(job["input"], BATCH_INPUT_SCHEMA)
+    if 'errors' in validated_input:
+        return {"error": validated_input['errors']}
+    batch_input = validated_input['validated_input']
+
+    items = []
+    for index, spec in enumerate(batch_input['jobs']):
+        if not isinstance(spec, dict):
+            items.append((None, f"job {index} is not an object"))
+            continue
+        kwargs, error = lora_kwargs(
+            job,
+            {**batch_input['defaults'], **spec},
+            progress_fields={"item": index, "items": len(batch_input['jobs'])}
+        )
+        items.append((kwargs, error["error"] if error else None))
+
+    from main import run_job, job_result
+    return run_batch(items, lambda index, kwargs: plan_job(kwargs) or job_result(run_job(**kwargs)))
+
+
+def plan_job(kwargs):
+    '''
+    Estimates the job's runtime, memory and disk use. Returns the response
+    for jobs that must not train: the estimate for a dry run, an error for
+    jobs that exceed the worker's limits. Returns None otherwise.
+    '''
+    from main import estimate_job
+    dry_run = kwargs.pop("dry_run")
+    estimate, exceeded = estimate_job(**kwargs)
+    if dry_run:
+        return {"status": "dry_run", "estimate": estimate, "exceeded_limits": exceeded}
+    if exceeded:
+        logging.error(f"Job exceeds worker limits: {exceeded}")
+        return {"status": "failed", "error": {"stage": "estimate", "exceeded_limits": exceeded}, "estimate": estimate}
+    return None
+
+
+def get_pipeline():
+    global PIPELINE
+    with PIPELINE_LOCK:
+        if PIPELINE is None:
+            from main import create_pipeline
+            PIPELINE = create_pipeline(queue_size=PIPELINE_JOBS - 1)
+        return PIPELINE
+
+
+def train_handler(job):
+    '''
+    Handler for Lora training job
+    '''
+    if "jobs" in job["input"]:
+        return batch_train_handler(job)
+
+    kwargs, error = lora_kwargs(job)
+    if error is not None:
+        return error
+    
+    from main import run_job, job_result
+    from workspace import InsufficientSpaceError
+
+    # Run the Lora training job with the validated parameters
+    try:
+        response = plan_job(kwargs)
+        if response is not None:
+            return response
+        job_state = run_job(**kwargs)
+    except (InsufficientSpaceError, ValueError) as e:
+        logging.error(str(e))
+        return {"status": "failed", "error": str(e)}
+    
+    return job_result(job_state)
+
+
+async def pipelined_train_handler(job):
+    '''
+    Handler for Lora training job when several jobs share the staged pipeline
+    '''
+    if "jobs" in job["input"]:
+        return await asyncio.to_thread(batch_train_handler, job)
+
+    kwargs, error = lora_kwargs(job)
+    if error is not None:
+        return error
+
+    try:
+        from main import create_job, job_result
+        response = plan_job(kwargs)
+        if response is not None:
+            return response
+        pipeline = await asyncio.to_thread(get_pipeline)
+        # submit blocks while the first stage is full, so keep it off the event loop
+        future = await asyncio.to_thread(pipeline.submit, create_job(**kwargs))
+        state = await asyncio.wrap_future(future)
+        logging.info(f"Stage timings: {state['stage_timings']}")
+        return job_result(state)
+    except Exception as e:
+        logging.error(f"Pipelined job failed: {e}")
+        return {"status": "failed", "error": str(e)}
+
+
+def sweep_scratch():
+    '''
+    Removes workspaces left behind by a previous worker and trims the latent
+    cache to its size and age limits.
+    '''
+    from workspace import get_workspace_manager
+    from latent_cache import LatentCache
+    try:
+        freed = get_workspace_manager().sweep()
+        LatentCache().prune()
+        logging.info(f"Startup sweep freed {freed} bytes of orphaned workspaces")
+    except OSError as e:
+        logging.error(f"Startup sweep failed: {e}")
+
 
-runpod.serverless.start({"handler": train_handler})
\ No newline at end of file
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    STARTUP.prewarm()
+    threading.Thread(target=sweep_scratch, name="sweep", daemon=True).start()
+    MODELS = ModelHandler()
+    STARTUP.mark("models_loaded")
+    import runpod
+    STARTUP.mark("runpod_imported")
+    if PIPELINE_JOBS > 1:
+        runpod.serverless.start({
+            "handler": pipelined_train_handler,
+            "concurrency_modifier": lambda current_concurrency: PIPELINE_JOBS
+        })
+    else:
+        runpod.serverless.start({"handler": train_handler})
@@ -1,3 +1,8 @@
+from training_config import DTYPE_BYTES, PRESETS
+
+# runpod's validator skips the type check and the constraints of a value with
+# the same type as its default, so optional fields with constraints default
+# to None; create_job treats None as the documented default.
 INPUT_SCHEMA = {
     'image_urls': {
         'type': list,
@@ -76,4 +81,86 @@ INPUT_SCHEMA = {
         'required': False,
         'default': "Loras"
     },
-}
\ No newline at end of file
+    'use_latent_cache': {
+        'type': bool,
+        'required': False,
+        'default': True,
+        # 'description': 'Reuse VAE latents cached by earlier jobs on the same images'
+    },
+    'cache_text_embeddings': {
+        'type': bool,
+        'required': False,
+        'default': False,
+        # 'description': 'Pre-encode prompts and unload the text encoders before training; embeddings are cached across jobs only on warm workers'
+    },
+    'remove_duplicates': {
+        'type': bool,
+        'required': False,
+        'default': True,
+        # 'description': 'Drop duplicate and near-duplicate images (False only reports them)'
+    },
+    'captions': {
+        'type': list,
+        'required': False,
+        'default': [],
+        # 'description': 'Caption per image, in image_urls order; the trigger word is added when missing'
+    },
+    'preset': {
+        'type': str,
+        'required': False,
+        'default': None,
+        'constraints': lambda preset: preset in PRESETS,
+        # 'description': 'Performance preset: default, fast, low_vram or quality (default: default)'
+    },
+    'dry_run': {
+        'type': bool,
+        'required': False,
+        'default': False,
+        # 'description': 'Return the runtime/memory/disk estimate without training'
+    },
+    'auto_caption': {
+        'type': bool,
+        'required': False,
+        'default': False,
+        # 'description': 'Caption images without a supplied caption with the captioning model'
+    },
+    'compact_dtype': {
+        'type': str,
+        'required': False,
+        'default': None,
+        'constraints': lambda dtype: dtype in DTYPE_BYTES,
+        # 'description': 'dtype of the uploaded final LoRA: float16, bf16 or float32 (default: the worker's COMPACT_DTYPE)'
+    },
+    'compact_rank': {
+        'type': int,
+        'required': False,
+        'default': None,
+        'constraints': lambda rank: rank >= 0,
+        # 'description': 'Reduce the final LoRA to at most this rank by SVD (0, the default, keeps the trained rank)'
+    },
+    'compact_energy': {
+        'type': float,
+        'required': False,
+        'default': None,
+        'constraints': lambda energy: 0 < energy <= 1,
+        # 'description': 'Keep the smallest rank holding this fraction of each layer update (1.0, the default, keeps all)'
+    },
+}
+
+# Batch jobs: several training specs run back to back on one worker.
+# Each entry of 'jobs' is validated against INPUT_SCHEMA after merging it
+# over 'defaults', so shared fields such as R2 credentials are given once.
+BATCH_INPUT_SCHEMA = {
+    'jobs': {
+        'type': list,
+        'required': True,
+        'constraints': lambda jobs: len(jobs) > 0,
+        # 'description': 'List of training specs, each shaped like INPUT_SCHEMA'
+    },
+    'defaults': {
+        'type': dict,
+        'required': False,
+        'default': {},
+        # 'description': 'Fields shared by every job in the batch'
+    },
+}
@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+# Append every job's metrics as one JSON line to this file when set
+METRICS_JSONL = os.environ.get("METRICS_JSONL")
+# Seconds between the RSS samples a job's peak memory is taken from
+RSS_SAMPLE_INTERVAL = float(os.environ.get("RSS_SAMPLE_INTERVAL", 0.5))
+
+
+def _rss_mb(pid="self"):
+    # Current resident set size from /proc, falling back to the peak on other platforms
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError):
+        if pid != "self":
+            return 0.0  # exited meanwhile
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _descendants(pid):
+    """
+    Pids of all live descendants of pid, from /proc/<pid>/task/*/children.
+    """
+    pids = []
+    try:
+        tasks = os.listdir(f"/proc/{pid}/task")
+    except OSError:
+        return pids
+    for task in tasks:
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children = [int(child) for child in f.read().split()]
+        except (OSError, ValueError):
+            continue
+        for child in children:
+            pids.append(child)
+            pids.extend(_descendants(child))
+    return pids
+
+
+class RssSampler:
+    """
+    Samples the RSS of this process and the total RSS of its descendants
+    (the trainer) on a daemon thread and keeps the peaks, so a job reports
+    the memory used while it ran rather than the process's lifetime maximum.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self.peak_children_mb = 0.0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def start(self):
+        self.sample()
+        self.thread.start()
+        return self
+
+    def sample(self):
+        self.peak_mb = max(self.peak_mb, _rss_mb())
+        children = sum(_rss_mb(pid) for pid in _descendants(os.getpid()))
+        self.peak_children_mb = max(self.peak_children_mb, children)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        if not self.stopped.is_set():
+            self.stopped.set()
+            self.sample()
+
+
+def folder_bytes(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class JobMetrics:
+    """
+    Per-job timing and resource telemetry, recorded as a flat list of spans.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.started = time.time()
+        self.spans = []
+        # Job inputs the spans depend on, for fitting the cost model
+        self.features = {}
+        self.lock = threading.Lock()
+        self.rss = RssSampler().start()
+
+    def stop(self):
+        """
+        Ends RSS sampling once the job is finished.
+        """
+        self.rss.stop()
+
+    @contextmanager
+    def span(self, name, folder=None, **fields):
+        """
+        Times the enclosed block. The yielded dict can be updated with counters
+        such as bytes or items; with folder set, the folder's disk usage is
+        recorded when the span ends.
+        """
+        record = {"name": name, **fields}
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            record["rss_mb"] = round(_rss_mb(), 1)
+            if folder is not None and os.path.isdir(folder):
+                record["disk_bytes"] = folder_bytes(folder)
+            with self.lock:
+                self.spans.append(record)
+
+    def to_dict(self):
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        with self.lock:
+            spans = [dict(span) for span in self.spans]
+        return {
+            "job_id": self.job_id,
+            "started": self.started,
+            "seconds": time.time() - self.started,
+            # Sampled while the job ran; jobs pipelined on the worker share the process
+            "peak_rss_mb": round(self.rss.peak_mb, 1),
+            "peak_child_rss_mb": round(self.rss.peak_children_mb, 1),
+            # ru_maxrss is in KiB on Linux and covers the worker's lifetime
+            "process_peak_rss_mb": round(self_usage.ru_maxrss / 1024, 1),
+            "process_peak_child_rss_mb": round(child_usage.ru_maxrss / 1024, 1),
+            "features": dict(self.features),
+            "spans": spans,
+        }
+
+    def write_jsonl(self, path=METRICS_JSONL):
+        if not path:
+            return
+        line = json.dumps(self.to_dict())
+        with open(path, 'a') as f:
+            f.write(line + "\n")
+
+
+@contextmanager
+def span(metrics, name, folder=None, **fields):
+    """
+    metrics.span(...) that also works when metrics is None.
+    """
+    if metrics is None:
+        yield dict(fields)
+        return
+    with metrics.span(name, folder=folder, **fields) as record:
+        yield record
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def summarize(path):
+    """
+    Aggregates a metrics JSONL file into count/p50/p95/max seconds per span name.
+    """
+    durations = {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for record in json.loads(line)["spans"]:
+                durations.setdefault(record["name"], []).append(record["seconds"])
+    return {
+        name: {
+            "count": len(values),
+            "p50": _percentile(values, 50),
+            "p95": _percentile(values, 95),
+            "max": max(values),
+        }
+        for name, values in sorted(durations.items())
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(summarize(sys.argv[1] if len(sys.argv) > 1 else METRICS_JSONL), indent=2))
@@ -1,107 +1,43 @@
 # @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@
 # @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@
-import subprocess
 import os
-import yaml
 import sys # Import sys to get the executable path
 import logging # Assuming you have logging configured as in lora_train
+from trainer_process import run_streaming
+from telemetry import span
+from training_config import build_config, to_yaml
 
 # Configure logging if not already done globally
 # logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def fine_tune_function(params, temp_folder_path):
+def fine_tune_function(params, temp_folder_path, on_progress=None, trainer=None, metrics=None):
     """
-    Creates a config.yaml from parameters and runs the training script
+    Creates a config.yaml from parameters and runs the training script.
+    on_progress, if given, is called with each parsed trainer progress event.
+    trainer, if given, is a WarmTrainer that runs the job with the base model
+    already loaded instead of spawning run.py.
+    metrics, if given, is a JobMetrics that records config and trainer spans.
     """
     # Ensure the temporary folder exists
     os.makedirs(temp_folder_path, exist_ok=True)
 
-    # --- [Your config dictionary creation remains the same] ---
-    config = {
-        "job": "extension",
-        "config": {
-            "name": params["trigger_word"],
-            "process": [{
-                "type": "sd_trainer",
-                "training_folder": params["training_folder"],
-                "device": "cuda:0",
-                "trigger_word": params["trigger_word"],
-                "network": {
-                    "type": "lora",
-                    "linear": 512,
-                    "linear_alpha": 512,
-                    "dropout": 0.25,
-                    "network_kwargs": {
-                        "only_if_contains": [
-                            "transformer.single_transformer_blocks.5.proj_out",
-                            "transformer.single_transformer_blocks.8.proj_out",
-                            "transformer.single_transformer_blocks.9.proj_out",
-                            "transformer.single_transformer_blocks.10.proj_out"
-                        ]
-                    }
-                },
-                "save": {
-                    "dtype": "float32",
-                    "save_every": None,
-                    "max_step_saves_to_keep": None,
-                    "push_to_hub": False
-                },
-                "datasets": [{
-                    "folder_path": params["datasets"][0]["folder_path"],
-                    "caption_ext": "txt",
-                    "caption_dropout_rate": params["datasets"][0]["caption_dropout_rate"],
-                    "token_dropout_rate": 0,
-                    "shuffle_tokens": False,
-                    "cache_latents_to_disk": True,
-                    "resolution": [512, 768, 1024]
-                }],
-                "train": {
-                    "batch_size": params["train"]["batch_size"],
-                    "steps": params["train"]["steps"],
-                    "gradient_accumulation_steps": 1,
-                    "train_unet": True,
-                    "gradient_checkpointing": True,
-                    "noise_scheduler": "flowmatch",
-                    "optimizer": params["train"]["optimizer"],
-                    "lr": params["train"]["lr"],
-                    "linear_timesteps": True,
-                    "ema_config": {
-                        "use_ema": True,
-                        "ema_decay": 0.99
-                    },
-                    "dtype": "bf16"
-                },
-                "model": {
-                    "name_or_path": "black-forest-labs/FLUX.1-dev",              
-                    "is_flux": True,
-                    "quantize": params["model"]["quantize"]
-                },
-                "sample": {
-                    "sampler": "flowmatch",
-                    "sample_every": None,
-                    "width": 1024,
-                    "height": 1024,
-                    "prompts": ["a man holding a sign that says, 'this is a sign'"],
-                    "neg": "",
-                    "seed": 42,
-                    "walk_seed": True,
-                    "guidance_scale": 4,
-                    "sample_steps": 1
-                }
-            }]
-        },
-        "meta": {
-            "name": "[name]",
-            "version": "1.0"
-        }
-    }
-    # --- [End of config dictionary] ---
+    # params is the process built by training_config.build_process
+    config = build_config(params)
 
     # Save the config file
     config_path_absolute = os.path.join(temp_folder_path, "config.yaml")
     logging.info(f"Saving config to: {config_path_absolute}")
-    with open(config_path_absolute, 'w') as f:
-        yaml.safe_dump(config, f, sort_keys=False)
+    with span(metrics, "config_write"), open(config_path_absolute, 'w') as f:
+        f.write(to_yaml(config))
+
+    if trainer is not None:
+        logging.info("Running job on warm trainer")
+        try:
+            with span(metrics, "training", folder=temp_folder_path, warm=True):
+                return trainer.train(config_path_absolute, on_progress=on_progress)
+        except Exception as e:
+            logging.error(f"Warm trainer failed: {e}")
+            return "failed"
 
     # Determine the ai-toolkit directory path relative to the *current script's location*
     # This might be more robust depending on how your project is structured/deployed
@@ -141,30 +77,25 @@ def fine_tune_function(params, temp_folder_path):
 
     status = "failed" # Default status
     try:
-        # Run the command specifying the working directory (cwd)
-        result = subprocess.run(
-            cmd_list,
-            check=True,           # Raise CalledProcessError on non-zero exit
-            capture_output=True,  # Capture stdout and stderr
-            text=True,            # Decode stdout/stderr as text
-            cwd=toolkit_dir       # Set the working directory for the subprocess
-        )
-        logging.info("Subprocess stdout:")
-        logging.info(result.stdout)
-        logging.info("Subprocess stderr:")
-        logging.info(result.stderr) # Log stderr even on success, might contain warnings
-        status = "success" # Set status to success if check=True passes
+        # Stream the trainer's output while it runs instead of buffering it until exit
+        with span(metrics, "training", folder=temp_folder_path, warm=False) as record:
+            result = run_streaming(cmd_list, cwd=toolkit_dir, on_progress=on_progress)
+            record["exit_code"] = result.returncode
+            if result.last_progress is not None:
+                record["steps"] = result.last_progress["step"]
+        if result.returncode == 0:
+            status = "success"
+        else:
+            logging.error(f"Subprocess failed with exit code {result.returncode}")
+            logging.error(f"Command executed: {' '.join(cmd_list)}")
+            logging.error("Last lines of subprocess stdout:")
+            logging.error("\n".join(result.stdout_tail))
+            logging.error("Last lines of subprocess stderr:")
+            logging.error("\n".join(result.stderr_tail)) # *** This is crucial for debugging exit code 127 ***
+            status = "failed"
 
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Subprocess failed with exit code {e.returncode}")
-        logging.error(f"Command executed: {' '.join(e.cmd)}")
-        logging.error("Subprocess stdout:")
-        logging.error(e.stdout)
-        logging.error("Subprocess stderr:")
-        logging.error(e.stderr) # *** This is crucial for debugging exit code 127 ***
-        status = "failed"
     except FileNotFoundError as e:
-        # This happens if python_executable or run.py itself wasn't found by subprocess.run
+        # This happens if python_executable or run.py itself wasn't found by Popen
         logging.error(f"FileNotFoundError during subprocess execution: {e}")
         logging.error(f"Attempted to run: {cmd_list}")
         logging.error(f"Working directory: {toolkit_dir}")
@@ -0,0 +1,121 @@
+import os
+import re
+import time
+import logging
+import threading
+import subprocess
+from collections import deque
+
+# Lines of each stream kept in memory for error reports
+DEFAULT_TAIL_LINES = 200
+# tqdm redraws its bar many times a second; only log it this often
+PROGRESS_LOG_INTERVAL = 30.0  # seconds
+
+# ai-toolkit progress bar, e.g.
+# "my_lora:  12%|#2   | 250/2000 [05:12<36:12,  1.24s/it, lr: 1.0e-04 loss: 4.123e-01]"
+LABEL_PATTERN = re.compile(r'^\s*(.*?):?\s*\d+%\|')
+STEP_PATTERN = re.compile(r'(\d+)/(\d+)\s*\[')
+RATE_PATTERN = re.compile(r'([\d.]+)\s*(it/s|s/it)')
+LOSS_PATTERN = re.compile(r'loss:\s*([-+\d.eE]+)')
+
+
+def parse_progress_line(line):
+    """
+    Parses a trainer progress line into a dict with label, step, total_steps,
+    it_per_sec and loss. Returns None for lines that are not progress.
+    """
+    step_match = STEP_PATTERN.search(line)
+    if step_match is None:
+        return None
+    label_match = LABEL_PATTERN.search(line)
+    event = {
+        "label": label_match.group(1) if label_match else "",
+        "step": int(step_match.group(1)),
+        "total_steps": int(step_match.group(2)),
+        "it_per_sec": None,
+        "loss": None,
+    }
+    rate_match = RATE_PATTERN.search(line, step_match.end())
+    if rate_match is not None:
+        rate = float(rate_match.group(1))
+        if rate_match.group(2) == 's/it':
+            rate = 1.0 / rate if rate else None
+        event["it_per_sec"] = rate
+    loss_match = LOSS_PATTERN.search(line)
+    if loss_match is not None:
+        try:
+            event["loss"] = float(loss_match.group(1))
+        except ValueError:
+            pass
+    return event
+
+
+class StreamingResult:
+    def __init__(self, returncode, stdout_tail, stderr_tail, last_progress):
+        self.returncode = returncode
+        self.stdout_tail = stdout_tail
+        self.stderr_tail = stderr_tail
+        self.last_progress = last_progress
+
+
+def run_streaming(cmd_list, cwd=None, env=None, on_progress=None, tail_lines=DEFAULT_TAIL_LINES):
+    """
+    Runs cmd_list and forwards stdout/stderr to logging line by line as the
+    process produces them. Progress lines are parsed and passed to on_progress.
+    Returns a StreamingResult with the exit code and the last lines of each stream.
+    """
+    env = dict(os.environ if env is None else env)
+    env.setdefault("PYTHONUNBUFFERED", "1")
+
+    process = subprocess.Popen(
+        cmd_list,
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,        # Universal newlines also split tqdm's '\r' redraws into lines
+        errors='replace',
+        bufsize=1
+    )
+
+    tails = {"stdout": deque(maxlen=tail_lines), "stderr": deque(maxlen=tail_lines)}
+    state = {"last_progress": None, "last_logged": 0.0}
+    lock = threading.Lock()
+
+    def pump(stream, name):
+        for raw_line in stream:
+            line = raw_line.rstrip()
+            if not line:
+                continue
+            event = parse_progress_line(line)
+            with lock:
+                tails[name].append(line)
+                if event is not None:
+                    state["last_progress"] = event
+                    now = time.monotonic()
+                    should_log = now - state["last_logged"] >= PROGRESS_LOG_INTERVAL or event["step"] == event["total_steps"]
+                    if should_log:
+                        state["last_logged"] = now
+            if event is None:
+                logging.info(f"[trainer {name}] {line}")
+                continue
+            if should_log:
+                logging.info(f"[trainer {name}] {line}")
+            if on_progress is not None:
+                try:
+                    on_progress(event)
+                except Exception as e:
+                    logging.error(f"Progress callback failed: {e}")
+        stream.close()
+
+    readers = [
+        threading.Thread(target=pump, args=(process.stdout, "stdout"), daemon=True),
+        threading.Thread(target=pump, args=(process.stderr, "stderr"), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    returncode = process.wait()
+    for reader in readers:
+        reader.join()
+
+    return StreamingResult(returncode, list(tails["stdout"]), list(tails["stderr"]), state["last_progress"])
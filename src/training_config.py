@@ -0,0 +1,209 @@
+import sys
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+BASE_MODEL = "black-forest-labs/FLUX.1-dev"
+SAMPLE_PROMPTS = ["a man holding a sign that says, 'this is a sign'"]
+
+# LoRA size: FLUX's linear layers add about 5.4M parameters per unit of rank;
+# a single named module is assumed to be a single block's proj_out (15360 -> 3072)
+FULL_LORA_PARAMETERS_PER_RANK = 5_400_000
+MODULE_LORA_PARAMETERS_PER_RANK = 15360 + 3072
+DTYPE_BYTES = {"float32": 4, "fp32": 4, "float16": 2, "fp16": 2, "bf16": 2, "bfloat16": 2}
+
+
+@dataclass(frozen=True)
+class Preset:
+    """
+    Performance profile: everything about a training run that is not a user
+    input. target_modules limits the LoRA to layers whose names contain one of
+    the entries; empty trains every linear layer.
+    """
+    name: str
+    rank: int
+    alpha: int
+    dropout: float = 0.0
+    target_modules: Tuple[str, ...] = ()
+    save_dtype: str = "float16"
+    quantize: bool = False
+    low_vram: bool = False
+    resolutions: Tuple[int, ...] = (512, 768, 1024)
+    gradient_checkpointing: bool = True
+    save_every: int = 250
+    max_step_saves_to_keep: int = 4
+    sample_every: Optional[int] = None
+    sample_steps: int = 1
+
+
+PRESETS = {
+    preset.name: preset for preset in (
+        # The configuration train.py hard-coded before presets existed
+        Preset(
+            name="default",
+            rank=512,
+            alpha=512,
+            dropout=0.25,
+            target_modules=(
+                "transformer.single_transformer_blocks.5.proj_out",
+                "transformer.single_transformer_blocks.8.proj_out",
+                "transformer.single_transformer_blocks.9.proj_out",
+                "transformer.single_transformer_blocks.10.proj_out",
+            ),
+            save_dtype="float32",
+        ),
+        # Small rank and low resolutions: shortest steps and smallest checkpoints
+        Preset(name="fast", rank=16, alpha=16, resolutions=(512, 768), save_every=500, max_step_saves_to_keep=2),
+        # 8-bit base model and a single low resolution bucket for 24 GB cards
+        Preset(name="low_vram", rank=16, alpha=16, quantize=True, low_vram=True, resolutions=(512,), max_step_saves_to_keep=2),
+        # Higher rank on every layer at all resolutions, with samples to review progress
+        Preset(name="quality", rank=32, alpha=32, save_dtype="bf16", sample_every=250, sample_steps=20),
+    )
+}
+
+
+@dataclass
+class TrainingSettings:
+    """
+    Per-job inputs, as validated by INPUT_SCHEMA.
+    """
+    trigger_word: str
+    steps: int = 2000
+    batch_size: int = 1
+    lr: float = 1e-4
+    optimizer: str = "adamw8bit"
+    caption_dropout_rate: float = 0.0
+    quantize: bool = False
+    unload_text_encoder: bool = False
+
+    def validate(self):
+        if self.steps <= 0:
+            raise ValueError(f"steps must be positive, got {self.steps}")
+        if self.batch_size <= 0:
+            raise ValueError(f"batch_size must be positive, got {self.batch_size}")
+        if not self.lr > 0:
+            raise ValueError(f"lr must be positive, got {self.lr}")
+        if not 0.0 <= self.caption_dropout_rate <= 1.0:
+            raise ValueError(f"caption_dropout_rate must be between 0 and 1, got {self.caption_dropout_rate}")
+
+
+def lora_parameters(network):
+    """
+    Approximate number of trainable LoRA parameters for a process's network section.
+    """
+    modules = network.get("network_kwargs", {}).get("only_if_contains")
+    per_rank = len(modules) * MODULE_LORA_PARAMETERS_PER_RANK if modules else FULL_LORA_PARAMETERS_PER_RANK
+    return network["linear"] * per_rank
+
+
+def get_preset(name):
+    try:
+        return PRESETS[name]
+    except KeyError:
+        raise ValueError(f"Unknown preset {name!r}, expected one of {sorted(PRESETS)}") from None
+
+
+def build_process(preset, settings, training_folder, dataset_folder):
+    """
+    Builds the ai-toolkit sd_trainer process for a preset and the job's settings.
+    The job's quantize input can turn quantization on but not off for presets
+    that need it.
+    """
+    settings.validate()
+    network = {"type": "lora", "linear": preset.rank, "linear_alpha": preset.alpha}
+    if preset.dropout:
+        network["dropout"] = preset.dropout
+    if preset.target_modules:
+        network["network_kwargs"] = {"only_if_contains": list(preset.target_modules)}
+
+    model = {"name_or_path": BASE_MODEL, "is_flux": True, "quantize": preset.quantize or settings.quantize}
+    if preset.low_vram:
+        model["low_vram"] = True
+
+    return {
+        "type": "sd_trainer",
+        "training_folder": training_folder,
+        "device": "cuda:0",
+        "trigger_word": settings.trigger_word,
+        "network": network,
+        "save": {
+            "dtype": preset.save_dtype,
+            "save_every": preset.save_every,
+            "max_step_saves_to_keep": preset.max_step_saves_to_keep,
+            "push_to_hub": False
+        },
+        "datasets": [{
+            "folder_path": dataset_folder,
+            "caption_ext": "txt",
+            "caption_dropout_rate": settings.caption_dropout_rate,
+            "token_dropout_rate": 0,
+            "shuffle_tokens": False,
+            "cache_latents_to_disk": True,
+            "resolution": list(preset.resolutions)
+        }],
+        "train": {
+            "batch_size": settings.batch_size,
+            "steps": settings.steps,
+            "gradient_accumulation_steps": 1,
+            "train_unet": True,
+            "gradient_checkpointing": preset.gradient_checkpointing,
+            "noise_scheduler": "flowmatch",
+            "optimizer": settings.optimizer,
+            "lr": settings.lr,
+            "linear_timesteps": True,
+            # Encode the trigger word/sample prompts once, then drop the text encoders
+            "unload_text_encoder": settings.unload_text_encoder,
+            "ema_config": {
+                "use_ema": True,
+                "ema_decay": 0.99
+            },
+            "dtype": "bf16"
+        },
+        "model": model,
+        "sample": {
+            "sampler": "flowmatch",
+            "sample_every": preset.sample_every,
+            "width": 1024,
+            "height": 1024,
+            "prompts": list(SAMPLE_PROMPTS),
+            "neg": "",
+            "seed": 42,
+            "walk_seed": True,
+            "guidance_scale": 4,
+            "sample_steps": preset.sample_steps
+        }
+    }
+
+
+def build_config(process):
+    """
+    Wraps a process in the ai-toolkit job config that run.py reads.
+    """
+    return {
+        "job": "extension",
+        "config": {
+            "name": process["trigger_word"],
+            "process": [process]
+        },
+        "meta": {
+            "name": "[name]",
+            "version": "1.0"
+        }
+    }
+
+
+def to_yaml(config):
+    import yaml
+    return yaml.safe_dump(config, sort_keys=False)
+
+
+def example_yaml(preset_name):
+    """
+    A preset's config YAML for default job settings and placeholder paths,
+    as compared against benchmarks/golden by benchmarks/check_configs.py.
+    """
+    process = build_process(get_preset(preset_name), TrainingSettings(trigger_word="[trigger]"), "/workspace/output", "/workspace/output/images")
+    return to_yaml(build_config(process))
+
+
+if __name__ == "__main__":
+    sys.stdout.write(example_yaml(sys.argv[1] if len(sys.argv) > 1 else "default"))
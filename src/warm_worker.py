@@ -0,0 +1,320 @@
+import io
+import os
+import sys
+import gc
+import logging
+import importlib
+import threading
+import multiprocessing
+from trainer_process import parse_progress_line
+from embedding_cache import EmbeddingCache
+
+# Backend used by the warm trainer, as "module:Class"
+DEFAULT_BACKEND = os.environ.get("WARM_WORKER_BACKEND", "warm_worker:ToolkitBackend")
+
+
+class TrainerBackend:
+    """
+    Interface for the model side of the warm trainer. load() runs once when the
+    worker starts, train() once per job and reset() after every job.
+    """
+
+    def load(self, model_config):
+        raise NotImplementedError
+
+    def train(self, config_path):
+        raise NotImplementedError
+
+    def reset(self):
+        pass
+
+
+def encoder_id(sd):
+    """
+    Embedding cache key for the text encoders of an ai-toolkit model: the
+    same encoder quantized or in another dtype produces different embeddings.
+    """
+    config = sd.model_config
+    quantize = bool(getattr(config, "quantize", False)), bool(getattr(config, "quantize_te", False))
+    return f"{config.name_or_path}|quantize={quantize[0]}|quantize_te={quantize[1]}|dtype={sd.torch_dtype}"
+
+
+def model_key(config):
+    """
+    What makes two loads of a base model interchangeable.
+    """
+    return (
+        config.name_or_path,
+        bool(getattr(config, "quantize", False)),
+        bool(getattr(config, "low_vram", False)),
+    )
+
+
+class ToolkitBackend(TrainerBackend):
+    """
+    Runs ai-toolkit jobs in-process. The first StableDiffusion.load_model() call
+    loads (and quantizes) the base model as usual; its results are kept and
+    handed to every later job with the same model config, so only the LoRA
+    network and optimizer are rebuilt per job. Only one base model is kept:
+    a job with another config (say quantize on a non-quantized worker) evicts
+    it first, since two FLUX copies do not fit on the GPU. Prompt encodings go
+    through an EmbeddingCache, so captions and sample prompts are encoded once
+    per worker.
+    """
+
+    def __init__(self, toolkit_dir=None):
+        self.toolkit_dir = toolkit_dir or os.path.join(os.getcwd(), "ai-toolkit")
+        self.model_state = {}
+        self.patched_forwards = []
+        self.embedding_cache = EmbeddingCache()
+
+    def load(self, model_config):
+        os.chdir(self.toolkit_dir)
+        sys.path.insert(0, self.toolkit_dir)
+        from toolkit.stable_diffusion_model import StableDiffusion
+        backend = self
+        original_load_model = StableDiffusion.load_model
+
+        def load_model(sd, *args, **kwargs):
+            key = model_key(sd.model_config)
+            cached = backend.model_state.get(key)
+            if cached is not None:
+                sd.__dict__.update(cached)
+                return
+            backend.evict()
+            before = dict(sd.__dict__)
+            original_load_model(sd, *args, **kwargs)
+            backend.model_state[key] = {k: v for k, v in sd.__dict__.items() if before.get(k) is not v}
+            backend._snapshot_modules()
+
+        StableDiffusion.load_model = load_model
+
+        original_encode_prompt = StableDiffusion.encode_prompt
+
+        def encode_prompt(sd, prompt, *args, **kwargs):
+            def to_device(value):
+                value = value.clone() if hasattr(value, "clone") else value
+                return value.to(sd.device_torch, dtype=sd.torch_dtype)
+
+            encode = backend.embedding_cache.cached(
+                encoder_id(sd),
+                lambda *a, **kw: original_encode_prompt(sd, *a, **kw),
+                to_device=to_device,
+                uncacheable=lambda p, a, kw: bool(kw.get("dropout_prob"))
+            )
+            return encode(prompt, *args, **kwargs)
+
+        StableDiffusion.encode_prompt = encode_prompt
+
+        # Load (and quantize) the base model now rather than on the first job
+        if model_config:
+            from toolkit.config_modules import ModelConfig
+            sd = StableDiffusion(device="cuda:0", model_config=ModelConfig(**model_config), dtype="bf16")
+            sd.load_model()
+
+    def _modules(self):
+        import torch
+        for state in self.model_state.values():
+            for value in state.values():
+                if isinstance(value, torch.nn.Module):
+                    yield from value.modules()
+
+    def _snapshot_modules(self):
+        # Modules whose forward is already overridden before any LoRA is applied
+        self.patched_forwards = [m for m in self._modules() if "forward" in m.__dict__]
+
+    def train(self, config_path):
+        from toolkit.job import get_job
+        job = get_job(config_path)
+        try:
+            job.run()
+        finally:
+            job.cleanup()
+
+    def evict(self):
+        """
+        Releases the resident base model and the VRAM it holds.
+        """
+        import torch
+        if not self.model_state:
+            return
+        logging.info(f"Evicting resident base model {list(self.model_state)}")
+        self.model_state.clear()
+        self.patched_forwards = []
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def reset(self):
+        import torch
+        # LoRA modules replace the forward of the layers they wrap; drop those
+        # overrides and any gradients so the next job starts from the bare model
+        keep = set(id(m) for m in self.patched_forwards)
+        for module in self._modules():
+            if "forward" in module.__dict__ and id(module) not in keep:
+                del module.forward
+            for param in module.parameters(recurse=False):
+                param.requires_grad_(False)
+                param.grad = None
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+class _ProgressStream(io.TextIOBase):
+    """
+    Write-through wrapper for the child's stdout/stderr that turns trainer
+    progress lines into events sent to the parent.
+    """
+
+    def __init__(self, stream, send):
+        self.stream = stream
+        self.send = send
+        self.buffer = ""
+
+    def write(self, text):
+        self.stream.write(text)
+        self.buffer += text.replace("\r", "\n")
+        *lines, self.buffer = self.buffer.split("\n")
+        for line in lines:
+            event = parse_progress_line(line)
+            if event is not None:
+                self.send({"event": "progress", **event})
+        return len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def load_backend(spec):
+    module_name, class_name = spec.split(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def _worker_main(conn, backend_spec, model_config):
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    try:
+        backend = load_backend(backend_spec)
+        backend.load(model_config)
+    except Exception as e:
+        send({"event": "error", "error": f"Failed to load base model: {e}"})
+        return
+    send({"event": "ready"})
+
+    sys.stdout = _ProgressStream(sys.stdout, send)
+    sys.stderr = _ProgressStream(sys.stderr, send)
+    while True:
+        message = conn.recv()
+        if message["cmd"] == "shutdown":
+            break
+        if message["cmd"] != "train":
+            send({"event": "error", "error": f"Unknown command: {message['cmd']}"})
+            continue
+        try:
+            backend.train(message["config_path"])
+            result = {"event": "done", "status": "success"}
+        except BaseException as e:
+            result = {"event": "done", "status": "failed", "error": f"{type(e).__name__}: {e}"}
+        try:
+            backend.reset()
+        except Exception as e:
+            result = {"event": "done", "status": result["status"], "error": f"Reset failed: {e}", "fatal": True}
+        send(result)
+        if result.get("fatal"):
+            break
+
+
+class WarmTrainer:
+    """
+    Long-lived child process that keeps the base model loaded between jobs.
+    Jobs are sent over a pipe and run one at a time; if the child dies it is
+    restarted (and the model reloaded) on the next job.
+    """
+
+    def __init__(self, model_config, backend=DEFAULT_BACKEND):
+        self.model_config = model_config
+        self.backend = backend
+        self.context = multiprocessing.get_context("spawn")  # CUDA cannot be forked
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the child and waits until the base model is loaded.
+        """
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_worker_main,
+            args=(child_conn, self.backend, self.model_config),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        message = self._recv()
+        if message is None or message["event"] != "ready":
+            error = message["error"] if message else "worker exited during startup"
+            self.stop()
+            raise RuntimeError(f"Warm trainer failed to start: {error}")
+        logging.info("Warm trainer ready, base model resident")
+        return self
+
+    def _recv(self):
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            return None
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def train(self, config_path, on_progress=None):
+        """
+        Runs one training job in the warm child. Returns "success" or "failed".
+        """
+        with self.lock:
+            if not self.is_alive():
+                self.start()
+            self.conn.send({"cmd": "train", "config_path": config_path})
+            while True:
+                message = self._recv()
+                if message is None:
+                    logging.error("Warm trainer exited during training")
+                    self.stop()
+                    return "failed"
+                if message["event"] == "progress":
+                    if on_progress is not None:
+                        event = dict(message)
+                        del event["event"]
+                        try:
+                            on_progress(event)
+                        except Exception as e:
+                            logging.error(f"Progress callback failed: {e}")
+                    continue
+                if message["event"] == "done":
+                    if message.get("error"):
+                        logging.error(f"Warm trainer job failed: {message['error']}")
+                    if message.get("fatal"):
+                        self.stop()
+                    return message["status"]
+                logging.error(f"Warm trainer error: {message.get('error')}")
+
+    def stop(self):
+        if self.conn is not None:
+            try:
+                self.conn.send({"cmd": "shutdown"})
+            except (OSError, ValueError):
+                pass
+            self.conn.close()
+            self.conn = None
+        if self.process is not None:
+            self.process.join(timeout=30)
+            if self.process.is_alive():
+                self.process.kill()
+            self.process = None
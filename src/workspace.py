@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+import threading
+from telemetry import folder_bytes
+from training_config import DTYPE_BYTES, lora_parameters
+
+# Per-job directories live here; point it at the worker's scratch volume
+DEFAULT_SCRATCH_DIR = os.environ.get("SCRATCH_DIR", os.path.join(os.getcwd(), "ai-toolkit", "output"))
+# Free space kept in reserve on top of a job's estimated footprint
+DEFAULT_MIN_FREE_BYTES = int(os.environ.get("WORKSPACE_MIN_FREE_BYTES", 2 * 1024 ** 3))
+MARKER_NAME = ".workspace.json"
+# Identifies this process in markers; pids alone repeat across container restarts
+OWNER = uuid.uuid4().hex
+
+# Rough per-item sizes for the footprint estimate
+IMAGE_BYTES = 4 * 1024 ** 2  # downloaded and preprocessed image
+LATENT_BYTES_PER_PIXEL = 16 * 4 / 64  # 16 fp32 latent channels per 8x8 pixels
+
+
+class InsufficientSpaceError(OSError):
+    pass
+
+
+def estimate_footprint(params, image_count):
+    """
+    Estimates a job's peak disk usage from its training parameters: images,
+    a latent per image and resolution bucket, and the checkpoints kept on
+    disk plus the final LoRA (with optimizer state, about 3x a checkpoint).
+    """
+    resolutions = params["datasets"][0]["resolution"]
+    latents = sum(LATENT_BYTES_PER_PIXEL * resolution ** 2 for resolution in resolutions)
+    checkpoint = lora_parameters(params["network"]) * DTYPE_BYTES.get(params["save"]["dtype"], 4)
+    kept = (params["save"].get("max_step_saves_to_keep") or 0) + 1
+    return int(image_count * (IMAGE_BYTES + latents) + kept * checkpoint + 3 * checkpoint)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Workspace:
+    """
+    A job's private directory. The marker file records the owning process so
+    workspaces left behind by a dead worker can be swept.
+    """
+
+    def __init__(self, root, job_id):
+        self.job_id = job_id
+        self.footprint = 0
+        # The suffix keeps two jobs with the same model_id apart
+        self.path = os.path.join(root, f"{job_id}-{uuid.uuid4().hex[:8]}")
+        self.created = time.time()
+        os.makedirs(self.path)
+        with open(os.path.join(self.path, MARKER_NAME), 'w') as f:
+            json.dump({"job_id": job_id, "pid": os.getpid(), "owner": OWNER, "created": self.created}, f)
+        self.released = False
+
+    def bytes_used(self):
+        return folder_bytes(self.path)
+
+
+class WorkspaceManager:
+    """
+    Allocates per-job workspaces under root after checking free space, and
+    removes them on release and when sweeping orphans at startup.
+    """
+
+    def __init__(self, root=DEFAULT_SCRATCH_DIR, min_free_bytes=DEFAULT_MIN_FREE_BYTES):
+        self.root = root
+        self.min_free_bytes = min_free_bytes
+        self.lock = threading.Lock()
+        # Space promised to live workspaces that they have not written yet
+        self.reserved = {}
+        os.makedirs(root, exist_ok=True)
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.root).free
+
+    def allocate(self, job_id):
+        workspace = Workspace(self.root, job_id)
+        with self.lock:
+            self.reserved[workspace.path] = workspace
+        return workspace
+
+    def reserve(self, workspace, footprint):
+        """
+        Checks that footprint bytes fit next to what other live workspaces are
+        still expected to write. Releases the workspace and raises
+        InsufficientSpaceError when they do not.
+        """
+        with self.lock:
+            free = self.free_bytes()
+            pending = sum(
+                max(0, ws.footprint - ws.bytes_used())
+                for path, ws in self.reserved.items() if path != workspace.path
+            )
+            needed = footprint + pending + self.min_free_bytes
+            if free >= needed:
+                workspace.footprint = footprint
+                return
+        self.release(workspace)
+        raise InsufficientSpaceError(
+            f"Not enough space in {self.root} for job {workspace.job_id}: "
+            f"{free} bytes free, {needed} bytes needed"
+        )
+
+    def release(self, workspace):
+        """
+        Removes the workspace and returns {path, bytes_used, footprint_estimate}.
+        Safe to call twice.
+        """
+        report = {"path": workspace.path, "bytes_used": 0, "footprint_estimate": workspace.footprint}
+        with self.lock:
+            self.reserved.pop(workspace.path, None)
+        if workspace.released:
+            return report
+        if os.path.isdir(workspace.path):
+            report["bytes_used"] = workspace.bytes_used()
+            shutil.rmtree(workspace.path, ignore_errors=True)
+        workspace.released = True
+        logging.info(f"Released workspace {workspace.path} ({report['bytes_used']} bytes used)")
+        return report
+
+    def sweep(self):
+        """
+        Removes workspaces whose owning process is gone, such as those of a
+        worker that crashed or was killed mid-job. Returns the bytes freed.
+        """
+        freed = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            marker = os.path.join(path, MARKER_NAME)
+            if not os.path.isfile(marker):
+                continue
+            try:
+                with open(marker) as f:
+                    owner = json.load(f)
+            except (OSError, ValueError):
+                owner = {}
+            if owner.get("owner") == OWNER:
+                continue
+            pid = owner.get("pid")
+            # A live pid that is not ours belongs to another worker sharing the volume
+            if isinstance(pid, int) and pid != os.getpid() and _pid_alive(pid):
+                continue
+            size = folder_bytes(path)
+            shutil.rmtree(path, ignore_errors=True)
+            freed += size
+            logging.info(f"Swept orphaned workspace {path} ({size} bytes)")
+        return freed
+
+
+_default_manager = None
+_default_manager_lock = threading.Lock()
+
+
+def get_workspace_manager():
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            _default_manager = WorkspaceManager()
+        return _default_manager